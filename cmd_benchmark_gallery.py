@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Use this script to benchmark lookups in the re-identification gallery, against a brute force search
+over the same stored faces. Each query is a stored face moved a set distance away in a random direction,
+for a range of distances up to the match threshold. The recall is the share of the queries for which the
+gallery finds the same face as the brute force search.
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from counter.gallery import SessionGallery
+from tools.logger import Logger
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--faces', type=int, default=10000, help="Number of faces to store in the gallery.")
+    parser.add_argument('-q', '--queries', type=int, default=500, help="Number of lookups to time.")
+    parser.add_argument('-t', '--threshold', type=float, default=0.4, help="The gallery match threshold.")
+    parser.add_argument('-d', '--distances', type=float, nargs="+", default=[0.1, 0.2, 0.3, 0.35, 0.39],
+                        help="The distances of the queries from their stored face.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    random_state = np.random.RandomState(0)
+
+    # Face embeddings are clustered in one part of the space, so build the fake faces the same way.
+    center = random_state.normal(size=128) * 0.1
+    faces = (center + random_state.normal(size=(args.faces, 128)) * 0.05).astype(np.float32)
+
+    gallery = SessionGallery(directory=tempfile.mkdtemp(), capacity=args.faces)
+    for i, face in enumerate(faces):
+        gallery.add(i, "{:032x}".format(i), face)
+    gallery.close()
+
+    stored = faces.astype(np.float16).astype(np.float32)
+    Logger.header("Gallery Benchmark ({} Faces)".format(args.faces))
+
+    for distance in args.distances:
+        # Query with a different sample of some of the stored faces, this far from the stored one.
+        query_ids = random_state.randint(0, args.faces, size=args.queries)
+        offsets = random_state.normal(size=(args.queries, 128))
+        offsets *= distance / np.linalg.norm(offsets, axis=1, keepdims=True)
+        queries = (faces[query_ids] + offsets).astype(np.float32)
+
+        start = time.perf_counter()
+        matches = [gallery.query(q, args.threshold) for q in queries]
+        gallery_ms = (time.perf_counter() - start) * 1000 / args.queries
+
+        start = time.perf_counter()
+        brute_matches = []
+        for q in queries:
+            distances = np.linalg.norm(stored - q, axis=1)
+            best = int(np.argmin(distances))
+            brute_matches.append(best if distances[best] < args.threshold else None)
+        brute_ms = (time.perf_counter() - start) * 1000 / args.queries
+
+        found = [(m, b) for m, b in zip(matches, brute_matches) if b is not None]
+        recall = np.mean([m is not None and m.session_id == b for m, b in found]) if len(found) > 0 else 0.0
+
+        Logger.field("Distance {:.2f}".format(distance),
+                     "Gallery: {:.3f} ms | Brute Force: {:.3f} ms | Recall: {:.1f}%".format(
+                         gallery_ms, brute_ms, recall * 100))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Use this script to benchmark the per-frame cost of matching face vectors to the live sessions.
+It compares the original (vector x session) Python loop, with the original per-vector session distance, to the
+vectorized distance matrix.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from counter import matching
+from counter.session import Session
+from tools.logger import Logger
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sessions', type=int, nargs="+", default=[1, 10, 50, 100, 200, 500],
+                        help="The live session counts to benchmark.")
+    parser.add_argument('-v', '--vectors', type=int, default=10, help="Number of face vectors per frame.")
+    parser.add_argument('-r', '--repeats', type=int, default=20, help="Number of frames to time.")
+    return parser.parse_args()
+
+
+def create_sessions(count: int):
+    """ The sessions, and the same vectors of each session in a list (which is how they were originally kept). """
+    sessions = []
+    session_vectors = []
+    for _ in range(count):
+        session = Session()
+        session.has_activated = True  # Skip the activation log.
+        vectors = [random_vector() for _ in range(Session.MAX_VECTOR_LENGTH)]
+        for vector in vectors:
+            session.add_vector(vector)
+        sessions.append(session)
+        session_vectors.append(vectors)
+    return sessions, session_vectors
+
+
+def random_vector():
+    vector = np.random.normal(size=128)
+    return vector / np.linalg.norm(vector)
+
+
+def loop_match(vectors, session_vectors, threshold: float):
+    """ The original matching loop from Counter.add_vectors_to_sessions, with the original Session.get_distance
+    (the summed distance to the first few vectors, one at a time) written out inline. """
+    pairs = []
+    for i, v in enumerate(vectors):
+        for j, stored_vectors in enumerate(session_vectors):
+            d = 0
+            for stored_vector in stored_vectors[:Session.VECTOR_COMPARE_LENGTH]:
+                d += np.linalg.norm(stored_vector - v)
+            d /= len(stored_vectors)
+            if d < threshold:
+                pairs.append((d, i, j))
+    pairs.sort(key=lambda x: x[0])
+    return pairs
+
+
+def matrix_match(vectors, sessions, threshold: float, method: str):
+    distances = matching.session_distance_matrix(np.stack(vectors), sessions)
+    return matching.assign(distances, threshold, method)
+
+
+def time_it(fn, repeats: int) -> float:
+    """ Returns the mean time of the function, in milliseconds. """
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+if __name__ == "__main__":
+    args = get_args()
+    Session.SESSION_FILE = os.path.join(tempfile.mkdtemp(), Session.SESSION_FILE)
+    Logger.header("Matching Benchmark ({} vectors per frame)".format(args.vectors))
+
+    for n_sessions in args.sessions:
+        sessions, session_vectors = create_sessions(n_sessions)
+        vectors = [random_vector() for _ in range(args.vectors)]
+        loop_ms = time_it(lambda: loop_match(vectors, session_vectors, 0.5), args.repeats)
+        greedy_ms = time_it(lambda: matrix_match(vectors, sessions, 0.5, matching.ASSIGN_GREEDY), args.repeats)
+        hungarian_ms = time_it(lambda: matrix_match(vectors, sessions, 0.5, matching.ASSIGN_HUNGARIAN), args.repeats)
+        Logger.field("Sessions: {}".format(n_sessions),
+                     "Loop: {:.3f} ms | Greedy: {:.3f} ms | Hungarian: {:.3f} ms".format(loop_ms, greedy_ms,
+                                                                                          hungarian_ms))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Use this script to benchmark the cost of labelling a frame, with the cached sprite text renderer against the
+original PIL renderer, at different frame sizes.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from tools import text
+from tools.logger import Logger
+from tools.region import Region
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+FRAME_SIZES = [(320, 240), (640, 480), (1280, 720), (1920, 1080), (3840, 2160)]
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-l', '--labels', type=int, default=20, help="Number of labels to draw on each frame.")
+    parser.add_argument('-r', '--repeats', type=int, default=20, help="Number of frames to time.")
+    return parser.parse_args()
+
+
+def label_frame(image: np.array, labels):
+    for label, region in labels:
+        image = text.label_region(image, label, region, font_size=12, bg_color=None)
+    return image
+
+
+def time_labelling(image: np.array, labels, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        label_frame(image, labels)
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+if __name__ == "__main__":
+    args = get_args()
+    random_state = np.random.RandomState(0)
+
+    Logger.header("Text Benchmark ({} Labels)".format(args.labels))
+    for width, height in FRAME_SIZES:
+        image = random_state.randint(0, 256, size=(height, width, 3)).astype(np.uint8)
+
+        labels = []
+        for i in range(args.labels):
+            x = random_state.randint(50, width - 50)
+            y = random_state.randint(50, height - 50)
+            labels.append(("SESSION {}".format(i), Region(x - 40, x + 40, y - 20, y + 60)))
+
+        # Warm up the sprite cache, so we time the steady state (the same labels are drawn on every frame).
+        label_frame(image.copy(), labels)
+        sprite_ms = time_labelling(image.copy(), labels, args.repeats)
+
+        text.raw_text, sprite_raw_text = text._raw_text_pil, text.raw_text
+        try:
+            pil_ms = time_labelling(image.copy(), labels, max(1, args.repeats // 4))
+        finally:
+            text.raw_text = sprite_raw_text
+
+        Logger.field("{}x{}".format(width, height), "Sprite: {:.2f} ms | PIL: {:.2f} ms".format(sprite_ms, pil_ms))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Use this script to benchmark tiled face detection on a video: the frames per second, and the recall of
+each tile grid. Recall is measured against every face (of at least the minimum size) found by any of the
+grids, since we don't have labelled frames.
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from counter.detector import Detector, non_max_suppression
+from counter.video_reader import VideoReader
+from tools.logger import Logger
+from tools.resource_manager import ResourceManager
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help="The video to detect faces in.")
+    parser.add_argument('-g', '--grids', nargs="+", default=["1x1", "2x1", "2x2", "3x2", "4x3"],
+                        help="The tile grids (columns x rows) to compare.")
+    parser.add_argument('-o', '--overlap', type=float, default=0.2, help="The tile overlap.")
+    parser.add_argument('-n', '--frames', type=int, default=50, help="Number of frames to test on.")
+    parser.add_argument('-m', '--min_face_size', type=int, default=40, help="The smallest face to count.")
+    return parser.parse_args()
+
+
+def read_frames(path: str, count: int):
+    video_reader = VideoReader()
+    video_reader.open(path)
+    frames = []
+    while len(frames) < count:
+        frame = video_reader.next_frame()
+        if frame is None:
+            break
+        frames.append(frame)
+    return frames
+
+
+def to_boxes(detections, min_face_size: int) -> np.array:
+    detections = detections.select(detections.mask_min_width(min_face_size))
+    return np.hstack([detections.boxes, detections.scores[:, np.newaxis]]).astype(np.float32)
+
+
+def count_found(found: np.array, reference: np.array) -> int:
+    """ How many of the reference faces are covered (by more than half) by one of the found faces. """
+    count = 0
+    for box in reference:
+        width = np.minimum(box[2], found[:, 2]) - np.maximum(box[0], found[:, 0])
+        height = np.minimum(box[3], found[:, 3]) - np.maximum(box[1], found[:, 1])
+        intersection = np.maximum(0, width) * np.maximum(0, height)
+        area = (box[2] - box[0]) * (box[3] - box[1])
+        if np.any(intersection > 0.5 * area):
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    args = get_args()
+    frames = read_frames(args.input, args.frames)
+
+    resource_manager = ResourceManager("resource")
+    resource_manager.read_manifest(os.path.join(os.path.dirname(os.path.realpath(__file__)), "counter"))
+    detector = Detector()
+    detector.load_model(resource_manager.get("ssd_model"))
+    detector.tile_overlap = args.overlap
+
+    # Detect with every grid.
+    results = {}
+    fps = {}
+    for grid in args.grids:
+        detector.tile_columns, detector.tile_rows = [int(v) for v in grid.split("x")]
+        detector.detect(frames[0])  # Warm up.
+
+        start = time.perf_counter()
+        results[grid] = [to_boxes(detector.detect(frame), args.min_face_size) for frame in frames]
+        fps[grid] = len(frames) / (time.perf_counter() - start)
+
+    # The reference is every face found by any grid, merged.
+    references = []
+    for i in range(len(frames)):
+        boxes = np.vstack([results[grid][i] for grid in args.grids])
+        references.append(boxes[non_max_suppression(boxes[:, :4], boxes[:, 4], 0.5)])
+    total = max(1, sum(len(r) for r in references))
+
+    Logger.header("Tiling Benchmark ({} Frames, {}x{})".format(len(frames), frames[0].shape[1], frames[0].shape[0]))
+    for grid in args.grids:
+        found = sum(count_found(results[grid][i], references[i]) for i in range(len(frames)))
+        Logger.field(grid, "{:.1f} FPS | Recall: {:.1f}% ({}/{})".format(fps[grid], found / total * 100, found, total))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Use this script to benchmark the face trackers on a simulated crowd. Each person walks across the frame at a
+constant velocity (with some jitter on the detected box), and only every few frames are processed. It reports the
+time per processed frame, and the number of times a person's detection joined a different track to the one it
+was on before (an ID switch).
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from counter.predictive_tracker import create_tracker, TRACKER_MODES
+from tools.logger import Logger
+from tools.tracking_tool import TrackingRegion
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+WIDTH = 1920
+HEIGHT = 1080
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--people', type=int, nargs="+", default=[10, 50, 200, 400],
+                        help="The crowd sizes to benchmark.")
+    parser.add_argument('-s', '--skip', type=int, nargs="+", default=[1, 3, 6],
+                        help="Process only every this many frames.")
+    parser.add_argument('--speed', type=float, default=6.0, help="The fastest walking speed, in pixels per frame.")
+    parser.add_argument('-f', '--frames', type=int, default=120, help="Number of frames to simulate.")
+    return parser.parse_args()
+
+
+def create_crowd(count: int, speed: float, seed: int = 0):
+    """ The start position, velocity and face size of each person. """
+    random = np.random.RandomState(seed)
+    positions = random.uniform([0, 0], [WIDTH, HEIGHT], size=(count, 2))
+    velocities = random.uniform(-speed, speed, size=(count, 2))
+    sizes = random.uniform(40, 80, size=count)
+    return positions, velocities, sizes
+
+
+def detect(crowd, frame_index: int, random):
+    """ The detected face region of each person at this frame (with jitter), wrapped around the frame. """
+    positions, velocities, sizes = crowd
+    centers = (positions + velocities * frame_index) % [WIDTH, HEIGHT]
+    centers = centers + random.normal(0, 1.5, size=centers.shape)
+    regions = []
+    for (x, y), size in zip(centers, sizes):
+        half_size = size / 2
+        regions.append(TrackingRegion(left=x - half_size, right=x + half_size, top=y - half_size, bottom=y + half_size))
+    return regions, centers
+
+
+def run(mode: str, crowd, frames: int, skip: int):
+    """ Returns the mean time per processed frame (in ms), and the number of ID switches. """
+    tracker = create_tracker(mode)
+    random = np.random.RandomState(1)
+    last_tracklet = {}
+    switches = 0
+    elapsed = 0.0
+    processed = 0
+
+    for frame_index in range(0, frames, skip):
+        regions, centers = detect(crowd, frame_index, random)
+
+        start = time.perf_counter()
+        tracker.process(regions, frame_index)
+        elapsed += time.perf_counter() - start
+        processed += 1
+
+        tracklets_by_region = {id(t.last_raw_region): t for t in tracker.tracklets
+                               if t.last_frame_index == frame_index}
+
+        for person, region in enumerate(regions):
+            # Don't count the switch when a person wraps around to the other side of the frame.
+            previous_center = last_tracklet.get(person, (None, None))[1]
+            wrapped = previous_center is not None and np.abs(centers[person] - previous_center).max() > 200
+
+            tracklet = tracklets_by_region[id(region)]
+            if person in last_tracklet and not wrapped and last_tracklet[person][0] is not tracklet:
+                switches += 1
+            last_tracklet[person] = (tracklet, centers[person])
+
+    return elapsed * 1000 / processed, switches
+
+
+if __name__ == "__main__":
+    args = get_args()
+    Logger.header("Tracker Benchmark ({} frames, max speed {} px per frame)".format(args.frames, args.speed))
+
+    for people in args.people:
+        crowd = create_crowd(people, args.speed)
+        for skip in args.skip:
+            results = []
+            for mode in TRACKER_MODES:
+                ms, switches = run(mode, crowd, args.frames, skip)
+                results.append("{}: {:.2f} ms, {} switches".format(mode.title(), ms, switches))
+            Logger.field("People: {} | Skip: {}".format(people, skip), " | ".join(results))
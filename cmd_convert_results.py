@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Use this script to convert the session results from the old layout (one JSON file per session) into the
+segmented JSON Lines store.
+"""
+
+import argparse
+
+from counter.result_store import SegmentedResultStore, convert_legacy_results
+from counter.session import Session
+from tools.logger import Logger
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', default=Session.OUTPUT_DIR, help="Directory of the session JSON files.")
+    parser.add_argument('-o', '--output', default=Session.OUTPUT_DIR, help="Directory of the segmented store.")
+    parser.add_argument('-r', '--remove', action="store_true", help="Delete the JSON files once converted.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    Logger.field("Converting Results", "{} -> {}".format(args.input, args.output))
+    store = SegmentedResultStore(args.output, retention=Session.ROLLING_WINDOW_SIZE)
+    count = convert_legacy_results(args.input, store, remove=args.remove)
+    store.close()
+    Logger.field("Sessions Converted", count)
@@ -6,6 +6,7 @@ Use this script to continously run the counter app.
 """
 
 import argparse
+import signal
 from tools.logger import Logger
 from counter.counter import Counter
 
@@ -29,7 +30,13 @@ visualize = args.visualize
 if __name__ == "__main__":
     Logger.field("Running", "Counter App")
     counter = Counter(visualize)
-    counter.process(0)
+
+    # Supervisor stops the app with SIGTERM. Finish the current frames and write out the results first.
+    signal.signal(signal.SIGTERM, lambda signum, frame: counter.stop())
+    try:
+        counter.process(0)
+    finally:
+        counter.close()
 
 
 
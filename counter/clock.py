@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""
+The clocks that drive the session lifetimes. Each frame is stamped with a time when it is captured, and the
+sessions age by the time between the frames that are actually processed. For a camera that is the wall clock
+time. For a file it is the media time of the frame, so that a recording processed faster (or slower) than real
+time, or with dropped frames, still gives the right session durations.
+"""
+
+import time
+from abc import abstractmethod
+
+import cv2
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+CLOCK_AUTO = "auto"  # Wall for live sources, media for files.
+CLOCK_WALL = "wall"
+CLOCK_MEDIA = "media"
+CLOCK_MODES = [CLOCK_AUTO, CLOCK_WALL, CLOCK_MEDIA]
+
+
+class Clock:
+    """ sample() is called by the capture (for each frame, as it is read), and advance() by the session
+    thread (for each frame, as it is processed). """
+
+    def __init__(self):
+        self._now = None
+
+    def reset(self):
+        self._now = None
+
+    @abstractmethod
+    def sample(self, cap) -> float:
+        """ The time of the frame that was just read from the capture. """
+        pass
+
+    def advance(self, timestamp: float) -> float:
+        """ Move the clock to the time of the frame being processed. Returns the time since the last frame. """
+        delta = 0.0 if self._now is None else max(0.0, timestamp - self._now)
+        self._now = timestamp
+        return delta
+
+    def now(self) -> float:
+        """ The time of the frame being processed (or the wall time, before the first frame). """
+        return self._now if self._now is not None else time.time()
+
+
+class WallClock(Clock):
+    def sample(self, cap) -> float:
+        return time.time()
+
+
+class MediaClock(Clock):
+    """ The position of the frame in the media, counted from the wall time when the media was opened. """
+
+    DEFAULT_FPS = 30.0
+
+    def __init__(self):
+        super().__init__()
+        self.origin = time.time()
+        self._last_position = None
+
+    def reset(self):
+        super().reset()
+        self.origin = time.time()
+        self._last_position = None
+
+    def sample(self, cap) -> float:
+        position = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+
+        # Some backends don't report a position. Step forward by one frame instead.
+        if self._last_position is not None and position <= self._last_position:
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            position = self._last_position + 1.0 / (fps if fps > 0 else self.DEFAULT_FPS)
+
+        self._last_position = position
+        return self.origin + position
+
+
+def create_clock(mode: str, is_live: bool) -> Clock:
+    if mode == CLOCK_AUTO:
+        mode = CLOCK_WALL if is_live else CLOCK_MEDIA
+
+    if mode == CLOCK_WALL:
+        return WallClock()
+
+    if mode == CLOCK_MEDIA:
+        return MediaClock()
+
+    raise ValueError("Unknown clock '{}'. Use one of: {}.".format(mode, CLOCK_MODES))
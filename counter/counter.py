@@ -10,16 +10,25 @@ import uuid
 
 import yaml
 
+from counter.detection_scheduler import DetectionScheduler
+from counter.embedding_scheduler import EmbeddingScheduler
+from counter.predictive_tracker import create_tracker
+from counter.face_quality import FaceQuality
+from counter.gallery import SessionGallery
+from counter import matching
 from counter.loader import Loader
+from counter.motion_gate import MotionGate
+from counter.pipeline import Pipeline, FramePacket
+from counter.renderer import Renderer, RenderJob, SessionPlate
+from counter.result_store import create_store
+from counter.result_writer import ResultWriter
 from counter.session import Session
 from counter.vector_extractor import VectorExtractor
-from tools import visual, text
 from tools.logger import Logger
 from tools.region import Region
 from tools.resource_manager import ResourceManager
 from counter.detector import Detector
 from counter.video_reader import VideoReader
-import cv2
 import time
 from datetime import datetime
 import numpy as np
@@ -30,20 +39,14 @@ __email__ = "krinj@genvis.co"
 
 
 class VectorWrapper:
-    def __init__(self, vector, region):
+    def __init__(self, vector, region, track=None):
         self.value = vector
         self.region = region
+        self.track = track
         self.session = None
         self.id = uuid.uuid4()
 
 
-class SessionVectorPair:
-    def __init__(self, session, vector, distance):
-        self.session = session
-        self.vector = vector
-        self.distance = distance
-
-
 class Counter:
 
     def __init__(self, visualize=False, resource_directory: str = "resource"):
@@ -55,15 +58,35 @@ class Counter:
         self.extractor = VectorExtractor()
         self.extractor.initialize(Loader.get_landmark_model(), Loader.get_face_model())
         self.visualize = visualize if "DISPLAY" in os.environ else False
+        self.renderer = None
 
         # Initialize the app settings.
         self.min_face_size = None
         self.rolling_window_size = None
+        self.pipeline_enabled = False
+        self.pipeline_queue_depth = 4
+        self.pipeline_drop_policy = None
+        self.embedding_scheduler = None
+        self.detection_scheduler = None
+        self.motion_gate = None
+        self.match_distance_threshold = 0.5
+        self.match_assignment = matching.ASSIGN_GREEDY
+        self.gallery = None
+        self.gallery_match_threshold = 0.4
+        self.embedding_pool = None
+        self.render_fps = 10
         self.load_settings()
 
+        # Rendering runs on its own thread, and only if there is a window to show it in.
+        if self.visualize:
+            self.renderer = Renderer(self.render_fps)
+
         # Initialize stateful variables.
         self.sessions = []
         self.timestamp_previous_activity = time.time()
+        self.frame_index = 0
+        self.container_region = None
+        self.is_stopping = False
 
     def load_settings(self):
         """ Load settings from the .yaml file. """
@@ -71,11 +94,76 @@ class Counter:
         with open(settings_file, 'r') as f:
             data = yaml.load(f)
 
+        Logger.set_level(data["LOG_LEVEL"])
+        if data["LOG_DIRECTORY"]:
+            Logger.attach_file_handler(data["LOG_DIRECTORY"])
+
         self.min_face_size = data["MIN_FACE_SIZE"]
+        self.detector.detection_width = int(data["DETECTION_WIDTH"])
+        self.detector.tile_columns = max(1, int(data["DETECTION_TILE_COLUMNS"]))
+        self.detector.tile_rows = max(1, int(data["DETECTION_TILE_ROWS"]))
+        self.detector.tile_overlap = float(data["DETECTION_TILE_OVERLAP"])
+        self.detector.nms_threshold = float(data["DETECTION_NMS_THRESHOLD"])
         Session.ROLLING_WINDOW_SIZE = int(data["ROLLING_WINDOW_SIZE"])
         Session.MAX_VECTOR_LENGTH = int(data["MAX_VECTOR_LENGTH"])
-        Session.SESSION_LONG_LIFE_FRAMES = int(data["SESSION_LONG_LIFE_FRAMES"])
-        Session.SESSION_SHORT_LIFE_FRAMES = int(data["SESSION_SHORT_LIFE_FRAMES"])
+        Session.SESSION_LONG_LIFE_SECONDS = float(data["SESSION_LONG_LIFE_SECONDS"])
+        Session.SESSION_SHORT_LIFE_SECONDS = float(data["SESSION_SHORT_LIFE_SECONDS"])
+        Session.DISTANCE_MODE = data["SESSION_DISTANCE_MODE"]
+        Session.SESSION_ID_BLOCK_SIZE = int(data["SESSION_ID_BLOCK_SIZE"])
+        Session.RESULT_STORE = create_store(data["RESULT_STORE_FORMAT"], Session.OUTPUT_DIR,
+                                            Session.ROLLING_WINDOW_SIZE,
+                                            segment_max_bytes=int(data["RESULT_SEGMENT_MAX_BYTES"]),
+                                            segment_max_seconds=float(data["RESULT_SEGMENT_MAX_SECONDS"]))
+        Session.RESULT_WRITER = ResultWriter(Session.RESULT_STORE,
+                                             queue_size=int(data["RESULT_WRITER_QUEUE_SIZE"]),
+                                             batch_size=int(data["RESULT_WRITER_BATCH_SIZE"]))
+        self.match_distance_threshold = float(data["MATCH_DISTANCE_THRESHOLD"])
+        self.match_assignment = data["MATCH_ASSIGNMENT"]
+
+        self.pipeline_enabled = bool(data["PIPELINE_ENABLED"])
+        self.pipeline_queue_depth = int(data["PIPELINE_QUEUE_DEPTH"])
+        self.pipeline_drop_policy = data["PIPELINE_DROP_POLICY"]
+        self.video_reader.threaded = bool(data["CAPTURE_THREADED"])
+        self.video_reader.buffer_size = max(1, int(data["CAPTURE_BUFFER_SIZE"]))
+        self.video_reader.policy = data["CAPTURE_POLICY"]
+        self.video_reader.clock_mode = data["CLOCK"]
+        self.render_fps = float(data["RENDER_FPS"])
+
+        if data["GALLERY_ENABLED"]:
+            self.gallery = SessionGallery(directory=data["GALLERY_DIRECTORY"],
+                                          capacity=Session.ROLLING_WINDOW_SIZE,
+                                          dtype=data["GALLERY_DTYPE"],
+                                          flush_interval=float(data["GALLERY_FLUSH_SECONDS"]))
+            self.gallery_match_threshold = float(data["GALLERY_MATCH_THRESHOLD"])
+
+        if data["MOTION_GATE_ENABLED"]:
+            self.motion_gate = MotionGate(min_area=float(data["MOTION_MIN_AREA"]),
+                                          quiet_seconds=float(data["MOTION_QUIET_SECONDS"]),
+                                          idle_interval=float(data["MOTION_IDLE_INTERVAL"]))
+
+        if data["QUALITY_GATE_ENABLED"]:
+            self.extractor.quality = FaceQuality(min_score=float(data["QUALITY_MIN_SCORE"]),
+                                                 sharpness_reference=float(data["QUALITY_SHARPNESS_REFERENCE"]))
+
+        # Embed in worker processes. Only imported when used, since it needs Python 3.8+ for shared memory.
+        if int(data["EMBEDDING_WORKERS"]) > 0:
+            from counter.embedding_pool import EmbeddingPool
+            self.embedding_pool = EmbeddingPool(int(data["EMBEDDING_WORKERS"]),
+                                                os.path.abspath(Loader.get_landmark_model()),
+                                                os.path.abspath(Loader.get_face_model()),
+                                                quality=self.extractor.quality,
+                                                ring_slots=self.pipeline_queue_depth + 2)
+
+        if data["TRACKING_ENABLED"]:
+            self.embedding_scheduler = EmbeddingScheduler(interval=int(data["EMBEDDING_INTERVAL_FRAMES"]),
+                                                          budget=int(data["EMBEDDING_BUDGET"]),
+                                                          tracker=create_tracker(data["TRACKER"]))
+
+            # Between full scans, only search around the tracked faces.
+            if int(data["DETECTION_SCAN_INTERVAL"]) > 1:
+                self.detection_scheduler = DetectionScheduler(self.detector, self.embedding_scheduler.tracker,
+                                                              scan_interval=int(data["DETECTION_SCAN_INTERVAL"]),
+                                                              crop_scale=float(data["DETECTION_CROP_SCALE"]))
 
     def load_resources(self, resource_directory: str):
         """ Load the neural net model for face detection. """
@@ -84,96 +172,244 @@ class Counter:
         model_path = resource_manager.get("ssd_model")
         self.detector.load_model(model_path)
 
-    def visualize_sessions(self, frame, vector_wrappers, invalid_regions):
-        """ Draw the visualization window for testing. """
+    def render(self, packet: FramePacket):
+        """ Hand a snapshot of this frame and the sessions to the renderer (if it is ready for one). """
+        if self.renderer is None or not self.renderer.is_due():
+            return
 
         cap_regions = []
-        for r in invalid_regions:
+        for r in packet.invalid_regions:
             cap_region = r.clone()
             cap_region.width = self.min_face_size
             cap_region.height = self.min_face_size
             cap_regions.append(cap_region)
 
-        valid_regions = []
-
-        for w in vector_wrappers:
-            valid_regions.append(w.region)
-            frame = text.label_region(frame, w.session.display_id, w.region, font_size=12)
+        labels = [(w.session.display_id, w.region) for w in packet.vector_wrappers if w.session is not None]
+        plates = [SessionPlate(i, s.display_id, s.is_active, s.display_time_left_percent)
+                  for i, s in enumerate(self.sessions) if s.is_full]
 
-        overlay = np.zeros_like(frame)
-        overlay = visual.draw_regions(overlay, valid_regions, color=(0, 255, 0), thickness=2)
-        overlay = visual.draw_regions(overlay, invalid_regions, color=(0, 0, 255), thickness=2)
-        overlay = visual.draw_regions(overlay, cap_regions, color=(60, 60, 60), thickness=1)
-        frame = cv2.addWeighted(frame, 1.0, overlay, 1.0, 0.0)
-
-        # Show the frame in a window.
-        if self.visualize:
-            cv2.imshow("window", frame)
-            cv2.waitKey(1)
+        job = RenderJob(packet.frame.copy(), labels, list(packet.invalid_regions), cap_regions, plates)
+        self.renderer.submit(job)
 
     def process(self, video_path):
 
-        self.video_reader.cap = cv2.VideoCapture(video_path)
-        container_region = None
-        while self.video_reader.cap is not None:
-
-            self.timestamp_previous_activity = time.time()
-
-            frame = self.video_reader.next_frame()
-            if frame is not None:
-
-                if container_region is None:
-                    pad = 5
-                    container_region = Region(pad, frame.shape[1] - pad, pad, frame.shape[0] - pad)
-
-                regions = self.detector.detect(frame)
-                valid_regions = []
-                invalid_regions = []
-
-                for r in regions:
-                    if r.width >= self.min_face_size:
-
-                        if r.left > container_region.left and r.right < container_region.right and \
-                                r.top > container_region.top and r.bottom < container_region.bottom:
-                            valid_regions.append(r)
-                            continue
-
-                    invalid_regions.append(r)
-
-                frame = self.draw_session_plates(frame)
+        self.video_reader.open(video_path)
+        Session.CLOCK = self.video_reader.clock
+        self.frame_index = 0
+        self.container_region = None
+        if self.embedding_scheduler is not None:
+            self.embedding_scheduler.reset()
+        if self.detection_scheduler is not None:
+            self.detection_scheduler.reset()
+        if self.motion_gate is not None:
+            self.motion_gate.reset()
+
+        if self.pipeline_enabled:
+            self.process_pipelined()
+            return
+
+        while self.video_reader.is_open:
+            packet = self.capture_frame()
+            if packet is None:
+                break
+
+            self.detect_faces(packet)
+            self.extract_vectors(packet)
+            self.update_sessions(packet)
+
+    def stop(self):
+        """ Stop reading new frames. The frames already being processed are finished first.
+        This is safe to call from a signal handler. """
+        self.is_stopping = True
+
+    def close(self):
+        """ End the sessions that are still open, and write out everything that is waiting to be written. """
+        if self.video_reader.is_open:
+            self.video_reader.end_capture()
+
+        for s in self.sessions:
+            self.end_session(s)
+        self.sessions = []
 
-                vector_wrappers = []
-                for r in valid_regions:
-                    vector = self.get_vector(frame, r)
-                    vector_wrapper = VectorWrapper(vector, r)
-                    vector_wrappers.append(vector_wrapper)
+        if self.gallery is not None:
+            self.gallery.close()
+
+        if Session.RESULT_WRITER is not None:
+            Session.RESULT_WRITER.close()
+        elif Session.RESULT_STORE is not None:
+            Session.RESULT_STORE.close()
+
+        if self.renderer is not None:
+            self.renderer.close()
+            self.renderer = None
+
+        if self.embedding_pool is not None:
+            self.embedding_pool.close()
+            self.embedding_pool = None
+
+        Logger.flush()
+
+    def process_pipelined(self):
+        """ Run capture, detection, embedding and session tracking as separate threaded stages.
+        The session stage runs on this thread, so the session list is only ever touched here. """
+        pipeline = Pipeline(self.pipeline_queue_depth, self.pipeline_drop_policy)
+        pipeline.add_stage("detect", self.detect_faces)
+        if self.embedding_pool is not None:
+            # Hand each frame to the workers as soon as it is detected, and collect the vectors in frame order.
+            pipeline.add_stage("embed_submit", self.submit_vectors)
+        pipeline.add_stage("embed", self.extract_vectors)
+        pipeline.run(self.capture_frame, self.update_sessions)
+
+    # ======================================================================================================================
+    # Frame processing stages.
+    # ======================================================================================================================
+
+    def capture_frame(self):
+        """ Read the next frame from the video, and wrap it in a packet. Returns None when the video has ended. """
+        if not self.video_reader.is_open or self.is_stopping:
+            return None
+
+        # While the scene is idle, poll the camera slowly (with the newest frame each time, so that the first
+        # motion is seen on the next poll). Files are always read at full speed.
+        if self.motion_gate is not None and self.motion_gate.is_idle and self.video_reader.is_live:
+            captured = self.video_reader.next_latest_frame(self.motion_gate.idle_interval)
+        else:
+            captured = self.video_reader.next_captured_frame()
 
-                self.add_vectors_to_sessions(vector_wrappers)
-                self.process_sessions(1)
-                self.visualize_sessions(frame, vector_wrappers, invalid_regions)
+        self.timestamp_previous_activity = time.time()
+        if captured is None:
+            return None
+
+        packet = FramePacket(self.frame_index, captured.image, captured.timestamp)
+        self.frame_index += 1
+        return packet
+
+    def detect_faces(self, packet: FramePacket) -> FramePacket:
+        """ Detect the faces in the frame, and split them into valid and invalid regions. """
+        frame = packet.frame
+        if self.container_region is None:
+            pad = 5
+            self.container_region = Region(pad, frame.shape[1] - pad, pad, frame.shape[0] - pad)
+
+        # Nothing has moved, and there is no one to keep track of. The sessions still age in update_sessions.
+        if self.motion_gate is not None and \
+                not self.motion_gate.check(frame, packet.timestamp, len(self.sessions) > 0):
+            return packet
+
+        c = self.container_region
+        if self.detection_scheduler is not None:
+            detections = self.detection_scheduler.detect(frame, packet.index)
+        else:
+            detections = self.detector.detect(frame)
+
+        # A valid face is big enough, and fully inside the frame.
+        is_valid = detections.mask_min_width(self.min_face_size) & \
+            detections.mask_inside(c.left, c.top, c.right, c.bottom)
+        packet.valid_regions = detections.select(is_valid).regions
+        packet.invalid_detections = detections.select(~is_valid)
+
+        if self.embedding_scheduler is not None:
+            packet.scheduled_faces = self.embedding_scheduler.schedule(packet.valid_regions, packet.index)
+
+        return packet
+
+    def submit_vectors(self, packet: FramePacket) -> FramePacket:
+        """ Start embedding the frame's faces in the worker pool, without waiting for the vectors. """
+        packet.embedding_job = self.embedding_pool.submit(packet.frame, self.get_embed_regions(packet))
+        return packet
+
+    def get_embed_regions(self, packet: FramePacket) -> list:
+        """ The regions of the frame that need a new vector. """
+        if packet.scheduled_faces is not None:
+            return [f.region for f in packet.scheduled_faces if f.embed]
+        return packet.valid_regions
+
+    def embed(self, packet: FramePacket):
+        """ The vector (or None) for each of the frame's embed regions, and whether each was rejected by the
+        quality check. """
+        if self.embedding_pool is None:
+            return self.extractor.process_batch_with_quality(packet.frame, self.get_embed_regions(packet))
+
+        if packet.embedding_job is None:
+            self.submit_vectors(packet)
+        return self.embedding_pool.result(packet.embedding_job)
+
+    def extract_vectors(self, packet: FramePacket) -> FramePacket:
+        """ Create the feature vector for each valid face in the frame, in a single batch. """
+        if packet.scheduled_faces is not None:
+            return self.extract_scheduled_vectors(packet)
+
+        vectors, rejected = self.embed(packet)
+        for vector, is_rejected, r in zip(vectors, rejected, packet.valid_regions):
+            # A rejected face has no vector, but can still keep the nearest session alive.
+            if vector is None and not is_rejected:
+                continue
+            vector_wrapper = VectorWrapper(vector, r)
+            packet.vector_wrappers.append(vector_wrapper)
+        return packet
+
+    def extract_scheduled_vectors(self, packet: FramePacket) -> FramePacket:
+        """ Only embed the tracked faces that the scheduler asked for. The other faces carry their
+        track's session forward without a new vector. """
+        embed_faces = [f for f in packet.scheduled_faces if f.embed]
+        vectors, rejected = self.embed(packet)
+        vectors_by_face = {id(f): v for f, v in zip(embed_faces, vectors)}
+        rejected_faces = {id(f) for f, is_rejected in zip(embed_faces, rejected) if is_rejected}
+
+        for face in packet.scheduled_faces:
+            vector = vectors_by_face.get(id(face))
+            if vector is not None:
+                packet.vector_wrappers.append(VectorWrapper(vector, face.region, face.track))
+            elif face.track.has_live_session or id(face) in rejected_faces:
+                packet.vector_wrappers.append(VectorWrapper(None, face.region, face.track))
+
+        return packet
+
+    def update_sessions(self, packet: FramePacket):
+        """ Match the frame's vectors to the sessions, age the sessions, and show the results. """
+        # Advance the clock first, so that the sessions created for this frame start at its time.
+        time_delta = self.video_reader.clock.advance(packet.timestamp)
+        self.add_vectors_to_sessions(packet.vector_wrappers)
+        self.reidentify_sessions()
+        self.process_sessions(time_delta)
+        self.render(packet)
 
     def add_vectors_to_sessions(self, vector_wrappers):
 
-        pairs = []
-
-        for v in vector_wrappers:
-            for s in self.sessions:
-                d = s.get_distance(v.value)
-                if d < 0.5:  # Within Range!
-                    pair = SessionVectorPair(s, v, d)
-                    pairs.append(pair)
-
         paired_sessions = {}
         paired_vectors = {}
-        pairs.sort(key=lambda x: x.distance)
 
-        # Merge the similar IDs.
-        for p in pairs:
-            if p.vector.id not in paired_vectors and p.session not in paired_sessions:
-                paired_sessions[p.session] = True
-                paired_vectors[p.vector.id] = True
-                p.session.add_vector(p.vector.value)
-                p.vector.session = p.session
+        # Faces without a new vector (tracked, or rejected by the quality check) keep their session alive.
+        # That is the track's session, or else the nearest session to the face.
+        for v in vector_wrappers:
+            if v.value is None:
+                if v.track is not None and v.track.has_live_session:
+                    v.session = v.track.session
+                else:
+                    v.session = self.nearest_session(v.region, paired_sessions)
+
+                if v.session is not None:
+                    v.session.keep_alive()
+                    paired_sessions[v.session] = True
+                paired_vectors[v.id] = True
+
+        # Match the new vectors to the remaining sessions, all at once.
+        new_wrappers = [v for v in vector_wrappers if v.id not in paired_vectors]
+        open_sessions = [s for s in self.sessions if s not in paired_sessions]
+
+        if len(new_wrappers) > 0 and len(open_sessions) > 0:
+            vectors = np.stack([v.value for v in new_wrappers])
+            distances = matching.session_distance_matrix(vectors, open_sessions)
+            pairs = matching.assign(distances, self.match_distance_threshold, self.match_assignment)
+
+            # Merge the similar IDs.
+            for row, col in pairs:
+                v = new_wrappers[row]
+                s = open_sessions[col]
+                paired_sessions[s] = True
+                paired_vectors[v.id] = True
+                s.add_vector(v.value)
+                v.session = s
 
         # Create New Sessions.
         for v in vector_wrappers:
@@ -183,7 +419,30 @@ class Counter:
                 v.session = session
                 self.sessions.append(session)
 
-    def process_sessions(self, time_delta):
+        # Remember the session on each track, so that it can be carried between embeddings. A face without a
+        # vector was only paired by position, so it doesn't hand its session to a track.
+        for v in vector_wrappers:
+            if v.session is not None:
+                v.session.last_region = v.region
+            if v.track is not None and v.session is not None and v.value is not None:
+                v.track.session = v.session
+
+    def nearest_session(self, region: Region, excluded_sessions: dict, reach: float = 1.5):
+        """ The session whose face was last seen closest to this region (within reach face sizes), or None. """
+        nearest = None
+        nearest_distance = region.biggest_edge * reach
+        for s in self.sessions:
+            if s in excluded_sessions or s.last_region is None:
+                continue
+
+            distance = Region.distance(region, s.last_region)
+            if distance < nearest_distance:
+                nearest, nearest_distance = s, distance
+        return nearest
+
+    def process_sessions(self, time_delta: float):
+        """ Age the sessions by the time (in seconds) since the last processed frame, and end the ones
+        that have run out of time. """
         for session in self.sessions:
             session.update(time_delta)
 
@@ -191,32 +450,32 @@ class Counter:
         self.sessions = [s for s in self.sessions if s.time_left_percent > 0]
 
         for s in ended_sessions:
-            if s.is_full:
-                s.end()
-
-    def get_vector(self, image, region):
-        vector = self.extractor.process(image, [region])
-        return vector
-
-    def draw_session_plates(self, frame):
-        pad = 2
-        unit_height = 30
-        unit_width = 128
-        bar_height = 2
-
-        for i, session in enumerate(self.sessions):
-
-            if not session.is_full:
+            self.end_session(s)
+
+        if self.gallery is not None:
+            self.gallery.flush_if_due()
+
+    def end_session(self, session):
+        """ Close the session. Only sessions that reached full confidence are recorded. """
+        session.has_ended = True
+        if session.is_full:
+            session.end()
+            if self.gallery is not None:
+                self.gallery.add(session.session_id, session.face_id, session.centroid)
+
+    def reidentify_sessions(self):
+        """ Check each newly activated session against the gallery of ended sessions. If the face has been
+        seen before, the session takes on the face ID of the earlier session. """
+        if self.gallery is None:
+            return
+
+        for s in self.sessions:
+            if not s.has_activated or s.gallery_checked:
                 continue
 
-            color = (0, 255, 0) if session.is_active else (255, 255, 255)
-            x = pad
-            y = pad + (unit_height + pad) * i
-            t_height = (unit_height - bar_height)
-            t_region = Region(x, x + unit_width, y, y + t_height)
-            frame = text.write_into_region(frame, session.display_id, t_region, bg_color=(0, 0, 0), font_size=12,
-                                           bg_opacity=0.7, color=color)
-            visual.draw_bar(frame, session.display_time_left_percent, x, y + t_height,
-                            unit_width, bar_height, bar_color=color)
-
-        return frame
+            s.gallery_checked = True
+            match = self.gallery.query(s.centroid, self.gallery_match_threshold)
+            if match is not None:
+                s.face_id = match.face_id
+                s.previous_session_id = match.session_id
+                Logger.field("Session Returned", "{} (Was Session {})".format(s.display_id, match.session_id))
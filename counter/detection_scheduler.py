@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""
+Decides where to look for faces each frame. Every few frames the whole frame is scanned. In between, only the
+areas around the faces that are already being tracked are searched, with all of those crops in one batch. So
+between the full scans, the cost of detection depends on the number of people, and not on the size of the
+image. New faces are picked up by the next full scan.
+"""
+
+from typing import List
+
+from counter.detections import Detections
+from counter.detector import Detector
+from tools.tracking_tool import Tracker
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+
+class DetectionScheduler:
+
+    def __init__(self, detector: Detector, tracker: Tracker, scan_interval: int = 10, crop_scale: float = 2.0,
+                 crop_input_size: int = 300):
+        self.detector = detector
+        self.tracker = tracker  # The tracks to search around between full scans.
+        self.scan_interval = scan_interval  # Scan the whole frame every this many frames.
+        self.crop_scale = crop_scale  # How much bigger than the face (on each side) the search crop is.
+        self.crop_input_size = crop_input_size
+
+        self.full_scan_count = 0
+        self.crop_scan_count = 0
+        self._last_full_scan = None
+
+    def detect(self, image, frame_index: int) -> Detections:
+        crops = self.get_crops(image.shape[1], image.shape[0])
+
+        if self._is_full_scan_due(frame_index) or len(crops) == 0:
+            self._last_full_scan = frame_index
+            self.full_scan_count += 1
+            return self.detector.detect(image)
+
+        self.crop_scan_count += 1
+        return self.detector.detect_crops(image, crops, self.crop_input_size)
+
+    def get_crops(self, width: int, height: int) -> List[tuple]:
+        """ A square (left, top, right, bottom) crop around the last region of each track that isn't lost.
+        Near the edge of the frame, the crop is moved back inside the frame (rather than cut), so that it stays
+        square and the face isn't stretched when the crop is resized. """
+        crops = []
+        for tracklet in self.tracker.tracklets:
+            if tracklet.is_lost:
+                continue
+
+            region = tracklet.last_raw_region
+            size = min(int(max(region.width, region.height) * self.crop_scale), width, height)
+            if size <= 0:
+                continue
+
+            left = int(min(max(0, region.x - size // 2), width - size))
+            top = int(min(max(0, region.y - size // 2), height - size))
+            crops.append((left, top, left + size, top + size))
+
+        return crops
+
+    def reset(self):
+        self._last_full_scan = None
+
+    def _is_full_scan_due(self, frame_index: int) -> bool:
+        if self._last_full_scan is None:
+            return True
+        return frame_index - self._last_full_scan >= self.scan_interval
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""
+The detector's output for one frame, kept as a structured numpy array (one row per box) so that thresholds
+and filters are single vectorized masks. TrackingRegion objects are only created for the rows that are
+actually needed, when they are first asked for.
+"""
+
+from typing import List
+
+import numpy as np
+
+from tools.region import RegionBatch
+from tools.tracking_tool import TrackingRegion
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+DETECTION_DTYPE = np.dtype([
+    ("left", "<i4"),
+    ("top", "<i4"),
+    ("right", "<i4"),
+    ("bottom", "<i4"),
+    ("score", "<f4"),
+    ("label", "<i4")
+])
+
+
+class Detections:
+
+    def __init__(self, data: np.array = None):
+        self.data = data if data is not None else np.zeros(0, dtype=DETECTION_DTYPE)
+        self._regions = None
+
+    @classmethod
+    def from_boxes(cls, boxes: np.array, scores: np.array, labels: np.array = None) -> 'Detections':
+        """ Boxes are [left, top, right, bottom] rows, in frame pixels. """
+        data = np.zeros(len(boxes), dtype=DETECTION_DTYPE)
+        if len(boxes) > 0:
+            boxes = np.asarray(boxes).astype(np.int32)
+            data["left"], data["top"], data["right"], data["bottom"] = boxes.T
+            data["score"] = scores
+            data["label"] = labels if labels is not None else 0
+        return cls(data)
+
+    @classmethod
+    def from_normalized(cls, boxes: np.array, scores: np.array, labels: np.array, width: int,
+                        height: int) -> 'Detections':
+        """ Boxes are the SSD's normalized [y_min, x_min, y_max, x_max] rows. """
+        frame_boxes = boxes[:, [1, 0, 3, 2]].astype(np.float64) * np.array([width, height, width, height])
+        return cls.from_boxes(frame_boxes, scores, labels)
+
+    def __len__(self):
+        return len(self.data)
+
+    # ======================================================================================================================
+    # Filters.
+    # ======================================================================================================================
+
+    def select(self, mask: np.array) -> 'Detections':
+        return Detections(self.data[mask])
+
+    def mask_score(self, min_score: float) -> np.array:
+        return self.data["score"] > min_score
+
+    def mask_min_width(self, min_width: int) -> np.array:
+        return self.widths >= min_width
+
+    def mask_inside(self, left: int, top: int, right: int, bottom: int) -> np.array:
+        """ The boxes that are strictly inside this area. """
+        data = self.data
+        return (data["left"] > left) & (data["right"] < right) & (data["top"] > top) & (data["bottom"] < bottom)
+
+    def top_k(self, k: int) -> 'Detections':
+        """ The k best scoring detections (best first). """
+        if len(self.data) <= k:
+            return self
+        order = np.argsort(-self.data["score"], kind="stable")[:k]
+        return Detections(self.data[order])
+
+    # ======================================================================================================================
+    # Access.
+    # ======================================================================================================================
+
+    @property
+    def widths(self) -> np.array:
+        return self.data["right"] - self.data["left"]
+
+    @property
+    def heights(self) -> np.array:
+        return self.data["bottom"] - self.data["top"]
+
+    @property
+    def boxes(self) -> np.array:
+        """ The (n x 4) [left, top, right, bottom] boxes. """
+        data = self.data
+        return np.stack([data["left"], data["top"], data["right"], data["bottom"]], axis=1)
+
+    @property
+    def scores(self) -> np.array:
+        return self.data["score"]
+
+    @property
+    def regions(self) -> List[TrackingRegion]:
+        """ A TrackingRegion for each detection, created the first time they are needed. """
+        if self._regions is None:
+            self._regions = RegionBatch.from_rects(self.boxes).to_regions(TrackingRegion)
+            for region, score in zip(self._regions, self.data["score"].tolist()):
+                region.confidence = score
+        return self._regions
@@ -13,17 +13,31 @@ import cv2
 import tensorflow as tf
 import os
 import numpy as np
-from tools.tracking_tool import TrackingRegion
+from counter.detections import Detections
+from tools.region import RegionBatch
 
 
 class Detector:
-    def __init__(self, min_score=0.5, use_gpu=True):
+    def __init__(self, min_score=0.5, use_gpu=True, detection_width: int = 0):
         self._gpu_fraction = 0.5
         self._gpu_count = 1
 
         # Minimum score to consider as a detection.
         self.score_min = min_score
 
+        # If set, wider frames are shrunk to this width before detection. The SSD resizes its input anyway,
+        # so this only saves the color conversion and copying of the full frame.
+        self.detection_width = detection_width
+
+        # Tiled detection (for high resolution cameras). A grid of 1 x 1 is off.
+        self.tile_columns = 1
+        self.tile_rows = 1
+        self.tile_overlap = 0.2  # How much (as a fraction of the tile size) neighbouring tiles overlap.
+        self.nms_threshold = 0.5
+
+        # Keep at most this many detections (the best ones) per frame.
+        self.top_k = 100
+
         # Tensorflow attributes.
         self._detection_graph = None
         self._session = None
@@ -39,10 +53,10 @@ class Detector:
         if not use_gpu:
             os.environ["CUDA_VISIBLE_DEVICES"] = ""
 
-    def detect(self, image) -> List[TrackingRegion]:
+    def detect(self, image) -> Detections:
         """ Classify the input image and return the detections.
         Returns:
-            tuple: Boxes (rect), scores (float), and classes (int).
+            Detections: The boxes (in full frame pixels), scores and classes of the faces, best first.
         """
 
         # Cannot do a detection without the model being loaded.
@@ -50,34 +64,98 @@ class Detector:
             raise Exception("Detection Classifier Error", "Classifier model has not been loaded. Please load the model"
                                                           "before using the classifier.")
 
-        cvt_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        image_np_expanded = np.expand_dims(cvt_image, axis=0)
-        (boxes, scores, classes, num) = self._session.run(
-            [self._detection_boxes, self._detection_scores, self._detection_classes, self._num_detections],
-            feed_dict={self._image_tensor: image_np_expanded})
-
-        width = image.shape[1]
-        height = image.shape[0]
-        regions = []
+        if self.is_tiled:
+            return self._detect_tiled(image)
 
-        for i in range(len(boxes[0])):
-            box = boxes[0][i]
-            score = scores[0][i]
+        cvt_image = cv2.cvtColor(self._shrink(image), cv2.COLOR_BGR2RGB)
+        boxes, scores, classes = self._run(np.expand_dims(cvt_image, axis=0))
 
-            if score > self.score_min:
-                y_min, x_min, y_max, x_max = box
-                face_region = TrackingRegion()
+        # The boxes are normalized, so scaling them by the original frame size gives full resolution boxes.
+        is_detection = scores[0] > self.score_min
+        detections = Detections.from_normalized(boxes[0][is_detection], scores[0][is_detection],
+                                                classes[0][is_detection], image.shape[1], image.shape[0])
+        return detections.top_k(self.top_k)
 
-                # Get the absolute x and y limits for each box.
-                face_region.set_rect(
-                    left=int(x_min * width),
-                    right=int(x_max * width),
-                    top=int(y_min * height),
-                    bottom=int(y_max * height)
-                )
-                regions.append(face_region)
+    @property
+    def is_tiled(self) -> bool:
+        return self.tile_columns * self.tile_rows > 1
+
+    def _run(self, batch: np.array) -> (np.array, np.array, np.array):
+        """ Run the SSD on a batch of RGB images (all the same size). Returns the normalized
+        [y_min, x_min, y_max, x_max] boxes, the scores and the classes, for each image. """
+        boxes, scores, classes = self._session.run(
+            [self._detection_boxes, self._detection_scores, self._detection_classes],
+            feed_dict={self._image_tensor: batch})
+        return boxes, scores, classes
+
+    # ======================================================================================================================
+    # Tiled detection.
+    # ======================================================================================================================
+
+    def _detect_tiled(self, image) -> Detections:
+        """ Detect on the whole frame plus a grid of overlapping tiles, all in one batch, then merge the
+        detections with non-maximum suppression. The whole frame still finds the faces that are too big
+        for a single tile. """
+        height, width = image.shape[:2]
+        tiles = tile_bounds(width, height, self.tile_columns, self.tile_rows, self.tile_overlap)
+
+        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        tile_images = [self._shrink(rgb_image[top:bottom, left:right]) for left, top, right, bottom in tiles]
+        tile_height, tile_width = tile_images[0].shape[:2]
+        full_image = cv2.resize(rgb_image, (tile_width, tile_height), interpolation=cv2.INTER_AREA)
+
+        return self._detect_batch([full_image] + tile_images, [(0, 0, width, height)] + tiles)
+
+    def detect_crops(self, image, crops: List[tuple], input_size: int = 300) -> Detections:
+        """ Detect only inside these (left, top, right, bottom) areas of the image. Each crop is resized to
+        the same square input, so that they all run in one batch. A crop that isn't square is padded (on the
+        right or bottom) to a square first, so that the faces in it keep their shape. """
+        if not self.is_ready:
+            raise Exception("Detection Classifier Error", "Classifier model has not been loaded. Please load the model"
+                                                          "before using the classifier.")
+        if len(crops) == 0:
+            return Detections()
+
+        crop_images = []
+        bounds = []
+        for left, top, right, bottom in crops:
+            size = max(right - left, bottom - top)
+            crop_image = cv2.copyMakeBorder(image[top:bottom, left:right], 0, size - (bottom - top),
+                                            0, size - (right - left), cv2.BORDER_CONSTANT)
+            crop_image = cv2.resize(crop_image, (input_size, input_size), interpolation=cv2.INTER_AREA)
+            crop_images.append(cv2.cvtColor(crop_image, cv2.COLOR_BGR2RGB))
+            bounds.append((left, top, left + size, top + size))
+
+        return self._detect_batch(crop_images, bounds)
+
+    def _detect_batch(self, images: List[np.array], bounds: List[tuple]) -> Detections:
+        """ Run the SSD on a batch of RGB images, where each one shows the (left, top, right, bottom) area of
+        the frame. Returns the merged detections in frame pixels. """
+        boxes, scores, classes = self._run(np.stack(images))
+
+        # Map every box from its area back to the frame: [left, top, right, bottom] in pixels.
+        bounds = np.array(bounds, dtype=np.float32)
+        origin = bounds[:, np.newaxis, [0, 1, 0, 1]]
+        size = (bounds[:, [2, 3]] - bounds[:, [0, 1]])[:, np.newaxis, [0, 1, 0, 1]]
+        frame_boxes = origin + boxes[:, :, [1, 0, 3, 2]] * size
+
+        frame_boxes = frame_boxes.reshape(-1, 4)
+        scores = scores.reshape(-1)
+        classes = classes.reshape(-1)
+        is_detection = scores > self.score_min
+        frame_boxes, scores, classes = frame_boxes[is_detection], scores[is_detection], classes[is_detection]
+
+        keep = non_max_suppression(frame_boxes, scores, self.nms_threshold)[:self.top_k]
+        return Detections.from_boxes(frame_boxes[keep], scores[keep], classes[keep])
+
+    def _shrink(self, image):
+        """ The image at the detection width (or the image itself, if it is already no wider). """
+        width = image.shape[1]
+        if self.detection_width <= 0 or width <= self.detection_width:
+            return image
 
-        return regions
+        height = max(1, int(round(image.shape[0] * self.detection_width / width)))
+        return cv2.resize(image, (self.detection_width, height), interpolation=cv2.INTER_AREA)
 
     def load_model(self, path_to_model):
         """ Load a TensorFlow frozen inference graph. This should only be used once."""
@@ -110,3 +188,42 @@ class Detector:
         return self._session is not None
 
 
+# ======================================================================================================================
+# Support functions.
+# ======================================================================================================================
+
+
+def tile_bounds(width: int, height: int, columns: int, rows: int, overlap: float) -> List[tuple]:
+    """ The (left, top, right, bottom) of each tile in a grid of equally sized, overlapping tiles that
+    covers the frame. """
+    def spans(length: int, count: int):
+        size = int(np.ceil(length / (count - (count - 1) * overlap)))
+        size = min(size, length)
+        step = (length - size) / (count - 1) if count > 1 else 0
+        return [(int(round(i * step)), int(round(i * step)) + size) for i in range(count)]
+
+    return [(left, top, right, bottom) for top, bottom in spans(height, rows) for left, right in spans(width, columns)]
+
+
+def non_max_suppression(boxes: np.array, scores: np.array, threshold: float) -> List[int]:
+    """ Returns the indexes of the boxes ([left, top, right, bottom] rows) to keep, best first.
+
+    A box is suppressed if it overlaps a better box by more than the threshold. The overlap is measured
+    against the smaller of the two boxes, so that a face cut off at the edge of a tile is merged into the
+    whole face from the neighbouring tile. """
+    if len(boxes) == 0:
+        return []
+
+    # Every pair's overlap at once. There are only as many boxes as passed the score threshold.
+    regions = RegionBatch.from_rects(boxes, force_int=False)
+    overlaps = regions.intersection(regions) / np.maximum(np.minimum.outer(regions.area, regions.area), 1e-6)
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    keep = []
+
+    for best in np.argsort(-scores):
+        if suppressed[best]:
+            continue
+        keep.append(int(best))
+        suppressed |= overlaps[best] > threshold
+
+    return keep
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+
+"""
+Runs the face embedding in a pool of worker processes, so that dlib can use more than one core. Each frame
+is copied once into a ring of shared memory slots, and the workers read it from there, so the frame itself
+is never pickled. Only the face boxes go out to the workers, and only the vectors come back.
+
+The faces of a frame are split between the workers. A result thread collects the vectors, frees the frame's
+slot once every worker is done with it, and restarts any worker that has died (handing its unfinished work
+to the new process). A worker that keeps dying before it is ready (say, from a bad model path) is restarted
+with a growing delay, and after a few tries the pool gives up and raises the error to the caller. Jobs are
+collected by ID, so the caller gets them back in whatever order it asks for them (which for the counter is
+frame order).
+
+This needs Python 3.8 or later (for multiprocessing.shared_memory).
+"""
+
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import List, Tuple
+
+import numpy as np
+
+from tools.logger import Logger
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+
+class FrameRing:
+    """ A fixed number of frame-sized slots in one block of shared memory. """
+
+    def __init__(self, slot_count: int, slot_bytes: int):
+        self.slot_count = slot_count
+        self.slot_bytes = slot_bytes
+        self.memory = shared_memory.SharedMemory(create=True, size=slot_count * slot_bytes)
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def write(self, slot: int, frame: np.array) -> int:
+        """ Copy the frame into the slot. Returns the slot's offset in the shared memory. """
+        offset = slot * self.slot_bytes
+        view = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self.memory.buf, offset=offset)
+        np.copyto(view, frame)
+        del view
+        return offset
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+class EmbeddingJob:
+    """ The faces of one frame, and the vectors that have come back for them so far. """
+    def __init__(self, region_count: int, slot: int = None):
+        self.slot = slot
+        self.vectors = [None] * region_count
+        self.rejected = [False] * region_count
+        self.parts = {}  # Key: Part number. Value: The indexes of the regions in that part.
+        self.attempts = {}  # Key: Part number. Value: How many times it has been sent to a worker.
+
+    @property
+    def is_done(self) -> bool:
+        return len(self.parts) == 0
+
+
+class EmbeddingPool:
+
+    RESULT_TIMEOUT = 0.5  # How often (in seconds) the result thread checks that the workers are alive.
+    MAX_ATTEMPTS = 2  # A part that has been running in this many crashed workers is given up as failed.
+    RESTART_DELAY = 1.0  # The wait (in seconds) before restarting a worker that died while starting. Doubles each time.
+    MAX_START_FAILURES = 5  # The pool fails after a worker dies this many times in a row while starting.
+
+    def __init__(self, worker_count: int, landmark_model: str, face_model: str, quality=None, ring_slots: int = 4):
+        self.worker_count = max(1, worker_count)
+        self.ring_slots = max(1, ring_slots)
+        self.restart_count = 0
+        self._worker_args = (landmark_model, face_model, quality)
+
+        self._context = multiprocessing.get_context("spawn")
+        self._condition = threading.Condition()
+        self._ring = None
+        self._free_slots = []
+        self._jobs = {}
+        self._next_job_id = 0
+        self._next_worker = 0
+        self._is_closed = False
+        self._error = None
+
+        # Each worker has its own task queue, and a record of the tasks it hasn't finished.
+        self._result_queue = self._context.Queue()
+        self._processes = [None] * self.worker_count
+        self._task_queues = [None] * self.worker_count
+        self._pending = [{} for _ in range(self.worker_count)]
+        self._ready_events = [None] * self.worker_count  # Set by the worker once it has loaded its models.
+        self._start_failures = [0] * self.worker_count  # How many times in a row it has died while starting.
+        self._restart_times = [None] * self.worker_count  # When a dead worker is due to be restarted.
+        for worker in range(self.worker_count):
+            self._create_worker(worker).start()
+
+        self._result_thread = threading.Thread(name="embedding-results", target=self._collect_results, daemon=True)
+        self._result_thread.start()
+
+    # ======================================================================================================================
+    # Public functions.
+    # ======================================================================================================================
+
+    def submit(self, frame: np.array, regions) -> int:
+        """ Start embedding the regions of this frame. Blocks while every slot of the ring is in use.
+        Returns the ID of the job, to collect the results with. """
+        with self._condition:
+            self._check_error()
+            job_id = self._next_job_id
+            self._next_job_id += 1
+            if len(regions) == 0:
+                self._jobs[job_id] = EmbeddingJob(0)
+                return job_id
+
+            frame = np.ascontiguousarray(frame)
+            slot = self._acquire_slot(frame.nbytes)
+            offset = self._ring.write(slot, frame)
+
+            job = EmbeddingJob(len(regions), slot)
+            self._jobs[job_id] = job
+            boxes = [(r.left, r.top, r.right, r.bottom, r.confidence) for r in regions]
+
+            # Split the faces between the workers, starting with a different worker each time.
+            part_count = min(len(regions), self.worker_count)
+            for part, indexes in enumerate(np.array_split(np.arange(len(regions)), part_count)):
+                indexes = indexes.tolist()
+                job.parts[part] = indexes
+                job.attempts[part] = 0
+                task = (job_id, part, self._ring.name, offset, frame.shape, frame.dtype.str,
+                        [boxes[i] for i in indexes])
+                self._send((self._next_worker + part) % self.worker_count, task)
+            self._next_worker = (self._next_worker + part_count) % self.worker_count
+
+            return job_id
+
+    def result(self, job_id: int) -> Tuple[List[np.array], List[bool]]:
+        """ Wait for the job to finish. Returns the vector (or None) for each region, and whether each region
+        was rejected by the quality check. """
+        with self._condition:
+            job = self._jobs[job_id]
+            self._condition.wait_for(lambda: job.is_done or self._is_closed or self._error is not None)
+            del self._jobs[job_id]
+            self._check_error()
+            return job.vectors, job.rejected
+
+    def process_batch_with_quality(self, image: np.array, regions) -> Tuple[List[np.array], List[bool]]:
+        """ The same as VectorExtractor.process_batch_with_quality, but run in the pool. """
+        return self.result(self.submit(image, regions))
+
+    def close(self):
+        with self._condition:
+            self._is_closed = True
+            self._condition.notify_all()
+
+        # The result thread stops first, so that it can't restart a worker while they are being stopped.
+        self._result_thread.join()
+        for task_queue in self._task_queues:
+            task_queue.put(None)
+        for process in self._processes:
+            process.join(timeout=5.0)
+            if process.is_alive():
+                process.terminate()
+
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+
+        if self.restart_count > 0:
+            Logger.field("Embedding Worker Restarts", self.restart_count)
+
+    # ======================================================================================================================
+    # Private functions.
+    # ======================================================================================================================
+
+    def _acquire_slot(self, frame_bytes: int) -> int:
+        """ A free slot of the ring (called with the lock held). A frame that doesn't fit the slots waits for
+        the ring to empty, then replaces it with a bigger one. """
+        if self._ring is None or frame_bytes > self._ring.slot_bytes:
+            self._condition.wait_for(lambda: self._ring is None or len(self._free_slots) == self._ring.slot_count)
+            if self._ring is not None:
+                self._ring.close()
+            self._ring = FrameRing(self.ring_slots, frame_bytes)
+            self._free_slots = list(range(self.ring_slots))
+
+        self._condition.wait_for(lambda: len(self._free_slots) > 0 or self._error is not None)
+        self._check_error()
+        return self._free_slots.pop(0)
+
+    def _check_error(self):
+        if self._error is not None:
+            raise Exception("Embedding Pool Error", self._error)
+
+    def _send(self, worker: int, task: tuple):
+        job_id, part = task[0], task[1]
+        self._jobs[job_id].attempts[part] += 1
+        self._pending[worker][(job_id, part)] = task
+        self._task_queues[worker].put(task)
+
+    def _create_worker(self, worker: int):
+        """ A new (not yet started) process for this worker, with a new task queue. """
+        self._task_queues[worker] = self._context.Queue()
+        self._ready_events[worker] = self._context.Event()
+        self._processes[worker] = self._context.Process(
+            name="embedding-worker-{}".format(worker), target=_run_worker, daemon=True,
+            args=(worker, self._task_queues[worker], self._result_queue, self._ready_events[worker]) +
+            self._worker_args)
+        return self._processes[worker]
+
+    def _collect_results(self):
+        while not self._is_closed:
+            try:
+                worker, job_id, part, vectors, rejected = self._result_queue.get(timeout=self.RESULT_TIMEOUT)
+            except queue.Empty:
+                self._restart_dead_workers()
+                continue
+
+            with self._condition:
+                self._pending[worker].pop((job_id, part), None)
+                self._complete_part(job_id, part, vectors, rejected)
+            self._restart_dead_workers()
+
+    def _complete_part(self, job_id: int, part: int, vectors: list, rejected: list):
+        job = self._jobs.get(job_id)
+        if job is None or part not in job.parts:
+            return
+
+        for index, vector, is_rejected in zip(job.parts.pop(part), vectors, rejected):
+            job.vectors[index] = vector
+            job.rejected[index] = is_rejected
+
+        # Every worker is done with the frame, so its slot can be reused.
+        if job.is_done:
+            if job.slot is not None:
+                self._free_slots.append(job.slot)
+            self._condition.notify_all()
+
+    def _restart_dead_workers(self):
+        """ Restart each worker that has died (once its restart delay has passed), and give the new process the
+        dead worker's unfinished tasks. The processes are started without the lock held. """
+        with self._condition:
+            new_processes = [self._processes[worker] for worker in self._get_restarts()]
+
+        for process in new_processes:
+            process.start()
+
+    def _get_restarts(self) -> List[int]:
+        """ The workers that are due to be restarted now (called with the lock held). """
+        if self._is_closed or self._error is not None:
+            return []
+
+        restarts = []
+        for worker, process in enumerate(self._processes):
+            if process.is_alive():
+                continue
+
+            if self._restart_times[worker] is None:
+                self._restart_times[worker] = self._schedule_restart(worker, process.exitcode)
+                if self._error is not None:
+                    return []
+
+            if time.time() < self._restart_times[worker]:
+                continue
+
+            self._restart_times[worker] = None
+            self.restart_count += 1
+            restarts.append(worker)
+
+        for worker in restarts:
+            unfinished, self._pending[worker] = self._pending[worker], {}
+            self._create_worker(worker)
+            for (job_id, part), task in unfinished.items():
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                if job.attempts[part] >= self.MAX_ATTEMPTS:
+                    count = len(job.parts[part])
+                    self._complete_part(job_id, part, [None] * count, [False] * count)
+                else:
+                    self._send(worker, task)
+
+        return restarts
+
+    def _schedule_restart(self, worker: int, exit_code: int) -> float:
+        """ When to restart this worker that has just died. A worker that was running is restarted straight
+        away. One that died while starting waits longer each time, and fails the pool if it keeps dying. """
+        if self._ready_events[worker].is_set():
+            self._start_failures[worker] = 0
+            Logger.error("Embedding worker {} stopped (exit code {}). Restarting it.".format(worker, exit_code))
+            return time.time()
+
+        self._start_failures[worker] += 1
+        if self._start_failures[worker] >= self.MAX_START_FAILURES:
+            self._error = "Embedding worker {} failed to start {} times in a row (exit code {}). Check that the " \
+                          "models can be loaded.".format(worker, self._start_failures[worker], exit_code)
+            Logger.error(self._error)
+            self._condition.notify_all()
+            return time.time()
+
+        delay = self.RESTART_DELAY * 2 ** (self._start_failures[worker] - 1)
+        Logger.error("Embedding worker {} failed to start (exit code {}). Restarting it in {:.1f} s.".format(
+            worker, exit_code, delay))
+        return time.time() + delay
+
+
+# ======================================================================================================================
+# Worker process.
+# ======================================================================================================================
+
+
+def _run_worker(worker: int, task_queue, result_queue, ready_event, landmark_model: str, face_model: str, quality):
+    # Imported here, so that only the worker processes load dlib's models.
+    from counter.vector_extractor import VectorExtractor
+    from tools.tracking_tool import TrackingRegion
+
+    extractor = VectorExtractor()
+    extractor.initialize(landmark_model, face_model)
+    extractor.quality = quality
+    ready_event.set()
+    memory = None
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        job_id, part, name, offset, shape, dtype, boxes = task
+        if memory is None or memory.name != name:
+            if memory is not None:
+                memory.close()
+            memory = _attach(name)
+
+        regions = []
+        for left, top, right, bottom, confidence in boxes:
+            region = TrackingRegion(left=left, right=right, top=top, bottom=bottom)
+            region.confidence = confidence
+            regions.append(region)
+
+        frame = np.ndarray(shape, dtype=np.dtype(dtype), buffer=memory.buf, offset=offset)
+        try:
+            vectors, rejected = extractor.process_batch_with_quality(frame, regions)
+        except Exception as e:
+            Logger.error("Embedding worker {}: {}".format(worker, e))
+            vectors, rejected = [None] * len(regions), [False] * len(regions)
+        del frame
+
+        result_queue.put((worker, job_id, part, vectors, rejected))
+
+    if memory is not None:
+        memory.close()
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """ Open the ring made by the main process. Only the main process unlinks it. """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 the memory is always tracked, but the (spawned) workers share the main process's
+        # resource tracker, so it is still only cleaned up once.
+        return shared_memory.SharedMemory(name=name)
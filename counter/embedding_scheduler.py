@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""
+Decides which faces actually need a new feature vector this frame. The faces are tracked from frame to frame,
+and each track remembers the session it was last matched to. A track is only embedded when it is new (or its
+session is not yet full), or when it has gone a number of frames without a new vector. The number of faces
+embedded per frame is capped by a budget, with new and bigger faces served first.
+"""
+
+from typing import List
+
+from counter.proximity_tracker import ProximityTracker
+from tools.tracking_tool import Tracker, TrackingRegion, Tracklet
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+
+class TrackState:
+    """ Scheduling state that is carried by a tracklet between embeddings. """
+    def __init__(self, tracklet: Tracklet):
+        self.tracklet = tracklet
+        self.session = None
+        self.last_embedded_frame = None
+
+    @property
+    def has_live_session(self) -> bool:
+        return self.session is not None and not self.session.has_ended
+
+    @property
+    def is_new(self) -> bool:
+        """ A track is new until it belongs to a live, full session. """
+        return not self.has_live_session or not self.session.is_full
+
+
+class ScheduledFace:
+    """ A detected face for this frame, the track it belongs to, and whether it should be embedded. """
+    def __init__(self, region: TrackingRegion, track: TrackState, embed: bool):
+        self.region = region
+        self.track = track
+        self.embed = embed
+
+
+class EmbeddingScheduler:
+
+    def __init__(self, interval: int = 10, budget: int = 0, tracker: Tracker = None):
+        self.interval = interval  # Re-embed a tracked face after this many frames.
+        self.budget = budget  # Maximum faces to embed per frame. 0 means there is no limit.
+        self.tracker = tracker if tracker is not None else ProximityTracker()
+        self.tracks = {}  # Key: Tracklet ID.
+
+    def schedule(self, regions: List[TrackingRegion], frame_index: int) -> List[ScheduledFace]:
+        """ Track the regions, and decide which of them need to be embedded this frame. """
+
+        dead_tracklets = self.tracker.process(regions, frame_index)
+        for tracklet in dead_tracklets:
+            self.tracks.pop(tracklet.id, None)
+
+        # Find the track that each of this frame's regions was merged into.
+        tracklets_by_region = {}
+        for tracklet in self.tracker.tracklets:
+            if tracklet.last_frame_index == frame_index:
+                tracklets_by_region[id(tracklet.last_raw_region)] = tracklet
+
+        faces = []
+        for region in regions:
+            tracklet = tracklets_by_region[id(region)]
+            if tracklet.id not in self.tracks:
+                self.tracks[tracklet.id] = TrackState(tracklet)
+            faces.append(ScheduledFace(region, self.tracks[tracklet.id], embed=False))
+
+        # New tracks first, then the biggest faces.
+        candidates = [f for f in faces if self._is_due(f.track, frame_index)]
+        candidates.sort(key=lambda f: (not f.track.is_new, -f.region.area))
+        if self.budget > 0:
+            candidates = candidates[:self.budget]
+
+        # Recorded here (and not when the vector comes back), so that the frames already in flight in the
+        # pipeline don't schedule the same track again.
+        for face in candidates:
+            face.embed = True
+            face.track.last_embedded_frame = frame_index
+
+        return faces
+
+    def _is_due(self, track: TrackState, frame_index: int) -> bool:
+        if track.is_new or track.last_embedded_frame is None:
+            return True
+        return frame_index - track.last_embedded_frame >= self.interval
+
+    def reset(self):
+        self.tracker.reset()
+        self.tracks = {}
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""
+A cheap check of whether a face is worth embedding. Blurred, turned away and very small faces give noisy
+vectors, which then split a person into several sessions. Each face gets a score between 0 and 1, made by
+multiplying four factors: the sharpness of the crop (the variance of its Laplacian), how frontal the pose
+is (from the 5-point landmarks that are already found for the face chip), the size of the box, and the
+detector's confidence.
+"""
+
+import cv2
+import numpy as np
+
+from tools.region import Region
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+
+class FaceQuality:
+
+    SHARPNESS_SIZE = 64  # The crop is shrunk to this size first, so that sharpness doesn't depend on face size.
+
+    # The nose sits this far below the eye line (in eye distances) on a level face, from dlib's mean 5-point face.
+    NOSE_DROP = 0.77
+
+    def __init__(self, min_score: float = 0.3, sharpness_reference: float = 100.0, size_reference: int = 100,
+                 yaw_limit: float = 0.4, pitch_limit: float = 0.5):
+        self.min_score = min_score
+        self.sharpness_reference = sharpness_reference  # A Laplacian variance at or above this is fully sharp.
+        self.size_reference = size_reference  # A face at least this wide (in pixels) scores fully for size.
+        self.yaw_limit = yaw_limit  # The sideways nose offset (in eye distances) that scores zero.
+        self.pitch_limit = pitch_limit  # The change in nose drop (in eye distances) that scores zero.
+
+    def accepts(self, image: np.array, region: Region, landmarks: np.array) -> bool:
+        """ Whether the face in this region is good enough to embed. """
+        return self.score(image, region, landmarks) >= self.min_score
+
+    def score(self, image: np.array, region: Region, landmarks: np.array) -> float:
+        confidence = float(np.clip(getattr(region, "confidence", 1.0), 0.0, 1.0))
+        size = min(1.0, region.width / self.size_reference)
+        return self.sharpness(image, region) * self.pose(landmarks) * size * confidence
+
+    def sharpness(self, image: np.array, region: Region) -> float:
+        left, top = max(0, region.left), max(0, region.top)
+        right, bottom = min(image.shape[1], region.right), min(image.shape[0], region.bottom)
+        if right - left < 2 or bottom - top < 2:
+            return 0.0
+
+        crop = cv2.resize(image[top:bottom, left:right], (self.SHARPNESS_SIZE, self.SHARPNESS_SIZE),
+                          interpolation=cv2.INTER_AREA)
+        if crop.ndim == 3:
+            crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        variance = cv2.Laplacian(crop, cv2.CV_64F).var()
+        return min(1.0, variance / self.sharpness_reference)
+
+    def pose(self, landmarks: np.array) -> float:
+        """ Landmarks are dlib's 5 points: two corners of each eye, then the base of the nose. """
+        eye_a = landmarks[0:2].mean(axis=0)
+        eye_b = landmarks[2:4].mean(axis=0)
+        eye_distance = np.linalg.norm(eye_b - eye_a)
+        if eye_distance < 1:
+            return 0.0
+
+        # The nose's offset from between the eyes, along and below the eye line.
+        along = (eye_b - eye_a) / eye_distance
+        below = np.array([-along[1], along[0]])
+        offset = landmarks[4] - (eye_a + eye_b) / 2
+        yaw = abs(offset.dot(along)) / eye_distance
+        pitch = abs(abs(offset.dot(below)) / eye_distance - self.NOSE_DROP)
+
+        yaw_score = max(0.0, 1.0 - yaw / self.yaw_limit)
+        pitch_score = max(0.0, 1.0 - pitch / self.pitch_limit)
+        return yaw_score * pitch_score
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+"""
+A gallery of the faces from sessions that have already ended, so that a returning visitor can be recognised.
+The embeddings live in a memory-mapped matrix on disk (a ring buffer of fixed capacity), and are indexed with
+random-projection LSH (probing the neighbouring buckets as well) so that a lookup only has to check a small
+share of the gallery. Everything (including the hash codes) is persisted, so the gallery and its index survive
+a restart. New faces are flushed to disk in batches (at most once every flush interval, and on close), so that
+ending a session doesn't wait on the disk.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from tools import pather
+from tools.logger import Logger
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+
+class GalleryMatch:
+    def __init__(self, session_id: int, face_id: str, distance: float):
+        self.session_id = session_id
+        self.face_id = face_id
+        self.distance = distance
+
+
+class SessionGallery:
+
+    META_FILE = "meta.json"
+    EMBEDDINGS_FILE = "embeddings.npy"
+    IDENTITIES_FILE = "identities.npy"
+    CODES_FILE = "codes.npy"
+    PROJECTION_FILE = "projection.npy"
+
+    IDENTITY_DTYPE = np.dtype([("session_id", "<i8"), ("face_id", "S32")])
+
+    def __init__(self, directory: str = "gallery", capacity: int = 10000, dimensions: int = 128,
+                 dtype: str = "float16", hash_tables: int = 20, hash_bits: int = 12, min_index_size: int = 256,
+                 probes: int = 4, flush_interval: float = 10.0):
+
+        if hash_bits > 32:
+            raise ValueError("Gallery hash codes can use at most 32 bits (got {}).".format(hash_bits))
+
+        self.directory = directory
+        self.capacity = capacity
+        self.dimensions = dimensions
+        self.dtype = np.dtype(dtype)
+        self.hash_tables = hash_tables
+        self.hash_bits = hash_bits
+        self.probes = probes  # Also look in the buckets one bit away, for this many of the least certain bits.
+        self.min_index_size = min_index_size  # Below this size, a brute force search is fast enough.
+        self.flush_interval = flush_interval  # The most time (in seconds) that a new face waits to be flushed.
+
+        # Ring buffer state.
+        self.count = 0
+        self.next_index = 0
+        self.is_dirty = False
+        self._time_last_flush = time.time()
+
+        # Memory-mapped storage.
+        self._embeddings = None
+        self._identities = None
+        self._codes = None
+
+        # LSH index. A center and a set of hyperplanes, and one bucket dict (code: set of rows) per table.
+        self._center = None
+        self._planes = None
+        self._buckets = []
+
+        self._open()
+
+    # ======================================================================================================================
+    # Public methods.
+    # ======================================================================================================================
+
+    def add(self, session_id: int, face_id: str, vector: np.array):
+        """ Store the embedding of an ended session, overwriting the oldest entry once the gallery is full. """
+        row = self.next_index
+        if self.count == self.capacity and self.is_indexed:
+            self._remove_from_buckets(row)
+
+        self._embeddings[row] = vector
+        self._identities[row] = (session_id, face_id.encode("ascii"))
+
+        if self.is_indexed:
+            self._codes[row] = self._hash(np.asarray(vector, dtype=np.float32)[np.newaxis])[0]
+            self._add_to_buckets(row)
+
+        self.next_index = (self.next_index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+        if not self.is_indexed and self.count >= self.min_index_size:
+            self._build_index()
+
+        self.is_dirty = True
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """ Flush the new faces to disk, if the flush interval has passed since the last flush. """
+        if self.is_dirty and time.time() - self._time_last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """ Write the new faces (and the ring buffer state) to disk. """
+        self._flush()
+        self.is_dirty = False
+        self._time_last_flush = time.time()
+
+    def close(self):
+        if self.is_dirty:
+            self.flush()
+
+    def query(self, vector: np.array, threshold: float):
+        """ Find the closest stored face to this vector. Returns a GalleryMatch, or None if nothing is
+        closer than the threshold. """
+        if self.count == 0:
+            return None
+
+        vector = np.asarray(vector, dtype=np.float32)
+        if self.is_indexed:
+            rows = self._candidates(vector)
+            if len(rows) == 0:
+                return None
+        else:
+            rows = np.arange(self.count)
+
+        embeddings = self._embeddings[rows].astype(np.float32)
+        distances = np.linalg.norm(embeddings - vector, axis=1)
+        best = int(np.argmin(distances))
+        if distances[best] >= threshold:
+            return None
+
+        identity = self._identities[rows[best]]
+        return GalleryMatch(int(identity["session_id"]), identity["face_id"].decode("ascii"), float(distances[best]))
+
+    @property
+    def is_indexed(self) -> bool:
+        return self._planes is not None
+
+    # ======================================================================================================================
+    # LSH index.
+    # ======================================================================================================================
+
+    def _hash(self, vectors: np.array) -> np.array:
+        """ Returns the (n x tables) array of hash codes for these vectors. """
+        return self._pack(self._project(vectors) > 0)
+
+    def _project(self, vectors: np.array) -> np.array:
+        """ The (n x tables x bits) signed distance of each vector from each hyperplane. """
+        projections = (vectors - self._center).dot(self._planes.T)
+        return projections.reshape(len(vectors), self.hash_tables, self.hash_bits)
+
+    def _pack(self, bits: np.array) -> np.array:
+        weights = (1 << np.arange(self.hash_bits, dtype=np.uint64))
+        return bits.dot(weights).astype(np.uint32)
+
+    def _candidates(self, vector: np.array) -> np.array:
+        """ All the rows that share a bucket with this vector in at least one table, or that are in one of the
+        probed buckets next to it. The probes flip the bits whose hyperplanes the vector is closest to, since
+        those are the bits that a slightly different face of the same person is most likely to land across. """
+        projections = self._project(vector[np.newaxis])[0]
+        codes = self._pack(projections > 0)
+
+        probe_codes = codes[:, np.newaxis]
+        if self.probes > 0:
+            nearest_bits = np.argsort(np.abs(projections), axis=1)[:, :self.probes]
+            flips = (np.uint32(1) << nearest_bits.astype(np.uint32))
+            probe_codes = np.hstack([probe_codes, codes[:, np.newaxis] ^ flips])
+
+        rows = set()
+        for table, table_codes in enumerate(probe_codes.tolist()):
+            buckets = self._buckets[table]
+            for code in table_codes:
+                rows.update(buckets.get(code, ()))
+        return np.fromiter(rows, dtype=np.int64, count=len(rows))
+
+    def _build_index(self):
+        """ Center the hyperplanes on the data we already have, and hash every stored row. """
+        embeddings = self._embeddings[:self.count].astype(np.float32)
+        random_state = np.random.RandomState(0)
+        self._center = embeddings.mean(axis=0)
+        self._planes = random_state.normal(size=(self.hash_tables * self.hash_bits, self.dimensions))
+        self._planes = self._planes.astype(np.float32)
+        self._codes[:self.count] = self._hash(embeddings)
+
+        projection = np.vstack([self._center[np.newaxis], self._planes])
+        np.save(os.path.join(self.directory, self.PROJECTION_FILE), projection)
+        self._rebuild_buckets()
+        Logger.field("Gallery Indexed", "{} Faces".format(self.count))
+
+    def _rebuild_buckets(self):
+        self._buckets = [{} for _ in range(self.hash_tables)]
+        for row in range(self.count):
+            self._add_to_buckets(row)
+
+    def _add_to_buckets(self, row: int):
+        for table, code in enumerate(self._codes[row].tolist()):
+            self._buckets[table].setdefault(code, set()).add(row)
+
+    def _remove_from_buckets(self, row: int):
+        for table, code in enumerate(self._codes[row].tolist()):
+            bucket = self._buckets[table].get(code)
+            if bucket is not None:
+                bucket.discard(row)
+                if len(bucket) == 0:
+                    del self._buckets[table][code]
+
+    # ======================================================================================================================
+    # Persistence.
+    # ======================================================================================================================
+
+    def _open(self):
+        """ Load the gallery from disk, or create a new one if it doesn't exist (or has a different layout). """
+        pather.create(self.directory)
+        meta = self._read_meta()
+
+        layout = self._layout()
+        if meta is not None and {k: meta.get(k) for k in layout} != layout:
+            Logger.field("Gallery Reset", "The stored layout does not match the settings.", red=True)
+            meta = None
+
+        mode = "r+" if meta is not None else "w+"
+        self._embeddings = open_memmap(self._path(self.EMBEDDINGS_FILE), mode=mode, dtype=self.dtype,
+                                       shape=(self.capacity, self.dimensions))
+        self._identities = open_memmap(self._path(self.IDENTITIES_FILE), mode=mode, dtype=self.IDENTITY_DTYPE,
+                                       shape=(self.capacity,))
+        self._codes = open_memmap(self._path(self.CODES_FILE), mode=mode, dtype=np.uint32,
+                                  shape=(self.capacity, self.hash_tables))
+
+        if meta is None:
+            self._write_meta()
+            return
+
+        self.count = meta["count"]
+        self.next_index = meta["next_index"]
+        if meta["indexed"]:
+            projection = np.load(self._path(self.PROJECTION_FILE))
+            self._center = projection[0]
+            self._planes = projection[1:]
+            self._rebuild_buckets()
+
+        Logger.field("Gallery Loaded", "{} Faces".format(self.count))
+
+    def _layout(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "dimensions": self.dimensions,
+            "dtype": self.dtype.name,
+            "hash_tables": self.hash_tables,
+            "hash_bits": self.hash_bits
+        }
+
+    def _read_meta(self):
+        meta_path = self._path(self.META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r") as f:
+            return json.load(f)
+
+    def _write_meta(self):
+        """ Atomically replace the meta file, so a crash can't leave it half written. """
+        meta = self._layout()
+        meta["count"] = self.count
+        meta["next_index"] = self.next_index
+        meta["indexed"] = self.is_indexed
+
+        meta_path = self._path(self.META_FILE)
+        temp_path = meta_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(meta, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, meta_path)
+
+    def _flush(self):
+        self._embeddings.flush()
+        self._identities.flush()
+        self._codes.flush()
+        self._write_meta()
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self.directory, file_name)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+"""
+Match the feature vectors of a frame to the live sessions. All of the vector-to-session distances are
+computed as a single matrix, and the pairs are then assigned either greedily (closest pair first) or optimally
+with the Hungarian algorithm.
+"""
+
+from typing import List, Tuple
+
+import numpy as np
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+ASSIGN_GREEDY = "greedy"
+ASSIGN_HUNGARIAN = "hungarian"
+ASSIGNMENT_METHODS = [ASSIGN_GREEDY, ASSIGN_HUNGARIAN]
+
+
+def session_distance_matrix(vectors: np.array, sessions) -> np.array:
+    """ Returns a (vectors x sessions) matrix, where each value is the same as session.get_distance(vector). """
+
+    n_sessions = len(sessions)
+    compare_vectors = [s.compare_vectors for s in sessions]
+    divisors = np.array([s.distance_divisor for s in sessions], dtype=np.float64)
+    compare_length = max([len(c) for c in compare_vectors])
+
+    # Each session is compared against a single vector (such as its centroid).
+    if compare_length == 1:
+        stack = np.concatenate(compare_vectors).astype(np.float64)
+        return euclidean_distance_matrix(vectors, stack) / divisors
+
+    # Stack the compare vectors of every session, padding the short ones (and masking them out).
+    dimensions = vectors.shape[1]
+    stack = np.zeros((n_sessions, compare_length, dimensions), dtype=np.float64)
+    mask = np.zeros((n_sessions, compare_length), dtype=np.float64)
+
+    for i, c in enumerate(compare_vectors):
+        stack[i, :len(c)] = c
+        mask[i, :len(c)] = 1.0
+
+    flat_stack = stack.reshape(-1, dimensions)
+    distances = euclidean_distance_matrix(vectors, flat_stack).reshape(len(vectors), n_sessions, compare_length)
+    return (distances * mask).sum(axis=2) / divisors
+
+
+def euclidean_distance_matrix(a: np.array, b: np.array) -> np.array:
+    """ Pairwise euclidean distance between the rows of a and the rows of b. """
+    a_squared = np.einsum("ij,ij->i", a, a)[:, None]
+    b_squared = np.einsum("ij,ij->i", b, b)[None, :]
+    squared = a_squared + b_squared - 2.0 * a.dot(b.T)
+    return np.sqrt(np.maximum(squared, 0.0))
+
+
+def assign(cost: np.array, threshold: float, method: str = ASSIGN_GREEDY) -> List[Tuple[int, int]]:
+    """ Pair up the rows and columns of the cost matrix. A pair can only be made if its cost is below the
+    threshold, and each row and column is used at most once. Returns a list of (row, column) pairs. """
+    if cost.size == 0:
+        return []
+
+    if method == ASSIGN_GREEDY:
+        return greedy_assignment(cost, threshold)
+
+    if method == ASSIGN_HUNGARIAN:
+        return hungarian_assignment(cost, threshold)
+
+    raise ValueError("Unknown assignment method '{}'. Use one of: {}.".format(method, ASSIGNMENT_METHODS))
+
+
+def greedy_assignment(cost: np.array, threshold: float) -> List[Tuple[int, int]]:
+    """ Repeatedly take the closest remaining pair, until no pair is below the threshold. """
+    cost = np.where(cost < threshold, cost, np.inf)
+    pairs = []
+
+    for _ in range(min(cost.shape)):
+        index = np.argmin(cost)
+        row, col = np.unravel_index(index, cost.shape)
+        if not np.isfinite(cost[row, col]):
+            break
+
+        pairs.append((int(row), int(col)))
+        cost[row, :] = np.inf
+        cost[:, col] = np.inf
+
+    return pairs
+
+
+def hungarian_assignment(cost: np.array, threshold: float) -> List[Tuple[int, int]]:
+    """ Find the assignment with the lowest total cost, then drop any pairs that are not below the threshold. """
+
+    # Every pair above the threshold costs the same as leaving the row unassigned.
+    limit = threshold * 2.0 + 1.0
+    bounded_cost = np.where(cost < threshold, cost, limit)
+
+    transposed = bounded_cost.shape[0] > bounded_cost.shape[1]
+    if transposed:
+        bounded_cost = bounded_cost.T
+
+    pairs = _solve_hungarian(bounded_cost)
+    if transposed:
+        pairs = [(col, row) for row, col in pairs]
+
+    pairs = [(row, col) for row, col in pairs if cost[row, col] < threshold]
+    pairs.sort()
+    return pairs
+
+
+def _solve_hungarian(cost: np.array) -> List[Tuple[int, int]]:
+    """ The O(n^3) shortest augmenting path algorithm, for a matrix with no more rows than columns.
+    Each row is assigned to exactly one column. The inner column scans are vectorized. """
+
+    n_rows, n_cols = cost.shape
+    u = np.zeros(n_rows + 1)
+    v = np.zeros(n_cols + 1)
+    col_owner = np.zeros(n_cols + 1, dtype=np.int64)  # 1-based row assigned to each column (0 is none).
+    way = np.zeros(n_cols + 1, dtype=np.int64)
+
+    for row in range(1, n_rows + 1):
+        col_owner[0] = row
+        j0 = 0
+        min_values = np.full(n_cols + 1, np.inf)
+        used = np.zeros(n_cols + 1, dtype=bool)
+
+        while True:
+            used[j0] = True
+            i0 = col_owner[j0]
+            free = ~used[1:]
+
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            improved = free & (reduced < min_values[1:])
+            min_values[1:][improved] = reduced[improved]
+            way[1:][improved] = j0
+
+            candidates = np.where(free, min_values[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+
+            u[col_owner[used]] += delta
+            v[used] -= delta
+            min_values[1:][free] -= delta
+
+            j0 = j1
+            if col_owner[j0] == 0:
+                break
+
+        # Walk the augmenting path back to the start.
+        while j0 != 0:
+            j1 = way[j0]
+            col_owner[j0] = col_owner[j1]
+            j0 = j1
+
+    return [(int(col_owner[j]) - 1, j - 1) for j in range(1, n_cols + 1) if col_owner[j] != 0]
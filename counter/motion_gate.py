@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""
+A cheap check for whether anything in the scene has changed, so that the face detector only runs when it
+could find something. Each frame is shrunk, converted to grayscale and blurred, then compared to the previous
+one. If there has been no motion for a while (and there are no live sessions), the gate goes idle, and the
+camera is polled at a low rate until the first motion.
+"""
+
+import cv2
+import numpy as np
+
+from tools.logger import Logger
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+
+class MotionGate:
+
+    PIXEL_THRESHOLD = 25  # How much (out of 255) a pixel has to change to count as motion.
+
+    def __init__(self, width: int = 160, min_area: float = 0.002, quiet_seconds: float = 10.0,
+                 idle_interval: float = 0.5):
+        self.width = width
+        self.min_area = min_area  # The fraction of the frame that has to change to count as motion.
+        self.quiet_seconds = quiet_seconds
+        self.idle_interval = idle_interval  # Seconds between frames while idle.
+
+        self.is_idle = False
+        self.skipped_count = 0
+        self._previous = None
+        self._time_last_motion = None
+
+    def reset(self):
+        self.is_idle = False
+        self._previous = None
+        self._time_last_motion = None
+
+    def check(self, frame: np.array, timestamp: float, has_live_sessions: bool) -> bool:
+        """ Returns True if the frame should go through face detection. Live sessions always need detection,
+        since a face that is standing still still has to keep its session alive. """
+        has_motion = self.has_motion(frame)
+        if has_motion or self._time_last_motion is None:
+            self._time_last_motion = timestamp
+
+        is_quiet = timestamp - self._time_last_motion >= self.quiet_seconds
+        self._set_idle(is_quiet and not has_live_sessions)
+
+        if has_motion or has_live_sessions:
+            return True
+
+        self.skipped_count += 1
+        return False
+
+    def has_motion(self, frame: np.array) -> bool:
+        height = max(1, int(frame.shape[0] * self.width / frame.shape[1]))
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        small = cv2.GaussianBlur(small, (5, 5), 0)
+
+        previous, self._previous = self._previous, small
+        if previous is None or previous.shape != small.shape:
+            return True
+
+        changed = cv2.absdiff(small, previous) > self.PIXEL_THRESHOLD
+        return np.count_nonzero(changed) >= self.min_area * changed.size
+
+    def _set_idle(self, is_idle: bool):
+        if is_idle != self.is_idle:
+            Logger.field("Motion Gate", "Idle" if is_idle else "Active")
+        self.is_idle = is_idle
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+"""
+A staged, multi-threaded frame pipeline. Each stage runs on its own thread and is joined to the next
+by a bounded queue, so that (for example) the detector can work on frame N+1 while dlib embeds frame N.
+Every stage has exactly one worker, so frames always leave the pipeline in the order they entered it.
+"""
+
+import queue
+import threading
+
+from tools.logger import Logger
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+# What to do when the source produces frames faster than the first stage can consume them.
+DROP_NONE = "block"  # Wait for space in the queue (never drop a frame).
+DROP_OLDEST = "drop_oldest"  # Discard the oldest queued frame to make room for the new one.
+DROP_NEWEST = "drop_newest"  # Discard the incoming frame if the queue is full.
+DROP_POLICIES = [DROP_NONE, DROP_OLDEST, DROP_NEWEST]
+
+# Marks the end of the stream. It is never dropped.
+_END = object()
+
+# How often (in seconds) a blocked thread checks if the pipeline has been stopped.
+_POLL_INTERVAL = 0.1
+
+
+class FramePacket:
+    """ All of the data for a single frame, as it flows through the pipeline stages. """
+    def __init__(self, index: int, frame, timestamp: float = None):
+        self.index = index
+        self.frame = frame
+        self.timestamp = timestamp  # When the frame was captured.
+        self.valid_regions = []
+        self.invalid_detections = None  # Only turned into regions if something (like the renderer) needs them.
+        self.scheduled_faces = None
+        self.embedding_job = None  # The ID of the frame's job in the embedding pool, once it is submitted.
+        self.vector_wrappers = []
+
+    @property
+    def invalid_regions(self):
+        if self.invalid_detections is None:
+            return []
+        return self.invalid_detections.regions
+
+
+class PipelineStage(threading.Thread):
+    def __init__(self, name: str, process_fn, input_queue: queue.Queue, output_queue: queue.Queue,
+                 stop_event: threading.Event):
+        super().__init__(name=name, daemon=True)
+        self.process_fn = process_fn
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.stop_event = stop_event
+        self.error = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                item = self.input_queue.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+
+            if item is _END:
+                break
+
+            try:
+                result = self.process_fn(item)
+            except BaseException as e:
+                # Hand the error to the main thread, and close the stream behind it.
+                self.error = e
+                break
+
+            if result is not None:
+                _put(self.output_queue, result, self.stop_event)
+
+        _put(self.output_queue, _END, self.stop_event)
+
+
+class Pipeline:
+
+    def __init__(self, queue_depth: int = 4, drop_policy: str = DROP_NONE):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError("Unknown drop policy '{}'. Use one of: {}.".format(drop_policy, DROP_POLICIES))
+
+        self.queue_depth = max(1, queue_depth)
+        self.drop_policy = drop_policy
+        self.stages = []
+        self.dropped_count = 0
+        self._source_error = None
+        self._stop_event = threading.Event()
+
+    def add_stage(self, name: str, process_fn):
+        """ Add a worker stage. The function takes a packet and returns it (or None to discard it). """
+        self.stages.append((name, process_fn))
+
+    def stop(self):
+        """ Stop the pipeline. Any frames still in flight are abandoned. """
+        self._stop_event.set()
+
+    def run(self, source_fn, sink_fn):
+        """ Run the pipeline until the source is exhausted. The source function is called on its own thread
+        and returns the next packet (or None at the end of the stream). The sink is called on this thread,
+        in frame order, for every packet that makes it through the stages. """
+
+        self._stop_event.clear()
+        self.dropped_count = 0
+        self._source_error = None
+        source_queue = queue.Queue(maxsize=self.queue_depth)
+        input_queue = source_queue
+        workers = []
+
+        for name, process_fn in self.stages:
+            output_queue = queue.Queue(maxsize=self.queue_depth)
+            workers.append(PipelineStage(name, process_fn, input_queue, output_queue, self._stop_event))
+            input_queue = output_queue
+
+        source = threading.Thread(name="capture", target=self._run_source, args=(source_fn, source_queue),
+                                  daemon=True)
+        for worker in workers:
+            worker.start()
+        source.start()
+
+        # Drain the final queue on this thread.
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    item = input_queue.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                if item is _END:
+                    break
+                sink_fn(item)
+        finally:
+            self.stop()
+            for worker in workers:
+                worker.join()
+
+        for worker in workers:
+            if worker.error is not None:
+                raise worker.error
+
+        if self._source_error is not None:
+            raise self._source_error
+
+        if self.dropped_count > 0:
+            Logger.field("Pipeline Dropped Frames", self.dropped_count)
+
+    def _run_source(self, source_fn, source_queue: queue.Queue):
+        try:
+            while not self._stop_event.is_set():
+                packet = source_fn()
+                if packet is None:
+                    break
+                self._put_source(source_queue, packet)
+        except BaseException as e:
+            self._source_error = e
+        finally:
+            _put(source_queue, _END, self._stop_event)
+
+    def _put_source(self, source_queue: queue.Queue, packet):
+        """ Put a new packet into the first queue, according to the drop policy. """
+        if self.drop_policy == DROP_NONE:
+            _put(source_queue, packet, self._stop_event)
+            return
+
+        while True:
+            try:
+                source_queue.put_nowait(packet)
+                return
+            except queue.Full:
+                pass
+
+            if self.drop_policy == DROP_NEWEST:
+                self.dropped_count += 1
+                return
+
+            # Drop the oldest frame, and try again.
+            try:
+                source_queue.get_nowait()
+                self.dropped_count += 1
+            except queue.Empty:
+                pass
+
+
+def _put(target_queue: queue.Queue, item, stop_event: threading.Event):
+    """ Block until the item is in the queue, unless the pipeline is stopped. """
+    while not stop_event.is_set():
+        try:
+            target_queue.put(item, timeout=_POLL_INTERVAL)
+            return
+        except queue.Full:
+            continue
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+"""
+A tracker that keeps the state of every track in numpy arrays, and predicts where each face will be with a
+constant velocity Kalman filter. Each frame, all the tracks are predicted forward at once, and compared to all
+of the detections in one distance matrix. The pairs inside the distance gate are costed by distance plus IoU,
+and paired up greedily. The prediction is scaled by the number of frames since the last update, so a fast
+walker stays with their track even when frames are skipped.
+"""
+
+from typing import List
+
+import numpy as np
+
+from counter.proximity_tracker import ProximityTracker
+from tools.region import RegionBatch
+from tools.tracking_tool import Tracker, TrackingRegion, Tracklet
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+TRACKER_PROXIMITY = "proximity"
+TRACKER_PREDICTIVE = "predictive"
+TRACKER_MODES = [TRACKER_PROXIMITY, TRACKER_PREDICTIVE]
+
+# The state of a track is [center x, center y, width, height] and the velocity of each.
+_STATE_SIZE = 8
+_MEASURE_SIZE = 4
+
+
+class PredictiveTracker(Tracker):
+
+    # Noise, relative to the size of the face.
+    POSITION_NOISE = 1.0 / 20
+    VELOCITY_NOISE = 1.0 / 160
+
+    def __init__(self, ratio_lock: float = 1.0, scale_factor: float = 1.5, reach: float = 1.5):
+        self.ratio_lock = ratio_lock
+        self.scale_factor = scale_factor
+        self.reach = reach  # A detection can only join a track within this many face sizes of its prediction.
+        super().__init__()
+
+        # One row per tracklet, in the same order as self.tracklets.
+        self._x = np.zeros((0, _STATE_SIZE))
+        self._p = np.zeros((0, _STATE_SIZE, _STATE_SIZE))
+        self._frame_index = np.zeros(0, dtype=np.int64)
+
+    def process(self, regions: List[TrackingRegion], frame_index: int = 0) -> List[Tracklet]:
+        new_frames = self._convert_to_track_frames(regions, frame_index, self.ratio_lock, self.scale_factor)
+        measurements = _to_measurements(regions)
+
+        self._predict(frame_index)
+        pairs = self._associate(measurements)
+
+        # Update the matched tracks.
+        merged_tracks = np.zeros(len(self.tracklets), dtype=bool)
+        merged_frames = np.zeros(len(new_frames), dtype=bool)
+        if len(pairs) > 0:
+            rows, cols = np.array(pairs).T
+            self._update(rows, measurements[cols])
+            merged_tracks[rows] = True
+            merged_frames[cols] = True
+            self.add_frames([self.tracklets[row] for row in rows], [new_frames[col] for col in cols])
+
+        # Decay the non-hit tracklets.
+        self.register_misses([self.tracklets[row] for row in np.flatnonzero(~merged_tracks)])
+
+        # Start a track for every un-merged detection.
+        new_cols = np.flatnonzero(~merged_frames)
+        new_tracklets = [self.create_tracklet(color=(255, 150, 30), red_fade=True) for _ in new_cols]
+        self.add_frames(new_tracklets, [new_frames[col] for col in new_cols])
+        self.tracklets.extend(new_tracklets)
+        self._initiate(measurements[new_cols], frame_index)
+
+        return self.remove_dead_tracklets()
+
+    def remove_dead_tracklets(self) -> List[Tracklet]:
+        """ Prune the list of all the tracks, and their state. """
+        dead = self.dead_mask()
+        self._x, self._p, self._frame_index = self._x[~dead], self._p[~dead], self._frame_index[~dead]
+        return self._remove_tracklets(dead)
+
+    def predicted_boxes(self) -> np.array:
+        """ The (n x 4) [left, top, right, bottom] predicted box of each tracklet. """
+        return _to_boxes(self._x[:, :_MEASURE_SIZE])
+
+    def reset(self):
+        super().reset()
+        self._x = np.zeros((0, _STATE_SIZE))
+        self._p = np.zeros((0, _STATE_SIZE, _STATE_SIZE))
+        self._frame_index = np.zeros(0, dtype=np.int64)
+
+    # ======================================================================================================================
+    # Kalman filter.
+    # ======================================================================================================================
+
+    def _initiate(self, measurements: np.array, frame_index: int):
+        count = len(measurements)
+        x = np.zeros((count, _STATE_SIZE))
+        x[:, :_MEASURE_SIZE] = measurements
+
+        size = measurements[:, 3:4]
+        std = np.hstack([2 * self.POSITION_NOISE * size.repeat(4, axis=1),
+                         10 * self.VELOCITY_NOISE * size.repeat(4, axis=1)])
+        p = np.zeros((count, _STATE_SIZE, _STATE_SIZE))
+        p[:, np.arange(_STATE_SIZE), np.arange(_STATE_SIZE)] = std ** 2
+
+        self._x = np.vstack([self._x, x])
+        self._p = np.concatenate([self._p, p])
+        self._frame_index = np.concatenate([self._frame_index, np.full(count, frame_index, dtype=np.int64)])
+
+    def _predict(self, frame_index: int):
+        """ Move every track forward to this frame. """
+        if len(self._x) == 0:
+            return
+
+        steps = (frame_index - self._frame_index).astype(np.float64)
+        transition = np.tile(np.eye(_STATE_SIZE), (len(steps), 1, 1))
+        transition[:, np.arange(_MEASURE_SIZE), np.arange(_MEASURE_SIZE) + _MEASURE_SIZE] = steps[:, np.newaxis]
+
+        size = self._x[:, 3:4]
+        std = np.hstack([self.POSITION_NOISE * size.repeat(4, axis=1), self.VELOCITY_NOISE * size.repeat(4, axis=1)])
+        noise = np.zeros_like(self._p)
+        noise[:, np.arange(_STATE_SIZE), np.arange(_STATE_SIZE)] = std ** 2 * steps[:, np.newaxis]
+
+        self._x = np.einsum("nij,nj->ni", transition, self._x)
+        self._p = np.einsum("nij,njk,nlk->nil", transition, self._p, transition) + noise
+        self._x[:, 2:4] = np.maximum(self._x[:, 2:4], 1.0)
+        self._frame_index[:] = frame_index
+
+    def _update(self, rows: np.array, measurements: np.array):
+        x = self._x[rows]
+        p = self._p[rows]
+
+        size = x[:, 3:4]
+        measure_noise = np.zeros((len(rows), _MEASURE_SIZE, _MEASURE_SIZE))
+        measure_noise[:, np.arange(_MEASURE_SIZE), np.arange(_MEASURE_SIZE)] = \
+            (self.POSITION_NOISE * size.repeat(4, axis=1)) ** 2
+
+        innovation_cov = p[:, :_MEASURE_SIZE, :_MEASURE_SIZE] + measure_noise
+        gain = np.einsum("nij,njk->nik", p[:, :, :_MEASURE_SIZE], np.linalg.inv(innovation_cov))
+        innovation = measurements - x[:, :_MEASURE_SIZE]
+
+        self._x[rows] = x + np.einsum("nij,nj->ni", gain, innovation)
+        self._p[rows] = p - np.einsum("nij,njk->nik", gain, p[:, :_MEASURE_SIZE, :])
+
+    # ======================================================================================================================
+    # Association.
+    # ======================================================================================================================
+
+    def _associate(self, measurements: np.array) -> List[tuple]:
+        """ Pair the (not lost) tracks with the detections, closest first. """
+        live_rows = np.flatnonzero(~self.store.lost[self._slots(self.tracklets)])
+        if len(live_rows) == 0 or len(measurements) == 0:
+            return []
+
+        predicted = self._x[live_rows, :_MEASURE_SIZE]
+        offsets = predicted[:, np.newaxis, :2] - measurements[np.newaxis, :, :2]
+        distances = np.sqrt(np.einsum("ijk,ijk->ij", offsets, offsets))
+
+        # Gate by distance, in the same way as the proximity tracker. Only the pairs inside the gate are costed.
+        edges = measurements[:, 2:4].max(axis=1)
+        candidate_rows, candidate_cols = np.nonzero(distances < edges[np.newaxis, :] * self.reach)
+        overlaps = _iou(_to_boxes(predicted[candidate_rows]), _to_boxes(measurements[candidate_cols]))
+        cost = distances[candidate_rows, candidate_cols] / edges[candidate_cols] + (1.0 - overlaps)
+
+        # Greedy, cheapest pair first. The gate leaves only a few candidates per track.
+        order = np.argsort(cost, kind="stable")
+
+        used_rows = set()
+        used_cols = set()
+        pairs = []
+        for row, col in zip(candidate_rows[order].tolist(), candidate_cols[order].tolist()):
+            if row in used_rows or col in used_cols:
+                continue
+            used_rows.add(row)
+            used_cols.add(col)
+            pairs.append((int(live_rows[row]), col))
+
+        return pairs
+
+
+def create_tracker(mode: str) -> Tracker:
+    if mode == TRACKER_PROXIMITY:
+        return ProximityTracker()
+
+    if mode == TRACKER_PREDICTIVE:
+        return PredictiveTracker()
+
+    raise ValueError("Unknown tracker '{}'. Use one of: {}.".format(mode, TRACKER_MODES))
+
+
+# ======================================================================================================================
+# Support functions.
+# ======================================================================================================================
+
+
+def _to_measurements(regions: List[TrackingRegion]) -> np.array:
+    """ The (n x 4) [center x, center y, width, height] of each region. """
+    measurements = RegionBatch.from_regions(regions).rects
+    sizes = np.maximum(measurements[:, 2:] - measurements[:, :2], 1.0)
+    return np.hstack([measurements[:, :2] + sizes / 2, sizes])
+
+
+def _to_boxes(measurements: np.array) -> np.array:
+    half_sizes = measurements[:, 2:4] / 2
+    return np.hstack([measurements[:, :2] - half_sizes, measurements[:, :2] + half_sizes])
+
+
+def _iou(a: np.array, b: np.array) -> np.array:
+    """ The intersection over union of each [left, top, right, bottom] box in a with the same row in b. """
+    width = np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0])
+    height = np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1])
+    intersection = np.maximum(0, width) * np.maximum(0, height)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return intersection / np.maximum(area_a + area_b - intersection, 1e-6)
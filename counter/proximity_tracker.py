@@ -1,18 +1,12 @@
 from typing import List
-from tools.tracking_tool import Tracker, TrackingRegion, TrackFrame, Tracklet
-from tools.region import Region
+import numpy as np
+from tools.tracking_tool import Tracker, TrackingRegion, Tracklet
+from tools.region import RegionBatch
 
 __author__ = "Jakrin Juangbhanich"
 __email__ = "juangbhanich.k@gmail.com"
 
 
-class TrackletPair:
-    def __init__(self, tracklet: Tracklet, new_frame: TrackFrame, distance: float):
-        self.tracklet = tracklet
-        self.new_frame = new_frame
-        self.distance = distance
-
-
 class ProximityTracker(Tracker):
 
     def __init__(self, ratio_lock: float=1.0, scale_factor: float=1.5, reach: float=1.5):
@@ -24,43 +18,37 @@ class ProximityTracker(Tracker):
     def process(self, regions: List[TrackingRegion], frame_index: int = 0) -> List[Tracklet]:
         new_frames = self._convert_to_track_frames(regions, frame_index, self.ratio_lock, self.scale_factor)
 
-        # Compare each detection to each other, and make a list of them.
-        tracklet_pairs = []
-        for tracklet in self.tracklets:
-
-            if tracklet.is_lost:
-                continue
+        # Compare each detection to each live track's last region, all at once.
+        live_tracklets = [t for t in self.tracklets if not t.is_lost]
+        old_regions = RegionBatch.from_regions([t.last_raw_region for t in live_tracklets])
+        new_regions = RegionBatch.from_regions([t.raw_region for t in new_frames])
+        distances = old_regions.distance(new_regions)
+        rows, cols = np.nonzero(distances < new_regions.biggest_edge[np.newaxis, :] * self.reach)
 
-            old_t = tracklet.track_frames[-1]
-            for new_t in new_frames:
-                distance = Region.distance(new_t.raw_region, old_t.raw_region)
-                reach = new_t.raw_region.biggest_edge * self.reach
-                if distance < reach:
-                    t_pair = TrackletPair(tracklet, new_t, distance)
-                    tracklet_pairs.append(t_pair)
-
-        # For each valid pair, merge them.
-        tracklet_pairs.sort(key=lambda x: x.distance)
+        # For each valid pair, merge them (closest first).
+        order = np.argsort(distances[rows, cols], kind="stable")
         merged = {}
+        merged_tracklets = []
+        merged_frames = []
+
+        for row, col in zip(rows[order].tolist(), cols[order].tolist()):
+            tracklet, new_frame = live_tracklets[row], new_frames[col]
+            if new_frame not in merged and tracklet not in merged:
+                merged[new_frame] = True
+                merged[tracklet] = True
+                merged_tracklets.append(tracklet)
+                merged_frames.append(new_frame)
 
-        for pair in tracklet_pairs:
-            if pair.new_frame not in merged and pair.tracklet not in merged:
-                merged[pair.new_frame] = True
-                merged[pair.tracklet] = True
-                pair.tracklet.add(pair.new_frame)
+        self.add_frames(merged_tracklets, merged_frames)
 
-        # TODO: This loop is probably not efficient.
         # Decay the non-hit tracklets.
-        for tracklet in self.tracklets:
-            if tracklet not in merged:
-                tracklet.update(hit=False)
+        self.register_misses([t for t in self.tracklets if t not in merged])
 
         # Add all the un-merged detections.
-        for frame in new_frames:
-            if frame not in merged:
-                tracklet = Tracklet(color=(255, 150, 30), red_fade=True)
-                tracklet.add(frame)
-                self.tracklets.append(tracklet)
+        unmerged_frames = [f for f in new_frames if f not in merged]
+        new_tracklets = [self.create_tracklet(color=(255, 150, 30), red_fade=True) for _ in unmerged_frames]
+        self.add_frames(new_tracklets, unmerged_frames)
+        self.tracklets.extend(new_tracklets)
 
         # Prune the list of all the tracks.
         return self.remove_dead_tracklets()
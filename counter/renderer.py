@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""
+Draws the visualization window on its own thread, so that the analysis never pays for rendering (and the
+frame that we detect and embed on is never drawn on). The analysis thread hands over a snapshot of what to
+draw at most RENDER_FPS times a second. The renderer only keeps the latest snapshot: if it falls behind,
+older ones are replaced rather than queued.
+"""
+
+import threading
+import time
+
+import cv2
+
+from tools.logger import Logger
+from tools.region import Region
+from tools.visual import Compositor
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+
+class SessionPlate:
+    """ A snapshot of what the session list shows for one session. """
+    def __init__(self, slot: int, display_id: str, is_active: bool, time_left_percent: float):
+        self.slot = slot
+        self.display_id = display_id
+        self.is_active = is_active
+        self.time_left_percent = time_left_percent
+
+
+class RenderJob:
+    """ Everything needed to draw one frame. The frame is a copy, so the renderer can draw into it. """
+    def __init__(self, frame, labels, invalid_regions, cap_regions, plates):
+        self.frame = frame
+        self.labels = labels  # (display_id, region) for each face with a session.
+        self.invalid_regions = invalid_regions
+        self.cap_regions = cap_regions
+        self.plates = plates
+
+
+class Renderer:
+
+    WINDOW_NAME = "window"
+
+    def __init__(self, fps: float = 10):
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.compositor = Compositor()
+        self.rendered_count = 0
+
+        self._time_last_submit = 0.0
+        self._job = None
+        self._is_closing = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(name="renderer", target=self._run, daemon=True)
+        self._thread.start()
+
+    def is_due(self) -> bool:
+        """ Check this before building a job, so that skipped frames cost nothing. """
+        return time.time() - self._time_last_submit >= self.interval
+
+    def submit(self, job: RenderJob):
+        """ Replace the waiting job (if any) with this one. This never blocks. """
+        self._time_last_submit = time.time()
+        with self._condition:
+            self._job = job
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self._is_closing = True
+            self._condition.notify()
+        self._thread.join()
+
+    # ======================================================================================================================
+    # Render thread.
+    # ======================================================================================================================
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._job is None and not self._is_closing:
+                    self._condition.wait()
+                if self._is_closing:
+                    break
+                job, self._job = self._job, None
+
+            try:
+                frame = self.draw(job)
+                cv2.imshow(self.WINDOW_NAME, frame)
+                cv2.waitKey(1)
+                self.rendered_count += 1
+            except Exception as e:
+                Logger.error("Renderer failed to draw frame: {}".format(e))
+
+        # The window belongs to this thread, so it has to be destroyed here as well.
+        if self.rendered_count > 0:
+            cv2.destroyAllWindows()
+
+    def draw(self, job: RenderJob):
+        compositor = self.compositor
+        self._add_session_plates(job.plates)
+
+        for display_id, region in job.labels:
+            compositor.add_label(display_id, region, font_size=12)
+
+        compositor.add_rectangles([r for _, r in job.labels], color=(0, 255, 0), thickness=2, additive=True)
+        compositor.add_rectangles(job.invalid_regions, color=(0, 0, 255), thickness=2, additive=True)
+        compositor.add_rectangles(job.cap_regions, color=(60, 60, 60), thickness=1, additive=True)
+        return compositor.draw(job.frame)
+
+    def _add_session_plates(self, plates):
+        pad = 2
+        unit_height = 30
+        unit_width = 128
+        bar_height = 2
+
+        for plate in plates:
+            color = (0, 255, 0) if plate.is_active else (255, 255, 255)
+            x = pad
+            y = pad + (unit_height + pad) * plate.slot
+            t_height = (unit_height - bar_height)
+            t_region = Region(x, x + unit_width, y, y + t_height)
+            self.compositor.add_text_box(plate.display_id, t_region, bg_color=(0, 0, 0), font_size=12,
+                                         bg_opacity=0.7, color=color)
+            self.compositor.add_bar(plate.time_left_percent, x, y + t_height,
+                                    unit_width, bar_height, bar_color=color)
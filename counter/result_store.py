@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+"""
+Storage for the session results. The segmented store appends each session as one JSON line to the current
+segment file, starts a new segment when the current one is too big (or too old), and enforces the rolling
+window by deleting whole segments. So the cost of ending a session does not depend on how many are stored.
+The file store keeps the original layout of one JSON file per session.
+"""
+
+import json
+import os
+import time
+
+from tools import pather
+from tools.logger import Logger
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+STORE_SEGMENTED = "segmented"
+STORE_FILES = "files"
+STORE_FORMATS = [STORE_SEGMENTED, STORE_FILES]
+
+
+class Segment:
+    def __init__(self, path: str, index: int, record_count: int = 0, size: int = 0):
+        self.path = path
+        self.index = index
+        self.record_count = record_count
+        self.size = size
+        self.time_created = time.time()
+
+
+class SegmentedResultStore:
+
+    SEGMENT_PREFIX = "sessions_"
+    SEGMENT_EXTENSION = ".jsonl"
+    Z_FILL_INDEX = 7
+
+    def __init__(self, directory: str = "output", retention: int = 10000,
+                 segment_max_bytes: int = 1048576, segment_max_seconds: float = 3600):
+        self.directory = directory
+        self.retention = retention  # Keep at least this many records (dropping whole segments above it).
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_seconds = segment_max_seconds
+
+        self.segments = []
+        self.record_count = 0
+        self._file = None
+
+        pather.create(self.directory)
+        self._load_segments()
+
+    # ======================================================================================================================
+    # Writing.
+    # ======================================================================================================================
+
+    def append(self, record: dict):
+        self.append_many([record])
+
+    def append_many(self, records):
+        """ Append the records to the current segment, with a single write. """
+        if len(records) == 0:
+            return
+
+        if self._file is None or self._should_rotate():
+            self._start_segment()
+
+        lines = "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records)
+        self._file.write(lines)
+        self._file.flush()
+
+        segment = self.segments[-1]
+        segment.record_count += len(records)
+        segment.size += len(lines)
+        self.record_count += len(records)
+        self._enforce_retention()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # ======================================================================================================================
+    # Reading.
+    # ======================================================================================================================
+
+    def records(self):
+        """ Iterate over every stored record, from oldest to newest. """
+        for segment in list(self.segments):
+            for record in read_segment(segment.path):
+                yield record
+
+    def __iter__(self):
+        return self.records()
+
+    # ======================================================================================================================
+    # Segment management.
+    # ======================================================================================================================
+
+    def _should_rotate(self) -> bool:
+        segment = self.segments[-1]
+        if segment.size >= self.segment_max_bytes:
+            return True
+        return time.time() - segment.time_created >= self.segment_max_seconds
+
+    def _start_segment(self):
+        """ Close the current segment and open a new one. A new process always starts a new segment. """
+        self.close()
+        index = self.segments[-1].index + 1 if len(self.segments) > 0 else 0
+        file_name = "{}{}{}".format(self.SEGMENT_PREFIX, str(index).zfill(self.Z_FILL_INDEX), self.SEGMENT_EXTENSION)
+        segment = Segment(os.path.join(self.directory, file_name), index)
+        self._file = open(segment.path, "a")
+        self.segments.append(segment)
+
+    def _enforce_retention(self):
+        """ Drop the oldest segments, as long as the remaining ones still hold the whole window. """
+        while len(self.segments) > 1 and self.record_count - self.segments[0].record_count >= self.retention:
+            segment = self.segments.pop(0)
+            self.record_count -= segment.record_count
+            Logger.field("Pruning Segment", "{} ({} Sessions)".format(os.path.basename(segment.path),
+                                                                      segment.record_count))
+            os.remove(segment.path)
+
+    def _load_segments(self):
+        """ Find the existing segments (this is the only time we list the directory). """
+        for file_name in os.listdir(self.directory):
+            if not (file_name.startswith(self.SEGMENT_PREFIX) and file_name.endswith(self.SEGMENT_EXTENSION)):
+                continue
+
+            index_str = file_name[len(self.SEGMENT_PREFIX):-len(self.SEGMENT_EXTENSION)]
+            if not index_str.isdigit():
+                continue
+
+            path = os.path.join(self.directory, file_name)
+            with open(path, "r") as f:
+                record_count = sum(1 for line in f if line.strip())
+            self.segments.append(Segment(path, int(index_str), record_count, os.path.getsize(path)))
+
+        self.segments.sort(key=lambda s: s.index)
+        self.record_count = sum(s.record_count for s in self.segments)
+
+
+class FileResultStore:
+    """ The original layout: one pretty-printed JSON file per session, pruned to the rolling window. """
+
+    Z_FILL_INDEX = 7
+
+    def __init__(self, directory: str = "output", retention: int = 10000):
+        self.directory = directory
+        self.retention = retention
+
+    def append(self, record: dict):
+        self.append_many([record])
+
+    def append_many(self, records):
+        pather.create(self.directory)
+        for record in records:
+            file_name = "session_{}.json".format(str(record["session_id"]).zfill(self.Z_FILL_INDEX))
+            file_path = os.path.join(self.directory, file_name)
+            with open(file_path, "w") as f:
+                json.dump(record, f, indent=2)
+
+        self._execute_rolling_window(self.retention)
+
+    def close(self):
+        pass
+
+    def records(self):
+        for file_name in sorted(list_legacy_files(self.directory)):
+            with open(os.path.join(self.directory, file_name), "r") as f:
+                yield json.load(f)
+
+    def __iter__(self):
+        return self.records()
+
+    def _execute_rolling_window(self, rolling_window_size=5):
+        """ Clean up the directory to fit within the rolling window size. """
+        session_files = os.listdir(self.directory)
+        if len(session_files) > rolling_window_size:
+            session_files.sort()
+
+        # Delete the first n files from the session folder.
+        excess = len(session_files) - rolling_window_size
+        Logger.debug("File Storage", "{}/{}".format(len(session_files), rolling_window_size))
+        if excess > 0:
+            prune_files = session_files[:excess]
+            for f in prune_files:
+                Logger.debug("Pruning File", "{}".format(f))
+                file_path = os.path.join(self.directory, f)
+                os.remove(file_path)
+
+
+# ======================================================================================================================
+# Support functions.
+# ======================================================================================================================
+
+
+def create_store(store_format: str, directory: str, retention: int, segment_max_bytes: int = 1048576,
+                 segment_max_seconds: float = 3600):
+    if store_format == STORE_SEGMENTED:
+        return SegmentedResultStore(directory, retention, segment_max_bytes, segment_max_seconds)
+
+    if store_format == STORE_FILES:
+        return FileResultStore(directory, retention)
+
+    raise ValueError("Unknown result store format '{}'. Use one of: {}.".format(store_format, STORE_FORMATS))
+
+
+def read_segment(path: str):
+    """ Read the records of one segment. A line cut short by a crash is skipped. """
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                Logger.field("Skipping Record", "Incomplete line in {}".format(path), red=True)
+
+
+def list_legacy_files(directory: str):
+    return [f for f in os.listdir(directory) if f.startswith("session_") and f.endswith(".json")]
+
+
+def convert_legacy_results(directory: str, store: SegmentedResultStore, remove: bool = False) -> int:
+    """ Move the per-session JSON files in the directory into the segmented store, oldest first.
+    Returns the number of sessions converted. """
+    file_names = sorted(list_legacy_files(directory))
+    batch = []
+
+    for file_name in file_names:
+        with open(os.path.join(directory, file_name), "r") as f:
+            batch.append(json.load(f))
+
+        if len(batch) >= 1000:
+            store.append_many(batch)
+            batch = []
+
+    store.append_many(batch)
+
+    if remove:
+        for file_name in file_names:
+            os.remove(os.path.join(directory, file_name))
+
+    return len(file_names)
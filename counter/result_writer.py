@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+Writes the session results on a background thread, so that serialising and writing them (and pruning old
+results) never blocks the frame loop. Results are handed over through a bounded queue, and everything that
+is waiting in the queue is written together as one batch.
+"""
+
+import queue
+import threading
+import time
+
+from tools.logger import Logger
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+# Tells the writer thread to finish.
+_CLOSE = object()
+
+
+class ResultWriter:
+
+    def __init__(self, store, queue_size: int = 256, batch_size: int = 32, report_interval: float = 300):
+        self.store = store
+        self.batch_size = max(1, batch_size)
+        self.report_interval = report_interval  # How often (in seconds) to log the writer stats.
+
+        # Stats.
+        self.written_count = 0
+        self.batch_count = 0
+        self.last_write_ms = 0.0
+        self.max_write_ms = 0.0
+        self._total_write_ms = 0.0
+        self._time_last_report = time.time()
+
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._thread = threading.Thread(name="result-writer", target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, record: dict):
+        """ Queue a record to be written. This only blocks if the queue is full. """
+        self._queue.put(record)
+
+    def close(self, timeout: float = None):
+        """ Write everything that is still queued, then stop the writer thread. """
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_CLOSE)
+        self._thread.join(timeout)
+        self.log_stats()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def mean_write_ms(self) -> float:
+        return self._total_write_ms / self.batch_count if self.batch_count > 0 else 0.0
+
+    def log_stats(self):
+        Logger.field("Result Writer", "Written: {} | Queue: {} | Write: {:.2f} ms (mean) {:.2f} ms (max)".format(
+            self.written_count, self.queue_depth, self.mean_write_ms, self.max_write_ms))
+
+    # ======================================================================================================================
+    # Writer thread.
+    # ======================================================================================================================
+
+    def _run(self):
+        is_closing = False
+        while not is_closing:
+            batch = [self._queue.get()]
+
+            # Take everything else that is already waiting, up to the batch size.
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if _CLOSE in batch:
+                is_closing = True
+                batch = [r for r in batch if r is not _CLOSE]
+
+            self._write(batch)
+
+        # Anything submitted while closing is still written.
+        remaining = []
+        while True:
+            try:
+                remaining.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._write([r for r in remaining if r is not _CLOSE])
+        self.store.close()
+
+    def _write(self, batch):
+        if len(batch) == 0:
+            return
+
+        start = time.perf_counter()
+        try:
+            self.store.append_many(batch)
+        except Exception as e:
+            Logger.error("Result Writer failed to write {} sessions: {}".format(len(batch), e))
+            return
+
+        write_ms = (time.perf_counter() - start) * 1000
+        self.written_count += len(batch)
+        self.batch_count += 1
+        self.last_write_ms = write_ms
+        self.max_write_ms = max(self.max_write_ms, write_ms)
+        self._total_write_ms += write_ms
+
+        if time.time() - self._time_last_report >= self.report_interval:
+            self._time_last_report = time.time()
+            self.log_stats()
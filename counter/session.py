@@ -4,14 +4,13 @@
 <Description>
 """
 
-import json
-import os
 import time
 import uuid
 
 import numpy as np
 
-from tools import pather
+from counter.result_store import FileResultStore
+from counter.session_id_allocator import SessionIdAllocator
 from tools.logger import Logger
 
 __author__ = "Jakrin Juangbhanich"
@@ -22,69 +21,142 @@ __email__ = "krinj@genvis.co"
 class Session:
 
     SESSION_FILE = "session_index.txt"
+    SESSION_ID_BLOCK_SIZE = 1000  # How many session IDs to reserve from the session file at a time.
+    ID_ALLOCATOR = None
+    RESULT_STORE = None
+    RESULT_WRITER = None  # If set, results are handed to this background writer instead of written here.
     OUTPUT_DIR = "output"
-    Z_FILL_INDEX = 7
     ROLLING_WINDOW_SIZE = 10000  # This is how many session files we will keep.
     MAX_VECTOR_LENGTH = 10
-    SESSION_LONG_LIFE_FRAMES = 150  # How long to keep a session pending for, before ending it.
-    SESSION_SHORT_LIFE_FRAMES = 5  # How long to keep a session pending for (until it is full).
+    SESSION_LONG_LIFE_SECONDS = 5.0  # How long to keep a session pending for, before ending it.
+    SESSION_SHORT_LIFE_SECONDS = 0.1  # How long to keep a session pending for (until it is full).
+    CLOCK = None  # The clock of the frames being processed. The wall clock is used if it is not set.
     DISPLAY_TIME_LEFT_LIMIT = 0.9
 
     VECTOR_COMPARE_LENGTH = 3
+    VECTOR_DIMENSIONS = 128
+
+    # How a new vector is compared to the session.
+    DISTANCE_CENTROID = "centroid"  # Distance to the mean of all the session's vectors.
+    DISTANCE_MEAN = "mean"  # Mean distance to each of the first VECTOR_COMPARE_LENGTH vectors.
+    DISTANCE_MODE = DISTANCE_CENTROID
 
     def __init__(self):
         self.session_id = self.get_session_id()
         self.face_id = uuid.uuid4().hex
-        self.timestamp_start = time.time()
+        self.timestamp_start = self.now()
         self.timestamp_end = 0
-        self.local_time_start = time.localtime()
-        self.vectors = []
-        self.time_left = self.SESSION_SHORT_LIFE_FRAMES
+        self.local_time_start = time.localtime(self.timestamp_start)
+
+        # The vectors are kept in a fixed size ring buffer, with a running sum for the centroid.
+        self._vectors = np.zeros((self.MAX_VECTOR_LENGTH, self.VECTOR_DIMENSIONS), dtype=np.float32)
+        self._vector_sum = np.zeros(self.VECTOR_DIMENSIONS, dtype=np.float64)
+        self._centroid = np.zeros(self.VECTOR_DIMENSIONS, dtype=np.float32)
+        self._vector_count = 0
+        self._next_index = 0
+
+        self.time_left = self.SESSION_SHORT_LIFE_SECONDS
         self.has_activated = False
+        self.has_ended = False
+        self.last_region = None  # Where this session's face was last seen in the frame.
+
+        # If this face was recognised from an earlier session, that session's ID.
+        self.gallery_checked = False
+        self.previous_session_id = None
 
     @property
     def display_id(self):
         return "{}: {}".format(self.session_id, self.face_id[:6].upper())
 
     def add_vector(self, vector):
-        self.vectors.append(vector)
-        if len(self.vectors) > self.MAX_VECTOR_LENGTH:
-            self.vectors.pop(0)
+        if self.is_full:
+            self._vector_sum -= self._vectors[self._next_index]
+        else:
+            self._vector_count += 1
+
+        self._vectors[self._next_index] = vector
+        self._vector_sum += self._vectors[self._next_index]
+        self._next_index = (self._next_index + 1) % self.MAX_VECTOR_LENGTH
+
+        # Re-sum the buffer once per cycle, so that rounding errors can't build up.
+        if self._next_index == 0:
+            self._vector_sum = self._vectors.sum(axis=0, dtype=np.float64)
+
+        self._centroid = (self._vector_sum / self._vector_count).astype(np.float32)
 
         if not self.has_activated:
             if self.is_full:
                 self.has_activated = True
                 Logger.field("Session Activated", "{}".format(self.display_id))
 
-        self.timestamp_end = time.time()
-        self.time_left = self.SESSION_LONG_LIFE_FRAMES if self.is_full else self.SESSION_SHORT_LIFE_FRAMES
+        self.keep_alive()
+
+    def keep_alive(self):
+        """ The face is still in view (even if we did not take a new vector for it). Reset the countdown. """
+        self.timestamp_end = self.now()
+        self.time_left = self.SESSION_LONG_LIFE_SECONDS if self.is_full else self.SESSION_SHORT_LIFE_SECONDS
 
     @property
     def is_full(self):
-        return len(self.vectors) == self.MAX_VECTOR_LENGTH
+        return self._vector_count == self.MAX_VECTOR_LENGTH
+
+    @property
+    def vectors(self):
+        """ All of the session's vectors, from oldest to newest. """
+        if not self.is_full:
+            return self._vectors[:self._vector_count]
+        return np.concatenate((self._vectors[self._next_index:], self._vectors[:self._next_index]))
+
+    @property
+    def vector_count(self):
+        return self._vector_count
+
+    @property
+    def centroid(self):
+        """ The mean of all the session's vectors. """
+        return self._centroid
 
-    def update(self, time_delta):
+    def update(self, time_delta: float):
+        """ Count down by the time (in seconds) since the last frame. """
         self.time_left = max(0, self.time_left - time_delta)
 
     @property
     def time_left_percent(self):
-        return self.time_left/self.SESSION_LONG_LIFE_FRAMES
+        return self.time_left/self.SESSION_LONG_LIFE_SECONDS
 
     @property
     def display_time_left_percent(self):
         return min(1.0, self.time_left_percent / self.DISPLAY_TIME_LEFT_LIMIT)
 
+    @property
+    def compare_vectors(self):
+        """ The vectors that a new vector is compared against. """
+        if self.DISTANCE_MODE == self.DISTANCE_CENTROID:
+            return self.centroid[np.newaxis]
+
+        cmp_length = min(self._vector_count, self.VECTOR_COMPARE_LENGTH)
+        if not self.is_full:
+            return self._vectors[:cmp_length]
+        indexes = (self._next_index + np.arange(cmp_length)) % self.MAX_VECTOR_LENGTH
+        return self._vectors[indexes]
+
+    @property
+    def distance_divisor(self):
+        """ The summed distance to the compare vectors is divided by this, to get the session distance. """
+        if self.DISTANCE_MODE == self.DISTANCE_CENTROID:
+            return 1
+        return max(1, min(self._vector_count, self.VECTOR_COMPARE_LENGTH))
+
     def get_distance(self, vector):
-        distance_total = 0
-        cmp_length = min(len(self.vectors), self.VECTOR_COMPARE_LENGTH)
-        compare_vectors = self.vectors[:cmp_length]
-        for v in compare_vectors:
-            distance_total += np.linalg.norm(v - vector)
-        distance_total /= len(self.vectors)
-        return distance_total
+        if self.DISTANCE_MODE == self.DISTANCE_CENTROID:
+            return float(np.linalg.norm(self.centroid - vector))
+
+        compare_vectors = self.compare_vectors
+        distances = np.linalg.norm(compare_vectors - vector, axis=1)
+        return float(distances.sum() / self.distance_divisor)
 
     def end(self):
-        """ End the session and write the results to a file. """
+        """ End the session and write the results to the result store. """
         Logger.field("Session Ended", "{}".format(self.display_id))
         self.create_results_data()
 
@@ -97,67 +169,44 @@ class Session:
         data = {
             "session_id": self.session_id,
             "face_id": self.face_id,
+            "previous_session_id": self.previous_session_id,
             "timestamp_start": int(self.timestamp_start),
             "timestamp_end": int(self.timestamp_end),
             "duration_in_seconds": round(self.timestamp_end - self.timestamp_start, 2),
-            "date": self._get_readable_date(time.localtime()),
+            "date": self._get_readable_date(time.localtime(self.timestamp_end)),
             "readable_time_start": self._get_readable_time(self.local_time_start),
-            "readable_time_end": self._get_readable_time(time.localtime())
+            "readable_time_end": self._get_readable_time(time.localtime(self.timestamp_end))
         }
 
-        # Write the results data to disk.
-        file_name = "session_{}.json".format(str(self.session_id).zfill(self.Z_FILL_INDEX))
-        file_path = os.path.join(self.OUTPUT_DIR, file_name)
-        pather.create(self.OUTPUT_DIR)
-        with open(file_path, "w") as f:
-            json.dump(data, f, indent=2)
-
-        self._execute_rolling_window(self.ROLLING_WINDOW_SIZE)
+        if Session.RESULT_WRITER is not None:
+            Session.RESULT_WRITER.submit(data)
+        else:
+            self.get_result_store().append(data)
         return data
 
     # ======================================================================================================================
     # Private file I/O Support functions.
     # ======================================================================================================================
 
-    def _execute_rolling_window(self, rolling_window_size=5):
-        """ Clean up the directory to fit within the rolling window size. """
-        session_files = os.listdir(self.OUTPUT_DIR)
-        if len(session_files) > rolling_window_size:
-            session_files.sort()
-
-        # Delete the first n files from the session folder.
-        excess = len(session_files) - rolling_window_size
-        Logger.field("File Storage", "{}/{}".format(len(session_files), rolling_window_size))
-        if excess > 0:
-            prune_files = session_files[:excess]
-            for f in prune_files:
-                Logger.field("Pruning File", "{}".format(f))
-                file_path = os.path.join(self.OUTPUT_DIR, f)
-                os.remove(file_path)
-
-    def _create_session_file(self):
-        """ Create the session file if it doesn't yet exist. """
-        if not os.path.exists(self.SESSION_FILE):
-            self._write_session_id(0)
-
-    def _read_session_id(self):
-        """ Read the session ID from the file. """
-        self._create_session_file()
-        with open(self.SESSION_FILE, "r") as f:
-            session_id = int(f.read())
-        return session_id
-
-    def _write_session_id(self, new_id=0):
-        """ Write the new session ID into the file. """
-        with open(self.SESSION_FILE, "w") as f:
-            f.write(str(new_id))
+    @staticmethod
+    def now() -> float:
+        """ The time of the frame being processed. """
+        if Session.CLOCK is None:
+            return time.time()
+        return Session.CLOCK.now()
+
+    @classmethod
+    def get_result_store(cls):
+        """ Where the session results are written. Defaults to one JSON file per session. """
+        if Session.RESULT_STORE is None:
+            Session.RESULT_STORE = FileResultStore(cls.OUTPUT_DIR, cls.ROLLING_WINDOW_SIZE)
+        return Session.RESULT_STORE
 
     def get_session_id(self):
         """ Get the next incremental session ID. """
-        current_session_id = self._read_session_id()
-        current_session_id += 1
-        self._write_session_id(current_session_id)
-        return current_session_id
+        if Session.ID_ALLOCATOR is None:
+            Session.ID_ALLOCATOR = SessionIdAllocator(self.SESSION_FILE, self.SESSION_ID_BLOCK_SIZE)
+        return Session.ID_ALLOCATOR.next_id()
 
     @staticmethod
     def _get_readable_date(time_object):
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""
+Hands out unique, increasing session IDs without touching the disk for every session. IDs are leased from the
+session index file in blocks: the file always holds the highest ID that has been reserved, so after a crash
+(or with several counter processes sharing a directory) an ID can be skipped but is never handed out twice.
+"""
+
+import fcntl
+import os
+import threading
+
+__author__ = "Jakrin Juangbhanich"
+__copyright__ = "Copyright 2018, GenVis Pty Ltd."
+__email__ = "krinj@genvis.co"
+
+
+class SessionIdAllocator:
+
+    def __init__(self, path: str = "session_index.txt", block_size: int = 1000):
+        self.path = path
+        self.block_size = max(1, block_size)
+        self._next_id = 1
+        self._lease_end = 0  # The last ID (inclusive) in our current lease.
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        """ Get the next ID from the lease, reserving a new block when it runs out. """
+        with self._lock:
+            if self._next_id > self._lease_end:
+                self._reserve_block()
+
+            session_id = self._next_id
+            self._next_id += 1
+            return session_id
+
+    def _reserve_block(self):
+        """ Move the reserved high-water mark forward by one block, while holding an exclusive file lock
+        so that no other process can reserve the same block. """
+        with open(self.path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                last_reserved = self._read()
+                self._write(last_reserved + self.block_size)
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+        self._next_id = last_reserved + 1
+        self._lease_end = last_reserved + self.block_size
+
+    def _read(self) -> int:
+        """ Read the highest reserved ID from the file. """
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, "r") as f:
+            content = f.read().strip()
+        return int(content) if content else 0
+
+    def _write(self, value: int):
+        """ Durably replace the file: write a temporary file, sync it, then rename it over the original. """
+        temp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(temp_path, "w") as f:
+            f.write(str(value))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+        # Sync the directory too, so that the rename itself survives a power loss.
+        directory = os.path.dirname(os.path.abspath(self.path))
+        directory_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
@@ -4,6 +4,7 @@
 This is a wrapper for dlib's feature encoder. We use this to create feature vectors for each image.
 """
 
+from typing import List, Tuple
 import numpy as np
 import dlib
 
@@ -17,6 +18,7 @@ class VectorExtractor:
         self.face_detector = None
         self.pose_predictor_5_point = None
         self.face_encoder = None
+        self.quality = None  # If set, a FaceQuality that each face has to pass before it is encoded.
 
     def initialize(self,
                    predictor_5_point_model,
@@ -39,6 +41,78 @@ class VectorExtractor:
         else:
             return None
 
+    def process_batch(self, image, regions) -> List[np.array]:
+        """ Find the feature vectors for every face-region in the image, in a single batched call.
+
+        Returns:
+            list: One 128 byte feature vector per region (in the same order), or None if that region failed.
+        """
+        return self.process_frames([(image, regions)])[0]
+
+    def process_batch_with_quality(self, image, regions) -> Tuple[List[np.array], List[bool]]:
+        """ Like process_batch, but also says which regions were rejected by the quality check (and so were
+        not encoded).
+
+        Returns:
+            tuple: The feature vector (or None) for each region, and whether each region was rejected.
+        """
+        results, rejected = self._process_frames([(image, regions)])
+        return results[0], rejected[0]
+
+    def process_frames(self, frames, num_jitters=1) -> List[List[np.array]]:
+        """ Batch the face-regions from several (image, regions) pairs into one call to the face encoder.
+
+        Returns:
+            list: For each input pair, a list of feature vectors (or None) for each of its regions.
+        """
+        return self._process_frames(frames, num_jitters)[0]
+
+    def _process_frames(self, frames, num_jitters=1) -> Tuple[List[List[np.array]], List[List[bool]]]:
+        results = [[None] * len(regions) for _, regions in frames]
+        rejected = [[False] * len(regions) for _, regions in frames]
+        chips = []
+        chip_owners = []
+
+        for frame_index, (image, regions) in enumerate(frames):
+            valid_indexes = [i for i, r in enumerate(regions) if self._is_valid_region(image, r)]
+            if len(valid_indexes) == 0:
+                continue
+
+            rects = [self.region_to_rect(regions[i]) for i in valid_indexes]
+            try:
+                landmarks = self._raw_face_landmarks(image, rects)
+
+                # Drop the faces that aren't worth encoding, using the landmarks that the chips need anyway.
+                if self.quality is not None:
+                    is_accepted = [self.quality.accepts(image, regions[i], self._shape_to_points(shape))
+                                   for i, shape in zip(valid_indexes, landmarks)]
+                    for i in [i for i, accepted in zip(valid_indexes, is_accepted) if not accepted]:
+                        rejected[frame_index][i] = True
+                    valid_indexes = [i for i, accepted in zip(valid_indexes, is_accepted) if accepted]
+                    landmarks = [shape for shape, accepted in zip(landmarks, is_accepted) if accepted]
+
+                if len(valid_indexes) == 0:
+                    continue
+                chips.extend(self._landmarks_to_chips(image, landmarks))
+            except RuntimeError:
+                # Leave every region of this frame as a failure.
+                continue
+            chip_owners.extend((frame_index, i) for i in valid_indexes)
+
+        if len(chips) > 0:
+            vectors = self._encode_chips(chips, num_jitters)
+            for (frame_index, region_index), vector in zip(chip_owners, vectors):
+                results[frame_index][region_index] = vector
+
+        return results, rejected
+
+    @staticmethod
+    def _is_valid_region(image, region) -> bool:
+        """ Only regions with some area that overlap the image can be encoded. """
+        return region.width > 0 and region.height > 0 and \
+            region.right > 0 and region.bottom > 0 and \
+            region.left < image.shape[1] and region.top < image.shape[0]
+
     @staticmethod
     def region_to_rect(region):
         return (region.left, region.right, region.top, region.bottom)
@@ -61,9 +135,32 @@ class VectorExtractor:
         } for points in landmarks_as_tuples]
 
     def _face_encodings(self, face_image, known_face_locations=None, num_jitters=1):
-        raw_landmarks = self._raw_face_landmarks(face_image, known_face_locations)
-        return [np.array(self.face_encoder.compute_face_descriptor(face_image, raw_landmark_set, num_jitters)) for
-                raw_landmark_set in raw_landmarks]
+        chips = self._face_chips(face_image, known_face_locations)
+        return self._encode_chips(chips, num_jitters)
+
+    def _face_chips(self, face_image, face_locations=None):
+        """ Align and crop each face into the 150x150 chip that the face encoder expects. """
+        return self._landmarks_to_chips(face_image, self._raw_face_landmarks(face_image, face_locations))
+
+    @staticmethod
+    def _landmarks_to_chips(face_image, raw_landmarks):
+        if len(raw_landmarks) == 0:
+            return []
+
+        shapes = dlib.full_object_detections()
+        shapes.extend(raw_landmarks)
+        return dlib.get_face_chips(face_image, shapes, size=150, padding=0.25)
+
+    @staticmethod
+    def _shape_to_points(shape) -> np.array:
+        return np.array([(p.x, p.y) for p in shape.parts()], dtype=np.float64)
+
+    def _encode_chips(self, chips, num_jitters=1):
+        """ Encode a batch of face chips (from any number of images) in a single call. """
+        if len(chips) == 0:
+            return []
+        descriptors = self.face_encoder.compute_face_descriptor(chips, num_jitters)
+        return [np.array(d) for d in descriptors]
 
     def _raw_face_landmarks(self, face_image, face_locations=None):
 
@@ -2,10 +2,24 @@
 
 """
 Video reader simply reads in a video in any format, and outputs a CV2 BGR image.
+
+In threaded mode, a background thread reads the frames into a small ring buffer. For a live source, only the
+latest frames are kept (older ones are dropped and counted), so a slow consumer always gets a fresh frame
+instead of working through OpenCV's stale buffer. For a file, nothing is dropped: the thread decodes ahead
+until the buffer is full, then waits.
+
+While the scene is idle, the counter polls a live source slowly with next_latest_frame. That keeps taking the
+frames off the source while it waits, and returns only the newest one, so the poll sees what the camera sees
+now rather than the oldest frame left in its buffer.
 """
 
+import collections
 import os
+import threading
+import time
+
 import cv2
+from counter.clock import CLOCK_AUTO, WallClock, create_clock
 from tools.logger import Logger
 
 __author__ = "Jakrin Juangbhanich"
@@ -13,9 +27,64 @@ __copyright__ = "Copyright 2018, GenVis Pty Ltd."
 __email__ = "krinj@genvis.co"
 
 
+POLICY_AUTO = "auto"  # Latest for live sources, all for files.
+POLICY_LATEST = "latest"  # Keep the newest frames, dropping the oldest when the buffer is full.
+POLICY_ALL = "all"  # Never drop a frame. The reader waits for space in the buffer.
+CAPTURE_POLICIES = [POLICY_AUTO, POLICY_LATEST, POLICY_ALL]
+
+
+class CapturedFrame:
+    def __init__(self, index: int, image, timestamp: float):
+        self.index = index  # The frame's index in the source (including dropped frames).
+        self.image = image
+        self.timestamp = timestamp  # The reader's clock time when the frame was read.
+
+
 class VideoReader:
-    def __init__(self):
+    def __init__(self, threaded: bool = False, buffer_size: int = 4, policy: str = POLICY_AUTO,
+                 clock_mode: str = CLOCK_AUTO):
         self.cap = None
+        self.clock_mode = clock_mode
+        self.clock = WallClock()
+        self.threaded = threaded
+        self.buffer_size = max(1, buffer_size)
+        self.policy = policy
+
+        self.is_live = False
+        self.read_count = 0
+        self.dropped_count = 0
+
+        # Threaded capture.
+        self._buffer = collections.deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._has_ended = False
+        self._is_stopping = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.cap is not None
+
+    def open(self, source):
+        """ Open a file or a live source (a camera index, a device or a stream URL) and start reading. """
+        if self.policy not in CAPTURE_POLICIES:
+            raise ValueError("Unknown capture policy '{}'. Use one of: {}.".format(self.policy, CAPTURE_POLICIES))
+
+        self.cap = cv2.VideoCapture(source)
+        self.is_live = is_live_source(source)
+        self.clock = create_clock(self.clock_mode, self.is_live)
+        self.read_count = 0
+        self.dropped_count = 0
+        self._buffer.clear()
+        self._has_ended = False
+        self._is_stopping = False
+
+        if self.threaded:
+            policy = self.policy
+            if policy == POLICY_AUTO:
+                policy = POLICY_LATEST if self.is_live else POLICY_ALL
+            self._thread = threading.Thread(name="video-reader", target=self._run, args=(policy,), daemon=True)
+            self._thread.start()
 
     def start_capture(self, input_path: str) -> (int, int):
         """ Begin the video capture, returning the estimated frame length and rate. """
@@ -48,15 +117,116 @@ class VideoReader:
         self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
 
     def end_capture(self):
-        self.cap.release()
+        if self._thread is not None:
+            with self._condition:
+                self._is_stopping = True
+                self._condition.notify_all()
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+            self._thread = None
+
+            if self.dropped_count > 0:
+                Logger.field("Frames Dropped", "{}/{}".format(self.dropped_count, self.read_count))
+
+        if self.cap is not None:
+            self.cap.release()
         self.cap = None
 
     def next_frame(self):
         """ Get the next frame of the video. """
-        _, frame = self.cap.read()
-        if frame is None or frame.shape[0] == 0 or frame.shape[1] == 0:
+        captured = self.next_captured_frame()
+        return captured.image if captured is not None else None
+
+    def next_captured_frame(self):
+        """ Get the next frame, with its index and capture time. Returns None (and ends the capture) when the
+        video has ended. """
+        if self.threaded:
+            captured = self._take()
+        else:
+            captured = self._read()
+
+        if captured is None:
             self.end_capture()
-            return None
+        return captured
+
+    def next_latest_frame(self, wait: float):
+        """ Wait this long (in seconds), then get the newest frame. The frames that arrive in the meantime are
+        skipped. Returns None (and ends the capture) when the video has ended. """
+        if self.threaded:
+            time.sleep(wait)
+            captured = self._take(latest=True)
         else:
-            return frame
+            captured = self._read(wait)
+
+        if captured is None:
+            self.end_capture()
+        return captured
+
+    def _read(self, wait: float = 0.0):
+        """ Read the next frame. With a wait, keep grabbing frames for that long, and only decode the last. """
+        deadline = time.time() + wait
+        if not self.cap.grab():
+            return None
+
+        while time.time() < deadline:
+            if not self.cap.grab():
+                return None
+            self.read_count += 1
+
+        _, frame = self.cap.retrieve()
+        timestamp = self.clock.sample(self.cap)
+        if frame is None or frame.shape[0] == 0 or frame.shape[1] == 0:
+            return None
+
+        captured = CapturedFrame(self.read_count, frame, timestamp)
+        self.read_count += 1
+        return captured
+
+    # ======================================================================================================================
+    # Threaded capture.
+    # ======================================================================================================================
+
+    def _take(self, latest: bool = False):
+        """ Wait for the oldest frame in the buffer (or the newest, dropping the rest). """
+        with self._condition:
+            while len(self._buffer) == 0 and not self._has_ended:
+                self._condition.wait()
+            if len(self._buffer) == 0:
+                return None
+            if latest:
+                self.dropped_count += len(self._buffer) - 1
+                captured = self._buffer.pop()
+                self._buffer.clear()
+            else:
+                captured = self._buffer.popleft()
+            self._condition.notify_all()
+            return captured
+
+    def _run(self, policy: str):
+        while True:
+            captured = self._read()
+
+            with self._condition:
+                if captured is None or self._is_stopping:
+                    self._has_ended = True
+                    self._condition.notify_all()
+                    return
+
+                if policy == POLICY_ALL:
+                    while len(self._buffer) >= self.buffer_size and not self._is_stopping:
+                        self._condition.wait()
+                elif len(self._buffer) >= self.buffer_size:
+                    self._buffer.popleft()
+                    self.dropped_count += 1
+
+                self._buffer.append(captured)
+                self._condition.notify_all()
+
+
+def is_live_source(source) -> bool:
+    """ A camera index, a video device, or a network stream. Anything else is treated as a file. """
+    if isinstance(source, int):
+        return True
+    source = str(source)
+    return source.isdigit() or source.startswith("/dev/") or "://" in source
 
@@ -5,7 +5,9 @@ Use this tool to log stuff with pre-formatted margins, indents, line breaks, fie
 Also has the option to log output to the terminal and to a file.
 """
 
+import atexit
 import os
+import threading
 import time
 import sys
 from tools import pather
@@ -30,6 +32,13 @@ class Logger:
     DEFAULT_COLOR = '\33[0m'
     COLORS = [RED, GREEN, YELLOW, BLUE, DEFAULT_COLOR]
 
+    # Log levels. Messages below the current level are dropped before they are formatted.
+    DEBUG = 10
+    INFO = 20
+    ERROR = 40
+    LEVEL_NAMES = {"debug": DEBUG, "info": INFO, "error": ERROR}
+    _LEVEL = INFO
+
     # Singleton instance.
     _INSTANCE = None
 
@@ -44,20 +53,41 @@ class Logger:
         return Logger._INSTANCE
 
     @staticmethod
-    def log(message: str):
-        Logger.instance()._log(message)
+    def set_level(level):
+        """ Set the minimum level to log. Accepts a level constant, or its name (debug, info, error). """
+        if isinstance(level, str):
+            level = Logger.LEVEL_NAMES[level.lower()]
+        Logger._LEVEL = level
+
+    @staticmethod
+    def is_enabled(level: int) -> bool:
+        return level >= Logger._LEVEL
+
+    @staticmethod
+    def log(message: str, level: int = INFO):
+        if level >= Logger._LEVEL:
+            Logger.instance()._log(message)
 
     @staticmethod
-    def field(field_name: str, value, red: bool=False, extra_indent: int=1):
-        Logger.instance()._field(field_name, value, red, extra_indent)
+    def field(field_name: str, value, red: bool=False, extra_indent: int=1, level: int = INFO):
+        if level >= Logger._LEVEL:
+            Logger.instance()._field(field_name, value, red, extra_indent)
+
+    @staticmethod
+    def debug(field_name: str, value):
+        """ A field that is only logged at the debug level. Cheap to call on the hot path. """
+        if Logger.DEBUG >= Logger._LEVEL:
+            Logger.instance()._field(field_name, value)
 
     @staticmethod
     def special(message: str, with_gap: bool=True):
-        Logger.instance()._special(message, with_gap)
+        if Logger.INFO >= Logger._LEVEL:
+            Logger.instance()._special(message, with_gap)
 
     @staticmethod
     def header(message: str, with_gap: bool = True):
-        Logger.instance()._header(message, with_gap)
+        if Logger.INFO >= Logger._LEVEL:
+            Logger.instance()._header(message, with_gap)
 
     @staticmethod
     def error(message: str):
@@ -84,8 +114,9 @@ class Logger:
         Logger.instance()._clear_indent()
 
     @staticmethod
-    def attach_file_handler(path: str, main_name: str = "output", error_name: str = "error"):
-        Logger.instance()._attach_file_handler(path, main_name, error_name)
+    def attach_file_handler(path: str, main_name: str = "output", error_name: str = "error",
+                            max_bytes: int = 10485760, backup_count: int = 3, flush_interval: float = 1.0):
+        Logger.instance()._attach_file_handler(path, main_name, error_name, max_bytes, backup_count, flush_interval)
 
     @staticmethod
     def add_action(tag: str, action):
@@ -95,6 +126,10 @@ class Logger:
     def clear_actions():
         Logger.instance()._clear_actions()
 
+    @staticmethod
+    def flush():
+        Logger.instance()._flush()
+
     # ==================================================================================================================
     # Constructor
     # ==================================================================================================================
@@ -122,6 +157,10 @@ class Logger:
 
         # Custom logging attachments.
         self.actions = {}
+        self.file_handlers = []
+
+        # Messages can come from several threads. Keep each one whole.
+        self._lock = threading.RLock()
 
     # ======================================================================================================================
     # Core logging methods.
@@ -180,24 +219,27 @@ class Logger:
 
     def _write(self, message: str, is_error: bool=False, extra_indent: int = 0):
 
-        # Add the message header and the indents.
-        message = self._add_format(message, extra_indent)
+        with self._lock:
 
-        # Write the message to Python standard print.
-        if is_error:
-            print(message, file=sys.stderr)
-            sys.stderr.flush()
-        else:
-            print(message)
-            sys.stdout.flush()
+            # Add the message header and the indents.
+            message = self._add_format(message, extra_indent)
+
+            # Write the message to Python standard print.
+            if is_error:
+                print(message, file=sys.stderr)
+                sys.stderr.flush()
+            else:
+                print(message)
+                sys.stdout.flush()
 
-        # Clear the colors and write the message to all the custom actions.
-        message = self._strip_colors(message)
-        for k in self.actions:
-            action = self.actions[k]
-            action(message, is_error)
+            # Clear the colors and write the message to all the custom actions.
+            message = self._strip_colors(message)
+            for k in self.actions:
+                action = self.actions[k]
+                action(message, is_error)
 
-    def _attach_file_handler(self, path: str, main_name: str="output", error_name: str="error"):
+    def _attach_file_handler(self, path: str, main_name: str="output", error_name: str="error",
+                             max_bytes: int = 10485760, backup_count: int = 3, flush_interval: float = 1.0):
 
         # Create the file if it doesn't exist.
         pather.create(path)
@@ -210,22 +252,29 @@ class Logger:
         if os.path.exists(error_path):
             os.remove(error_path)
 
-        # If it does, then open and append to it (unless clear is specified).
-        def write_to_file(message: str, is_error: bool):
-            write_path = error_path if is_error else main_path
+        # Keep both files open, and write to them through a buffer.
+        main_handler = BufferedFileHandler(main_path, max_bytes, backup_count, flush_interval)
+        error_handler = BufferedFileHandler(error_path, max_bytes, backup_count, flush_interval)
+        self.file_handlers.extend([main_handler, error_handler])
 
-            # Lazy create the path if it doesn't exist.
-            pather.create(write_path, clear=False)
-            with open(write_path, "a+") as f:
-                f.write(message + "\n")
+        def write_to_file(message: str, is_error: bool):
+            handler = error_handler if is_error else main_handler
+            handler.write(message)
 
         self._add_action(main_path, write_to_file)
 
+    def _flush(self):
+        for handler in self.file_handlers:
+            handler.flush()
+
     def _add_action(self, tag: str, action):
         self.actions[tag] = action
 
     def _clear_actions(self):
         self.actions.clear()
+        for handler in self.file_handlers:
+            handler.close()
+        self.file_handlers = []
 
     # ======================================================================================================================
     # Formatting Methods.
@@ -263,3 +312,86 @@ class Logger:
         for c in self.COLORS:
             message = message.replace(c, "")
         return message
+
+
+class BufferedFileHandler:
+    """ Keeps a log file open, and buffers the messages written to it. The buffer is written out when it is
+    full, or by a background thread every flush interval. The file is rotated when it gets too big, keeping
+    a bounded number of backups (output.log.1, output.log.2, ...). All methods are thread safe. """
+
+    def __init__(self, path: str, max_bytes: int = 10485760, backup_count: int = 3, flush_interval: float = 1.0,
+                 buffer_size: int = 65536):
+        self.path = path
+        self.max_bytes = max_bytes  # 0 means the file is never rotated.
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+
+        self._buffer = []
+        self._buffer_length = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+        pather.create(os.path.dirname(path) or ".")
+        self._file = open(path, "a")
+        self._file_size = self._file.tell()
+
+        self._flush_thread = threading.Thread(name="log-flush", target=self._run_flush, daemon=True)
+        self._flush_thread.start()
+        atexit.register(self.close)
+
+    def write(self, message: str):
+        with self._lock:
+            if self._file is None:
+                return
+            self._buffer.append(message + "\n")
+            self._buffer_length += len(message) + 1
+            if self._buffer_length >= self.buffer_size:
+                self._flush_buffer()
+
+    def flush(self):
+        with self._lock:
+            self._flush_buffer()
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            self._flush_buffer()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _run_flush(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def _flush_buffer(self):
+        if self._file is None or len(self._buffer) == 0:
+            return
+
+        data = "".join(self._buffer)
+        self._buffer = []
+        self._buffer_length = 0
+
+        if self.max_bytes > 0 and self._file_size > 0 and self._file_size + len(data) > self.max_bytes:
+            self._rotate()
+
+        self._file.write(data)
+        self._file.flush()
+        self._file_size += len(data)
+
+    def _rotate(self):
+        """ Shift the backups along (dropping the oldest), and start a new file. """
+        self._file.close()
+
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                source = "{}.{}".format(self.path, i)
+                if os.path.exists(source):
+                    os.replace(source, "{}.{}".format(self.path, i + 1))
+            os.replace(self.path, "{}.1".format(self.path))
+        else:
+            os.remove(self.path)
+
+        self._file = open(self.path, "a")
+        self._file_size = 0
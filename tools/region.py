@@ -1,7 +1,12 @@
 import math
+from typing import List
+
+import numpy as np
 
 
 class Region:
+    __slots__ = ("_left", "_right", "_top", "_bottom", "_x", "_y", "_width", "_height", "_force_int")
+
     def __init__(self, left=0, right=0, top=0, bottom=0, force_int: bool = True):
 
         # Rect. Origin (0, 0) is top-left.
@@ -237,3 +242,215 @@ class Region:
     def fast_distance(r1: 'Region', r2: 'Region'):
         """ A quicker way of calculating approximate distance. Lower accuracy but faster results."""
         return abs(r1.x - r2.x) + abs(r1.y - r2.y)
+
+
+class RegionBatch:
+    """ Many regions in one (n x 8) numpy array, one row per region. Each row holds the same eight values that a
+    Region does, so converting to and from Regions is lossless, and every operation here gives the same result
+    (including the integer rounding) as doing it to each Region in turn. """
+
+    __slots__ = ("data", "force_int")
+
+    # The columns of the data array.
+    LEFT, TOP, RIGHT, BOTTOM, X, Y, WIDTH, HEIGHT = range(8)
+
+    def __init__(self, data: np.array = None, force_int: bool = True):
+        self.data = data if data is not None else np.zeros((0, 8))
+        self.force_int = force_int
+
+    # ======================================================================================================================
+    # Conversion.
+    # ======================================================================================================================
+
+    @classmethod
+    def from_rects(cls, rects: np.array, force_int: bool = True) -> 'RegionBatch':
+        """ Regions from (n x 4) [left, top, right, bottom] rows, as if each was made by Region.set_rect. """
+        rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+        if np.any(rects[:, 2] < rects[:, 0]) or np.any(rects[:, 3] < rects[:, 1]):
+            raise Exception("Invalid Input", "Right and bottom must be greater than left and top.")
+
+        batch = cls(np.zeros((len(rects), 8)), force_int)
+        batch.data[:, :4] = rects
+        batch._calibrate_to_rect()
+        return batch
+
+    @classmethod
+    def from_regions(cls, regions: List[Region]) -> 'RegionBatch':
+        force_int = all(r._force_int for r in regions)
+        data = np.array([(r._left, r._top, r._right, r._bottom, r._x, r._y, r._width, r._height) for r in regions],
+                        dtype=np.float64).reshape(-1, 8)
+        return cls(data, force_int)
+
+    def to_regions(self, region_type: type = Region) -> List[Region]:
+        """ A Region (or a subclass, like TrackingRegion) for each row. """
+        regions = []
+        cast = int if self.force_int else float
+        for left, top, right, bottom, x, y, width, height in self.data.tolist():
+            region = region_type()
+            region._left, region._top, region._right, region._bottom = cast(left), cast(top), cast(right), cast(bottom)
+            region._x, region._y, region._width, region._height = cast(x), cast(y), cast(width), cast(height)
+            region._force_int = self.force_int
+            regions.append(region)
+        return regions
+
+    def clone(self) -> 'RegionBatch':
+        """ Like Region.clone, each copy is rebuilt from its rect. """
+        return RegionBatch.from_rects(self.rects, self.force_int)
+
+    def select(self, index) -> 'RegionBatch':
+        """ The rows picked by a mask or an index array. """
+        return RegionBatch(self.data[index].reshape(-1, 8), self.force_int)
+
+    def __len__(self):
+        return len(self.data)
+
+    # ======================================================================================================================
+    # Utility functions.
+    # ======================================================================================================================
+
+    def contains(self, x, y) -> np.array:
+        """ Whether the (x, y) point (or one point per row) is within the area of each region. """
+        data = self.data
+        return (x >= data[:, self.LEFT]) & (x <= data[:, self.RIGHT]) & \
+               (y >= data[:, self.TOP]) & (y <= data[:, self.BOTTOM])
+
+    def is_in_bounds(self, width, height) -> np.array:
+        """ Whether each entire region is contained within the bounds of a given stage size. """
+        data = self.data
+        return (data[:, self.TOP] >= 0) & (data[:, self.BOTTOM] <= height) & \
+               (data[:, self.LEFT] >= 0) & (data[:, self.RIGHT] <= width)
+
+    def clip(self, width, height) -> 'RegionBatch':
+        """ Copies of the regions, cut to fit within a stage of this size. """
+        rects = self.rects
+        rects[:, [0, 2]] = np.clip(rects[:, [0, 2]], 0, width)
+        rects[:, [1, 3]] = np.clip(rects[:, [1, 3]], 0, height)
+        return RegionBatch.from_rects(rects, self.force_int)
+
+    def scale(self, scale_value: float = 1.0):
+        self.data[:, self.WIDTH] = np.trunc(self.data[:, self.WIDTH] * scale_value)
+        self.data[:, self.HEIGHT] = np.trunc(self.data[:, self.HEIGHT] * scale_value)
+        self._calibrate_to_xy()
+
+    def expand_to_ratio(self, aspect_ratio: float = 1.0):
+        width, height = self.data[:, self.WIDTH], self.data[:, self.HEIGHT]
+        aspect_width = np.trunc(height * aspect_ratio)
+        aspect_height = width // aspect_ratio
+
+        is_wider = aspect_width > width
+        is_taller = ~is_wider & (aspect_height > height)
+        self.data[is_wider, self.WIDTH] = aspect_width[is_wider]
+        self.data[is_taller, self.HEIGHT] = np.trunc(aspect_height[is_taller])
+        self._calibrate_to_xy(is_wider | is_taller)  # The other rows are left exactly as they were.
+
+    def canvas_resize(self, scale):
+        """ Resize these regions against the entire axis space. """
+        self.data[:, :4] *= scale
+        self._calibrate_to_rect()
+
+    # ======================================================================================================================
+    # Pairwise functions. Each returns an (n x m) matrix, for these n regions against the other m regions.
+    # ======================================================================================================================
+
+    def distance(self, other: 'RegionBatch') -> np.array:
+        """ The distance between the x and y of each pair of regions. """
+        dx = other.x[np.newaxis, :] - self.x[:, np.newaxis]
+        dy = other.y[np.newaxis, :] - self.y[:, np.newaxis]
+        return np.sqrt(dx ** 2 + dy ** 2)
+
+    def fast_distance(self, other: 'RegionBatch') -> np.array:
+        """ A quicker way of calculating approximate distance. Lower accuracy but faster results. """
+        return np.abs(self.x[:, np.newaxis] - other.x[np.newaxis, :]) + \
+            np.abs(self.y[:, np.newaxis] - other.y[np.newaxis, :])
+
+    def intersection(self, other: 'RegionBatch') -> np.array:
+        """ The area that each pair of regions overlap by. """
+        a, b = self.data, other.data
+        width = np.minimum(a[:, np.newaxis, self.RIGHT], b[np.newaxis, :, self.RIGHT]) - \
+            np.maximum(a[:, np.newaxis, self.LEFT], b[np.newaxis, :, self.LEFT])
+        height = np.minimum(a[:, np.newaxis, self.BOTTOM], b[np.newaxis, :, self.BOTTOM]) - \
+            np.maximum(a[:, np.newaxis, self.TOP], b[np.newaxis, :, self.TOP])
+        return np.maximum(0, width) * np.maximum(0, height)
+
+    def iou(self, other: 'RegionBatch') -> np.array:
+        """ The intersection over union of each pair of regions. """
+        intersection = self.intersection(other)
+        union = self.area[:, np.newaxis] + other.area[np.newaxis, :] - intersection
+        return intersection / np.maximum(union, 1e-6)
+
+    # ======================================================================================================================
+    # Private calibration functions.
+    # ======================================================================================================================
+
+    def _calibrate_to_rect(self) -> None:
+        data = self.data
+        data[:, self.WIDTH] = data[:, self.RIGHT] - data[:, self.LEFT]
+        data[:, self.HEIGHT] = data[:, self.BOTTOM] - data[:, self.TOP]
+        data[:, self.X] = data[:, self.LEFT] + data[:, self.WIDTH] / 2
+        data[:, self.Y] = data[:, self.TOP] + data[:, self.HEIGHT] / 2
+
+        if self.force_int:
+            np.trunc(data, out=data)
+
+    def _calibrate_to_xy(self, rows: np.array = None) -> None:
+        data = self.data if rows is None else self.data[rows]
+        half_width = data[:, self.WIDTH] / 2
+        half_height = data[:, self.HEIGHT] / 2
+        data[:, self.LEFT] = data[:, self.X] - half_width
+        data[:, self.RIGHT] = data[:, self.X] + half_width
+        data[:, self.TOP] = data[:, self.Y] - half_height
+        data[:, self.BOTTOM] = data[:, self.Y] + half_height
+
+        if self.force_int:
+            np.trunc(data, out=data)
+        if rows is not None:
+            self.data[rows] = data
+
+    # ======================================================================================================================
+    # Access properties.
+    # ======================================================================================================================
+
+    @property
+    def rects(self) -> np.array:
+        """ A copy of the (n x 4) [left, top, right, bottom] rows. """
+        return self.data[:, :4].copy()
+
+    @property
+    def left(self) -> np.array:
+        return self.data[:, self.LEFT]
+
+    @property
+    def top(self) -> np.array:
+        return self.data[:, self.TOP]
+
+    @property
+    def right(self) -> np.array:
+        return self.data[:, self.RIGHT]
+
+    @property
+    def bottom(self) -> np.array:
+        return self.data[:, self.BOTTOM]
+
+    @property
+    def x(self) -> np.array:
+        return self.data[:, self.X]
+
+    @property
+    def y(self) -> np.array:
+        return self.data[:, self.Y]
+
+    @property
+    def width(self) -> np.array:
+        return self.data[:, self.WIDTH]
+
+    @property
+    def height(self) -> np.array:
+        return self.data[:, self.HEIGHT]
+
+    @property
+    def biggest_edge(self) -> np.array:
+        return np.maximum(self.width, self.height)
+
+    @property
+    def area(self) -> np.array:
+        return self.width * self.height
@@ -4,9 +4,15 @@
 Draw good looking text to Cv2/Numpy images. Cv2's default text renderer is a bit ugly. I can't
 specify the font, and not all sizes look great. Here I use PIL with Cv2 to get ttf fonts into the jam,
 and also include support for the FontAwesome icon fonts.
+
+Each string is rendered once (with PIL) into an alpha mask sprite, which is cached. Drawing it after that only
+blends the mask into the part of the image it covers, so the cost depends on the size of the text, and not the
+size of the frame.
 """
 
 import os
+import threading
+from collections import OrderedDict
 import cv2
 import numpy as np
 from PIL import Image, ImageFont, ImageDraw
@@ -31,6 +37,28 @@ FONT_DEFAULT = "DEFAULT"
 FONT_ICON = "ICON"
 
 DEFAULT_PAD = 8
+SPRITE_CACHE_SIZE = 1024
+
+
+# ======================================================================================================================
+# A pre-rendered string.
+# ======================================================================================================================
+
+
+class TextSprite:
+    def __init__(self, mask: np.array, offset_x: int, offset_y: int, text_size):
+        self.mask = mask  # uint8 alpha mask (0 - 255) of the rendered text.
+        self.offset_x = offset_x  # Where the mask starts, relative to the draw position.
+        self.offset_y = offset_y
+        self.text_size = text_size  # The (width, height) that the font reports for the text, used for layout.
+
+    @property
+    def width(self):
+        return self.mask.shape[1]
+
+    @property
+    def height(self):
+        return self.mask.shape[0]
 
 
 # ======================================================================================================================
@@ -50,6 +78,11 @@ class TextManager:
         self.base_path = os.path.join(os.path.dirname(__file__), "fonts")
         self.fonts_by_size = {}
 
+        # LRU cache of the rendered text sprites, by (text, font type, size).
+        self.sprites = OrderedDict()
+        self.sprite_cache_size = SPRITE_CACHE_SIZE
+        self._sprite_lock = threading.Lock()
+
         self.font_path_map = {
             FONT_DEFAULT: "RobotoMono-Medium.ttf",
             FONT_ICON: "fa-solid-900.ttf"
@@ -78,6 +111,43 @@ class TextManager:
         text_manager = TextManager.instance()
         return text_manager.font_divisor_map[font_type]
 
+    @staticmethod
+    def get_sprite(text: str, font_type: str = FONT_DEFAULT, font_size: int = 18) -> TextSprite:
+        text_manager = TextManager.instance()
+        key = (text, font_type, font_size)
+
+        with text_manager._sprite_lock:
+            sprite = text_manager.sprites.get(key)
+            if sprite is not None:
+                text_manager.sprites.move_to_end(key)
+                return sprite
+
+        sprite = text_manager._render_sprite(text, font_type, font_size)
+
+        with text_manager._sprite_lock:
+            text_manager.sprites[key] = sprite
+            while len(text_manager.sprites) > text_manager.sprite_cache_size:
+                text_manager.sprites.popitem(last=False)
+
+        return sprite
+
+    def _render_sprite(self, text: str, font_type: str, font_size: int) -> TextSprite:
+        """ Render the text into an "L" mask with a margin (some glyphs reach outside their box),
+        then crop it down to the pixels that were drawn. """
+        font = TextManager.get_font(font_type=font_type, font_size_id=font_size)
+        width, height = font.getsize(text)
+        margin = font_size
+
+        mask_image = Image.new("L", (width + margin * 2, height + margin * 2), 0)
+        ImageDraw.Draw(mask_image).text((margin, margin), text, font=font, fill=255)
+
+        bbox = mask_image.getbbox()
+        if bbox is None:
+            return TextSprite(np.zeros((0, 0), dtype=np.uint8), 0, 0, (width, height))
+
+        mask = np.array(mask_image.crop(bbox), dtype=np.uint8)
+        return TextSprite(mask, bbox[0] - margin, bbox[1] - margin, (width, height))
+
     def _load_font(self, font_type: str = FONT_DEFAULT, size: int = 18) -> None:
         if size not in self.fonts_by_size:
             self.fonts_by_size[size] = {}
@@ -102,7 +172,23 @@ def raw_text(
         font_size: int = 18,
         color=(255, 255, 255)
 ):
-    """ Draw the specified text into the image at the point of the region. """
+    """ Draw the specified text into the image at the point of the region. The image is drawn into (and returned). """
+    sprite = TextManager.get_sprite(text, font_type, font_size)
+    _blend_sprite(image, sprite, x, y, color)
+    return image
+
+
+def _raw_text_pil(
+        image: np.array,
+        text: str,
+        x: int,
+        y: int,
+        font_type: str = FONT_DEFAULT,
+        font_size: int = 18,
+        color=(255, 255, 255)
+):
+    """ The original renderer, which round trips the whole image through PIL. Kept as the reference for
+    the sprite renderer (and for the benchmark). """
 
     # Convert image from CV2 to PIL.
     pil_image, pil_draw = _cv2_to_pil(image)
@@ -362,9 +448,9 @@ def label_region(image: np.array, text: str, region: Region, icon: str = None, p
 
 
 def get_text_size(text: str, font_type: str = FONT_DEFAULT, font_size: int = 16):
-    """ Returns the width and height for this text, font and size. """
-    font = TextManager.get_font(font_type=font_type, font_size_id=font_size)
-    return font.getsize(text)
+    """ Returns the width and height for this text, font and size. Measuring is slow, so this comes from
+    the cached sprite. """
+    return TextManager.get_sprite(text, font_type, font_size).text_size
 
 
 def _get_text_and_icon_size(text: str, icon: str, pad: int = 0, font_type: str = FONT_DEFAULT, font_size: int = 16):
@@ -376,21 +462,52 @@ def _get_text_and_icon_size(text: str, icon: str, pad: int = 0, font_type: str =
 
 
 def _fill_region(image: np.array, region: Region, bg_color=None, bg_opacity: float = 1.0):
-    """ Fill the region in this image with a color and opacity. """
+    """ Fill the region in this image with a color and opacity. Only the region itself is blended. """
 
     # No color or opacity is clear, do nothing.
     if bg_color is None or bg_opacity <= 0.0:
         return image
 
+    # The area that the (inclusive) rectangle covers, clipped to the image.
+    left, right = max(0, min(region.left, region.right)), min(image.shape[1], max(region.left, region.right) + 1)
+    top, bottom = max(0, min(region.top, region.bottom)), min(image.shape[0], max(region.top, region.bottom) + 1)
+    if left >= right or top >= bottom:
+        return image
+
+    roi = image[top:bottom, left:right]
+
     # Opacity 1, just draw it onto the image.
     if bg_opacity >= 1.0:
-        cv2.rectangle(image, (region.left, region.top), (region.right, region.bottom), color=bg_color, thickness=-1)
+        roi[:] = bg_color
         return image
 
-    # Opacity is semi-clear. Draw it in a different image and overlay it on.
-    overlay_image = np.copy(image)
-    cv2.rectangle(overlay_image, (region.left, region.top), (region.right, region.bottom), color=bg_color, thickness=-1)
-    return cv2.addWeighted(image, 1.0 - bg_opacity, overlay_image, bg_opacity, 0.0)
+    # Opacity is semi-clear. Blend the color over the region.
+    fill = np.empty_like(roi)
+    fill[:] = bg_color
+    cv2.addWeighted(roi, 1.0 - bg_opacity, fill, bg_opacity, 0.0, dst=roi)
+    return image
+
+
+def _blend_sprite(image: np.array, sprite: TextSprite, x: int, y: int, color):
+    """ Alpha blend the sprite in this color into the image, in place. Only the region of interest under the
+    sprite is touched. The blend uses the same integer rounding as PIL, so the output is identical. """
+    left = x + sprite.offset_x
+    top = y + sprite.offset_y
+    right = left + sprite.width
+    bottom = top + sprite.height
+
+    # Clip the sprite to the image.
+    c_left, c_top = max(left, 0), max(top, 0)
+    c_right, c_bottom = min(right, image.shape[1]), min(bottom, image.shape[0])
+    if c_left >= c_right or c_top >= c_bottom:
+        return
+
+    mask = sprite.mask[c_top - top:c_bottom - top, c_left - left:c_right - left]
+    mask = mask.astype(np.int32)[:, :, np.newaxis]
+    roi = image[c_top:c_bottom, c_left:c_right]
+
+    blend = roi.astype(np.int32) * (255 - mask) + np.array(color[:3], dtype=np.int32) * mask + 128
+    roi[:] = ((blend >> 8) + blend) >> 8
 
 
 def _cv2_to_pil(image: np.array) -> (Image, ImageDraw):
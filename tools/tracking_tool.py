@@ -3,13 +3,13 @@ import uuid
 from enum import Enum
 from typing import List, Tuple
 from tools import core
-from tools.simple_filter import SimpleFilter
 from abc import abstractmethod
 import numpy as np
 from tools import visual
 
 
 class TrackingRegion(Region):
+    __slots__ = ("confidence", "label", "data")
 
     def __init__(self, left=0, right=0, top=0, bottom=0):
         super().__init__(left, right, top, bottom)
@@ -28,13 +28,19 @@ class TrackingRegion(Region):
 
 
 class TrackFrame:
+    """ A detected region, and the (x, y, width, height) box to display for it. The display region itself is only
+    created when it is asked for. """
+
     def __init__(self, region: TrackingRegion = None, ratio_lock: float = 0.0, scale_factor: float = 1.0):
         # Basic tracking parameters.
         self.scale_factor = scale_factor
         self.ratio_lock = ratio_lock
         self.frame_index = 0
         self.raw_region = None
-        self.display_region = None
+        self.x = 0
+        self.y = 0
+        self.width = 0
+        self.height = 0
 
         if region is not None:
             self.set_region(region)
@@ -42,42 +48,24 @@ class TrackFrame:
     def set_region(self, region: TrackingRegion):
         if region is not None:
             self.raw_region = region
-            self.display_region = region.clone()
-            if self.ratio_lock != 0:
-                self.display_region.expand_to_ratio(self.ratio_lock)
-            self.display_region.scale(self.scale_factor)
-
-    @property
-    def x(self):
-        return self.display_region.x
-
-    @x.setter
-    def x(self, value):
-        self.display_region.x = int(value)
-
-    @property
-    def y(self):
-        return self.display_region.y
-
-    @y.setter
-    def y(self, value):
-        self.display_region.y = int(value)
+            self.width, self.height = region.right - region.left, region.bottom - region.top
+            self.x, self.y = int(region.left + self.width / 2), int(region.top + self.height / 2)
 
-    @property
-    def width(self):
-        return self.display_region.width
+            # The same steps as Region.expand_to_ratio and Region.scale, without the clone.
+            if self.ratio_lock != 0:
+                aspect_width = int(self.height * self.ratio_lock)
+                aspect_height = self.width // self.ratio_lock
+                if aspect_width > self.width:
+                    self.width = aspect_width
+                elif aspect_height > self.height:
+                    self.height = int(aspect_height)
 
-    @width.setter
-    def width(self, value):
-        self.display_region.width = int(value)
+            self.width = int(self.width * self.scale_factor)
+            self.height = int(self.height * self.scale_factor)
 
     @property
-    def height(self):
-        return self.display_region.height
-
-    @height.setter
-    def height(self, value):
-        self.display_region.height = int(value)
+    def display_region(self) -> TrackingRegion:
+        return _box_to_region(self.x, self.y, self.width, self.height)
 
 
 class VisualState(Enum):
@@ -88,6 +76,9 @@ class VisualState(Enum):
 
 
 class Tracklet:
+    """ A handle to one row of a TrackletStore. The state of the track (its display box, hit and miss counters,
+    visual state and a short history of its frames) lives in the store's arrays. """
+
     # Visual Constants
     _PINK = (80, 30, 255)
     _RED = (0, 0, 255)
@@ -105,38 +96,23 @@ class Tracklet:
                "Frames: {}-{} " \
                "Size: {}]".format(
                     self.id,
-                    self.first_frame.frame_index,
-                    self.last_frame.frame_index,
+                    self.first_frame_index,
+                    self.last_frame_index,
                     self.frame_count)
 
         return desc
 
     def __init__(self, hit_limit: int = 3, miss_limit: int = 7,
-                 color: Tuple = (255, 255, 255), red_fade: bool = False):
-        self.track_frames = []
+                 color: Tuple = (255, 255, 255), red_fade: bool = False, store: 'TrackletStore' = None):
+        # A tracklet that isn't made by a Tracker keeps its own store.
+        self._store = store if store is not None else TrackletStore(capacity=1)
+        self._slot = self._store.allocate(hit_limit, miss_limit)
 
-        # TODO: We should probably allow this for config passing.
-
-        # Smoothing Filters.
         self.id = uuid.uuid4().hex
-        self._position_filter = SimpleFilter(0.5)
-        self._size_filter = SimpleFilter(0.5)
-
-        # Consecutive.
-        self._hit_counter = 0
-        self._miss_counter = 0
-        self._hit_limit = hit_limit
-        self._miss_limit = miss_limit
-        self._activated = False
-        self._lost = False
-        # TODO: Enum? UNTRACKED, LIVE, LOST?
 
         # Visual State Information.
-        self._anim_show_counter = 0
-        self._anim_kill_counter = 0
         self._color = color
         self._red_fade = red_fade  # Fade using the red animation.
-        self.visual_state = VisualState.NORMAL
 
         self.image = None
 
@@ -146,61 +122,18 @@ class Tracklet:
 
     def add(self, track_frame: TrackFrame, register_hit: bool = True):
         """ Add a new frame to this Tracklet. Filter the tracklet's display region. """
-
-        self._filter_frame(track_frame)
-        self.track_frames.append(track_frame)
-
-        # Also automatically register a hit to this Tracklet.
-        if register_hit:
-            self.update(True)
+        self._store.add(np.array([self._slot]), [track_frame], register_hit)
 
     def update(self, hit: bool = True):
         """ This function should be called every frame, to either register a hit or miss. """
-        if self._lost:
-            self._step_kill_animation()
-            return
+        self._store.register(np.array([self._slot]), hit)
 
-        self._register(hit)
-
-    # ===================================================================================================
-    # Private Functions.
-    # ===================================================================================================
-
-    def _filter_frame(self, track_frame: TrackFrame) -> TrackFrame:
-        """ Smoothly filter the position and size of the new frame. """
-        if len(self.track_frames) > 0:
-            pt = self.track_frames[-1]
-            track_frame.x = self._position_filter.process(track_frame.x, pt.x)
-            track_frame.y = self._position_filter.process(track_frame.y, pt.y)
-            track_frame.width = self._size_filter.process(track_frame.width, pt.width)
-            track_frame.height = self._size_filter.process(track_frame.height, pt.height)
-        return track_frame
-
-    def _register(self, hit: bool = True):
-        """ Register a hit or a miss, and update the counters. """
-        if hit:
-            self._hit_counter += 1
-            self._miss_counter = 0
-        else:
-            self._miss_counter += 1
-            self._hit_counter = 0
-
-        self._check_and_activate()
-        self._check_and_kill()
-
-    def _check_and_activate(self):
-        """ Check the conditions for activating this Tracklet. Execute it if passed. """
-        if not self._activated and self._hit_counter >= self._hit_limit:
-            self._activated = True
-
-    def _check_and_kill(self):
-        """ Check the conditions for losing this Tracklet. Execute it if passed. """
-        if not self._lost and self._miss_counter >= self._miss_limit:
-            self._lost = True
-
-            # If it has never been activated, kill it immediately.
-            if not self._activated:
-                self.visual_state = VisualState.KILLED
+    def detach(self):
+        """ Move this tracklet's state into a store of its own, and free its row in the shared store. """
+        store = TrackletStore(capacity=1)
+        self._store.copy_row(self._slot, store, store.allocate(self.hit_limit, self.miss_limit))
+        self._store.release([self._slot])
+        self._store, self._slot = store, 0
 
     # ===================================================================================================
     # Access Properties.
@@ -209,48 +142,80 @@ class Tracklet:
     @property
     def is_recent(self) -> bool:
         """ Received a hit in the latest update cycle. """
-        return self._hit_counter > 0
+        return bool(self._store.hits[self._slot] > 0)
 
     @property
     def is_live(self) -> bool:
         """ Received enough hits to be activated, and has not yet been lost."""
-        return self._activated and not self._lost
+        return self.is_activated and not self.is_lost
 
     @property
     def is_activated(self) -> bool:
         """ Received enough hits to be considered activated. """
-        return self._activated
+        return bool(self._store.activated[self._slot])
 
     @property
     def is_lost(self) -> bool:
         """ Received enough misses to be considered lost."""
-        return self._lost
+        return bool(self._store.lost[self._slot])
 
     @property
     def is_displayable(self) -> bool:
         """ Received enough misses to be considered lost."""
         return self.is_activated and self.visual_state != VisualState.KILLED
 
+    @property
+    def visual_state(self) -> VisualState:
+        return VisualState(int(self._store.visual_state[self._slot]))
+
+    @visual_state.setter
+    def visual_state(self, value: VisualState):
+        self._store.visual_state[self._slot] = value.value
+
+    @property
+    def slot(self) -> int:
+        """ This tracklet's row in its store. """
+        return self._slot
+
+    @property
+    def track_frames(self) -> List[TrackFrame]:
+        """ The frames still in the history ring, oldest first. """
+        return self._store.history(self._slot)
+
     @property
     def first_frame(self) -> TrackFrame:
+        """ The oldest frame that is still in the history ring. """
         return self.track_frames[0]
 
     @property
     def last_frame(self) -> TrackFrame:
         return self.track_frames[-1]
 
+    @property
+    def first_frame_index(self) -> int:
+        return int(self._store.first_frame_index[self._slot])
+
+    @property
+    def last_frame_index(self) -> int:
+        return int(self._store.last_frame_index[self._slot])
+
+    @property
+    def last_raw_region(self) -> TrackingRegion:
+        """ The region that was last added to this Tracklet (the same object, not a copy). """
+        return self._store.last_regions[self._slot]
+
     @property
     def miss_limit(self) -> int:
-        return self._miss_limit
+        return int(self._store.miss_limit[self._slot])
 
     @property
     def hit_limit(self) -> int:
-        return self._hit_limit
+        return int(self._store.hit_limit[self._slot])
 
     @property
     def frame_count(self) -> int:
         """ Number of frames in this Tracklet so far. """
-        return len(self.track_frames)
+        return int(self._store.frame_count[self._slot])
 
     # ======================================================================================================================
     # Visual and animation functions.
@@ -259,31 +224,26 @@ class Tracklet:
     @property
     def raw_region(self):
         """ Get the latest raw region of this Tracklet. """
-        return self.last_frame.raw_region.clone()
+        return self.last_raw_region.clone()
 
     @property
     def display_region(self):
         """ Gets the display region to show for this current frame."""
-        last_region = self.last_frame.display_region.clone()
+        last_region = _box_to_region(*self._store.display[self._slot].tolist())
         if self.is_lost:
             last_region.data["color"] = self._get_kill_animation_color()
         else:
             last_region.data["color"] = self._color
         return last_region
 
-    def _step_kill_animation(self):
-        """ Update the kill animation counter. """
-        self._anim_kill_counter += 1
-        if self._anim_kill_counter >= self._ANIM_KILL_MAX:
-            self.visual_state = VisualState.KILLED
-
     def _get_kill_animation_color(self) -> Tuple:
         """ Get the current display color for this step of the animation. """
-        progress = self._anim_kill_counter / self._ANIM_KILL_MAX
+        anim_kill_counter = int(self._store.anim_kill[self._slot])
+        progress = anim_kill_counter / self._ANIM_KILL_MAX
         if self._red_fade:
             if progress < 0.5:
                 # Flash the box for a while.
-                if self._anim_kill_counter % 2 == 0:
+                if anim_kill_counter % 2 == 0:
                     return self._PINK
                 else:
                     return 0, 0, 100
@@ -295,9 +255,175 @@ class Tracklet:
             return core.lerp_color(self._color, self._BLACK, 0.5 + progress * 0.5)
 
 
+class TrackletStore:
+    """ The state of many tracklets, one row each, in preallocated arrays. Each row keeps a fixed-size ring of its
+    most recent frames, so a track that lives for a long time doesn't grow. The arrays double in size when they
+    are full, and the rows of dead tracklets are reused. """
+
+    FILTER_FACTOR = 0.5  # How much of the new frame's display box is kept when smoothing.
+
+    # The per-row arrays, and the shape of each row.
+    _FIELDS = {
+        "display": ((4,), np.int64),  # The smoothed display box: x, y, width, height.
+        "hits": ((), np.int32),
+        "misses": ((), np.int32),
+        "hit_limit": ((), np.int32),
+        "miss_limit": ((), np.int32),
+        "activated": ((), np.bool_),
+        "lost": ((), np.bool_),
+        "visual_state": ((), np.int8),
+        "anim_kill": ((), np.int32),
+        "frame_count": ((), np.int64),
+        "first_frame_index": ((), np.int64),
+        "last_frame_index": ((), np.int64),
+    }
+
+    def __init__(self, capacity: int = 64, history_size: int = 16):
+        self.history_size = history_size
+        self.capacity = 0
+        self._free = []
+        self.last_regions = []
+
+        for name, (shape, dtype) in self._FIELDS.items():
+            setattr(self, name, np.zeros((0,) + shape, dtype=dtype))
+        self.history_raw = np.zeros((0, history_size, 4), dtype=np.int64)  # Left, top, right, bottom.
+        self.history_display = np.zeros((0, history_size, 4), dtype=np.int64)  # X, y, width, height.
+        self.history_frame_index = np.zeros((0, history_size), dtype=np.int64)
+
+        self._grow(capacity)
+
+    # ======================================================================================================================
+    # Rows.
+    # ======================================================================================================================
+
+    def allocate(self, hit_limit: int, miss_limit: int) -> int:
+        if len(self._free) == 0:
+            self._grow(max(1, self.capacity * 2))
+
+        slot = self._free.pop()
+        for name, (shape, dtype) in self._FIELDS.items():
+            getattr(self, name)[slot] = 0
+        self.hit_limit[slot] = hit_limit
+        self.miss_limit[slot] = miss_limit
+        self.visual_state[slot] = VisualState.NORMAL.value
+        self.last_regions[slot] = None
+        return slot
+
+    def release(self, slots):
+        for slot in slots:
+            self.last_regions[slot] = None
+            self._free.append(int(slot))
+
+    def copy_row(self, slot: int, store: 'TrackletStore', other_slot: int):
+        for name in list(self._FIELDS) + ["history_raw", "history_display", "history_frame_index"]:
+            getattr(store, name)[other_slot] = getattr(self, name)[slot]
+        store.last_regions[other_slot] = self.last_regions[slot]
+
+    def _grow(self, extra: int):
+        for name in list(self._FIELDS) + ["history_raw", "history_display", "history_frame_index"]:
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros((extra,) + array.shape[1:], dtype=array.dtype)]))
+
+        self.last_regions.extend([None] * extra)
+        self._free.extend(range(self.capacity + extra - 1, self.capacity - 1, -1))
+        self.capacity += extra
+
+    # ======================================================================================================================
+    # Updates.
+    # ======================================================================================================================
+
+    def add(self, slots: np.array, track_frames: List[TrackFrame], register_hit: bool = True):
+        """ Add a new frame to each of the rows, smoothing the display box towards the new frame's. """
+        if len(slots) == 0:
+            return
+
+        frame_indexes = np.array([t.frame_index for t in track_frames], dtype=np.int64)
+        raw = np.array([(t.raw_region.left, t.raw_region.top, t.raw_region.right, t.raw_region.bottom)
+                        for t in track_frames], dtype=np.int64)
+        display = np.array([(t.x, t.y, t.width, t.height) for t in track_frames], dtype=np.float64)
+
+        has_previous = self.frame_count[slots] > 0
+        smoothed = np.trunc(display * self.FILTER_FACTOR + self.display[slots] * (1 - self.FILTER_FACTOR))
+        display = np.where(has_previous[:, np.newaxis], smoothed, display).astype(np.int64)
+        self.display[slots] = display
+
+        position = self.frame_count[slots] % self.history_size
+        self.history_raw[slots, position] = raw
+        self.history_display[slots, position] = display
+        self.history_frame_index[slots, position] = frame_indexes
+
+        self.first_frame_index[slots] = np.where(has_previous, self.first_frame_index[slots], frame_indexes)
+        self.last_frame_index[slots] = frame_indexes
+        self.frame_count[slots] += 1
+        for slot, track_frame in zip(slots.tolist(), track_frames):
+            self.last_regions[slot] = track_frame.raw_region
+
+        if register_hit:
+            self.register(slots, True)
+
+    def register(self, slots: np.array, hit: bool = True):
+        """ Register a hit or a miss for each row. A row that is already lost steps its kill animation instead. """
+        if len(slots) == 0:
+            return
+
+        lost = self.lost[slots]
+
+        # Step the kill animation.
+        killing = slots[lost]
+        self.anim_kill[killing] += 1
+        self.visual_state[killing[self.anim_kill[killing] >= Tracklet._ANIM_KILL_MAX]] = VisualState.KILLED.value
+
+        # Update the counters.
+        live = slots[~lost]
+        if hit:
+            self.hits[live] += 1
+            self.misses[live] = 0
+        else:
+            self.misses[live] += 1
+            self.hits[live] = 0
+
+        # Activate the rows with enough hits, and lose the rows with enough misses.
+        self.activated[live] |= self.hits[live] >= self.hit_limit[live]
+        newly_lost = live[self.misses[live] >= self.miss_limit[live]]
+        self.lost[newly_lost] = True
+
+        # If it has never been activated, kill it immediately.
+        self.visual_state[newly_lost[~self.activated[newly_lost]]] = VisualState.KILLED.value
+
+    # ======================================================================================================================
+    # Access.
+    # ======================================================================================================================
+
+    def dead_mask(self, slots: np.array) -> np.array:
+        """ The rows that are lost, and have finished their kill animation (or were never shown). """
+        displayable = self.activated[slots] & (self.visual_state[slots] != VisualState.KILLED.value)
+        return self.lost[slots] & ~displayable
+
+    def history(self, slot: int) -> List[TrackFrame]:
+        """ Create a TrackFrame for each of the frames in this row's history ring, oldest first. The newest frame
+        has the region that was actually added. """
+        count = int(self.frame_count[slot])
+        positions = [i % self.history_size for i in range(max(0, count - self.history_size), count)]
+
+        track_frames = []
+        for position in positions:
+            track_frame = TrackFrame()
+            track_frame.frame_index = int(self.history_frame_index[slot, position])
+            left, top, right, bottom = self.history_raw[slot, position].tolist()
+            track_frame.raw_region = TrackingRegion(left=left, right=right, top=top, bottom=bottom)
+            track_frame.x, track_frame.y, track_frame.width, track_frame.height = \
+                self.history_display[slot, position].tolist()
+            track_frames.append(track_frame)
+
+        if len(track_frames) > 0:
+            track_frames[-1].raw_region = self.last_regions[slot]
+        return track_frames
+
+
 class Tracker:
 
-    def __init__(self):
+    def __init__(self, history_size: int = 16):
+        self.store = TrackletStore(history_size=history_size)
         self.tracklets = []
 
     @abstractmethod
@@ -314,15 +440,43 @@ class Tracker:
             if tracklet.is_recent and tracklet.image is None and tracklet.is_live:
                 tracklet.image = visual.safe_extract_with_region(frame, tracklet.display_region)
 
+    def create_tracklet(self, **kwargs) -> Tracklet:
+        """ A new Tracklet, with its state in this tracker's store. """
+        return Tracklet(store=self.store, **kwargs)
+
+    def add_frames(self, tracklets: List[Tracklet], track_frames: List[TrackFrame]):
+        """ Add one frame to each of the tracklets (and register a hit), all at once. """
+        self.store.add(self._slots(tracklets), track_frames)
+
+    def register_misses(self, tracklets: List[Tracklet]):
+        self.store.register(self._slots(tracklets), hit=False)
+
+    def dead_mask(self) -> np.array:
+        return self.store.dead_mask(self._slots(self.tracklets))
+
     def remove_dead_tracklets(self) -> List[Tracklet]:
         """ Get rid of the tracklets that we don't need anymore. """
-        dead_tracklets = [t for t in self.tracklets if t.is_lost and not t.is_displayable]
-        self.tracklets = [t for t in self.tracklets if not t.is_lost or t.is_displayable]
-        return dead_tracklets
+        return self._remove_tracklets(self.dead_mask())
 
     def reset(self):
+        self.store = TrackletStore(history_size=self.store.history_size)
         self.tracklets = []
 
+    def _remove_tracklets(self, mask: np.array) -> List[Tracklet]:
+        """ Remove the masked tracklets. They keep their state, but no longer share this tracker's store. """
+        if not mask.any():
+            return []
+
+        dead_tracklets = [t for t, is_dead in zip(self.tracklets, mask) if is_dead]
+        self.tracklets = [t for t, is_dead in zip(self.tracklets, mask) if not is_dead]
+        for tracklet in dead_tracklets:
+            tracklet.detach()
+        return dead_tracklets
+
+    @staticmethod
+    def _slots(tracklets: List[Tracklet]) -> np.array:
+        return np.fromiter((t.slot for t in tracklets), dtype=np.int64, count=len(tracklets))
+
     @staticmethod
     def _convert_to_track_frames(regions: List[TrackingRegion], frame_index: int = 0,
                                  ratio_lock: float = 0.0, scale_factor: float = 1.0) -> List[TrackFrame]:
@@ -357,3 +511,11 @@ class Tracker:
     def tracklet_count(self):
         """ Returns the number of currently active tracklets. """
         return len(self.tracklets)
+
+
+def _box_to_region(x: int, y: int, width: int, height: int) -> TrackingRegion:
+    """ A region from an (x, y, width, height) box, with the same rounding as setting those on a Region. """
+    region = TrackingRegion()
+    region.set_rect(left=int(x - width / 2), right=int(x + width / 2),
+                    top=int(y - height / 2), bottom=int(y + height / 2))
+    return region
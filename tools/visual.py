@@ -9,6 +9,7 @@ import cv2
 import numpy as np
 import colorsys
 from .region import Region
+from . import text
 
 __author__ = "Jakrin Juangbhanich"
 __email__ = "juangbhanich.k@gmail.com"
@@ -51,21 +52,10 @@ def draw_regions(image: np.array,
                  thickness: int = 2,
                  overlay: bool = False,
                  strength: float = 1.0):
-    """ Draw a bounding box around each region area."""
-    overlay_image = np.zeros_like(image, np.uint8) if overlay else np.copy(image)
-
-    for i in range(len(regions)):
-        r = regions[i]
-        cv2.rectangle(overlay_image, (r.left, r.top), (r.right, r.bottom),
-                      color=color,
-                      thickness=thickness)
-
-    if overlay:
-        image = cv2.addWeighted(image, 1.0, overlay_image, strength, 0.0)
-    else:
-        image = cv2.addWeighted(image, 1.0 - strength, overlay_image, strength, 0.0)
-
-    return image
+    """ Draw a bounding box around each region area. This draws into the image (only around each box). """
+    compositor = Compositor()
+    compositor.add_rectangles(regions, color=color, thickness=thickness, opacity=strength, additive=overlay)
+    return compositor.draw(image)
 
 
 def pixelate_region(image: np.array, regions: List[Region], blur_factor: float = 0.1):
@@ -106,6 +96,130 @@ def draw_region_mask(image: np.array, regions: List[Region], strength: float = 1
     return image
 
 
+# ======================================================================================================================
+# Compositor.
+# ======================================================================================================================
+
+
+class Compositor:
+    """ Collects everything to be drawn on a frame (rectangles, bars, masks and text), then draws it all in one
+    pass. Each item is blended only inside its own bounding box, using a scratch buffer that is kept between
+    frames, so the cost depends on what is drawn and not on the size of the frame. """
+
+    RECTANGLE = "rectangle"
+    MASK = "mask"
+    TEXT = "text"
+
+    def __init__(self):
+        self.items = []
+        self._buffer = None
+
+    def clear(self):
+        self.items = []
+
+    def add_rectangle(self, left: int, top: int, right: int, bottom: int, color=(255, 255, 255),
+                      thickness: int = 2, opacity: float = 1.0, additive: bool = False):
+        """ A thickness of -1 fills the rectangle. Additive rectangles are added onto the image
+        (scaled by the opacity) instead of being blended over it. """
+        self.items.append((self.RECTANGLE, (left, top, right, bottom, color, thickness, opacity, additive)))
+
+    def add_rectangles(self, regions: List[Region], color=(255, 255, 255), thickness: int = 2,
+                       opacity: float = 1.0, additive: bool = False):
+        for r in regions:
+            self.add_rectangle(r.left, r.top, r.right, r.bottom, color, thickness, opacity, additive)
+
+    def add_fill(self, region: Region, color=(0, 0, 0), opacity: float = 1.0):
+        self.add_rectangle(region.left, region.top, region.right, region.bottom, color, -1, opacity)
+
+    def add_bar(self, progress: float, x: int, y: int, width: int, height: int,
+                frame_color=(0, 0, 0), bar_color=(0, 150, 255)):
+        """ The same bar as draw_bar. """
+        for p_start, p_end, color in ((0.0, 1.0, frame_color), (0.0, progress, bar_color)):
+            p_width = int(width * max(0.05, p_end - p_start))
+            p_x = int(x + p_start * width)
+            self.add_rectangle(p_x, y, p_x + p_width, y + height, color, thickness=-1)
+
+    def add_mask(self, mask: np.array, left: int, top: int, color=(255, 255, 255), opacity: float = 1.0):
+        """ Blend the color into the image through a 2D mask (bool, or uint8 from 0 to 255) placed at left, top. """
+        self.items.append((self.MASK, (mask, left, top, color, opacity)))
+
+    def add_label(self, label: str, region: Region, **kwargs):
+        """ Same as text.label_region. """
+        self.items.append((self.TEXT, (text.label_region, label, region, kwargs)))
+
+    def add_text_box(self, label: str, region: Region, **kwargs):
+        """ Same as text.write_into_region. """
+        self.items.append((self.TEXT, (text.write_into_region, label, region, kwargs)))
+
+    def draw(self, image: np.array) -> np.array:
+        """ Draw all the items (in the order they were added) into the image, and clear them. """
+        for kind, params in self.items:
+            if kind == self.RECTANGLE:
+                self._draw_rectangle(image, *params)
+            elif kind == self.MASK:
+                self._draw_mask(image, *params)
+            else:
+                draw_function, label, region, kwargs = params
+                image = draw_function(image, label, region, **kwargs)
+
+        self.clear()
+        return image
+
+    def _scratch(self, image: np.array, top: int, bottom: int, left: int, right: int) -> np.array:
+        """ The scratch buffer area for this ROI. The buffer is only re-allocated when the frame size changes. """
+        if self._buffer is None or self._buffer.shape != image.shape or self._buffer.dtype != image.dtype:
+            self._buffer = np.empty_like(image)
+        return self._buffer[top:bottom, left:right]
+
+    def _draw_rectangle(self, image: np.array, left: int, top: int, right: int, bottom: int, color,
+                        thickness: int, opacity: float, additive: bool):
+        if opacity <= 0.0:
+            return
+
+        # The bounding box of the rectangle, including the stroke.
+        left, right = min(left, right), max(left, right)
+        top, bottom = min(top, bottom), max(top, bottom)
+        stroke = max(0, thickness)
+        x0, x1, _, _ = _get_safe_bounds(left - stroke, right + stroke + 1, image.shape[1])
+        y0, y1, _, _ = _get_safe_bounds(top - stroke, bottom + stroke + 1, image.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        roi = image[y0:y1, x0:x1]
+        corners = ((left - x0, top - y0), (right - x0, bottom - y0))
+
+        if opacity >= 1.0 and not additive:
+            cv2.rectangle(roi, corners[0], corners[1], color=color, thickness=thickness)
+            return
+
+        buffer = self._scratch(image, y0, y1, x0, x1)
+        if additive:
+            buffer[:] = 0
+            cv2.rectangle(buffer, corners[0], corners[1], color=color, thickness=thickness)
+            cv2.addWeighted(roi, 1.0, buffer, opacity, 0.0, dst=roi)
+        else:
+            buffer[:] = roi
+            cv2.rectangle(buffer, corners[0], corners[1], color=color, thickness=thickness)
+            cv2.addWeighted(roi, 1.0 - opacity, buffer, opacity, 0.0, dst=roi)
+
+    @staticmethod
+    def _draw_mask(image: np.array, mask: np.array, left: int, top: int, color, opacity: float):
+        right = left + mask.shape[1]
+        bottom = top + mask.shape[0]
+        x0, x1, left_excess, _ = _get_safe_bounds(left, right, image.shape[1])
+        y0, y1, top_excess, _ = _get_safe_bounds(top, bottom, image.shape[0])
+        if x0 >= x1 or y0 >= y1 or opacity <= 0.0:
+            return
+
+        mask = mask[top_excess:top_excess + y1 - y0, left_excess:left_excess + x1 - x0]
+        alpha = mask.astype(np.float32)
+        alpha *= opacity / 255.0 if mask.dtype != np.bool_ else opacity
+        alpha = alpha[:, :, np.newaxis]
+
+        roi = image[y0:y1, x0:x1]
+        roi[:] = roi * (1.0 - alpha) + np.array(color, dtype=np.float32) * alpha + 0.5
+
+
 # ======================================================================================================================
 # Progress (or custom) Bars.
 # ======================================================================================================================